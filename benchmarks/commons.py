@@ -0,0 +1,34 @@
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from hypothesis.factory import create_app
+from hypothesis.settings import Configuration
+
+DATABASE = 'hypothesis_benchmark'
+
+
+def create_database():
+    """Create the benchmarks database if needed and return its URI"""
+    url = make_url(Configuration.SQLALCHEMY_DATABASE_URI)
+    engine = create_engine(
+        url.set(database='postgres'), isolation_level='AUTOCOMMIT'
+    )
+    exists = engine.execute(
+        'SELECT 1 FROM pg_database WHERE datname = %s', DATABASE
+    ).first()
+    if not exists:
+        engine.execute(f'CREATE DATABASE {DATABASE}')
+    engine.dispose()
+    return str(url.set(database=DATABASE))
+
+
+def create_benchmark_app(settings_override={}):
+    # pylint: disable=dangerous-default-value
+    return create_app(
+        {'SQLALCHEMY_DATABASE_URI': create_database(), **settings_override}
+    )
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,107 @@
+"""
+Serialization of list pages through the ORM and marshmallow compared to
+selected columns and RowEncoder.
+
+Both paths run the query and build the JSON response for pages of 20, 200
+and 2000 transactions, and must produce the same bytes.
+
+    python -m benchmarks.serializers --repeat 50
+
+It needs the same environment variables as the application (.env) and
+uses its own database, so real data is never touched.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from flask import jsonify
+from sqlalchemy import insert
+
+from benchmarks.commons import create_benchmark_app, percentile
+from hypothesis.encoders import RowEncoder
+from hypothesis.factory import db
+from hypothesis.models import Customer, Transaction
+from hypothesis.schemas import TransactionSchema
+
+PAGE_SIZES = (20, 200, 2000)
+
+
+def create_transactions(count):
+    db.drop_all()
+    db.create_all()
+    db.session.add_all(
+        [Customer(name='source', balance=0), Customer(name='target')]
+    )
+    db.session.flush()
+
+    start = datetime(2025, 1, 1)
+    db.session.execute(
+        insert(Transaction.__table__),
+        [
+            {
+                'datetime': start + timedelta(minutes=i),
+                'customer_source': 1,
+                'customer_target': 2,
+                'value': 10.5,
+                'customer_source_value': -10.5 * (i + 1),
+                'customer_target_value': 10.5 * (i + 1),
+            }
+            for i in range(count)
+        ],
+    )
+    db.session.commit()
+
+
+def orm_page(schema, size):
+    query = Transaction.query.order_by(Transaction._id).limit(size)
+    return jsonify([schema.dump(obj) for obj in query]).get_data()
+
+
+def rows_page(encoder, size):
+    query = (
+        Transaction.query.with_entities(*encoder.columns)
+        .order_by(Transaction._id)
+        .limit(size)
+    )
+    return jsonify([encoder(row) for row in query]).get_data()
+
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+        # Each request starts with an empty identity map
+        db.session.remove()
+    return percentile(timings, 0.5) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    schema = TransactionSchema()
+    encoder = RowEncoder(schema, Transaction)
+
+    with app.test_request_context():
+        create_transactions(max(PAGE_SIZES))
+
+        print(f'{"rows":>6} {"orm (ms)":>10} {"rows (ms)":>10} {"speedup":>8}')
+        for size in PAGE_SIZES:
+            if orm_page(schema, size) != rows_page(encoder, size):
+                raise SystemExit(f'Responses differ for {size} rows')
+
+            orm = measure(
+                lambda size=size: orm_page(schema, size), args.repeat
+            )
+            rows = measure(
+                lambda size=size: rows_page(encoder, size), args.repeat
+            )
+            print(f'{size:>6} {orm:>10.2f} {rows:>10.2f} {orm / rows:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
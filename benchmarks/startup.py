@@ -0,0 +1,119 @@
+"""
+Cold start of a worker, with flasgger and with the spec file.
+
+Each run is a new interpreter importing hypothesis as gunicorn does, then
+answering its first GET /customers/ and GET /apispec_1.json. Times are in
+milliseconds: process is the interpreter start, import the modules and
+the application, and rss the memory of the process once imported. The
+spec file is written beforehand, or by the first request when missing.
+
+    python -m benchmarks.startup --repeat 10
+
+It needs the same environment variables as the application (.env) and
+uses its own database, so real data is never touched.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.commons import create_benchmark_app, percentile
+from hypothesis.extensions import write_api_spec
+from hypothesis.factory import db
+
+WORKER = '''
+import json
+import resource
+import sys
+import time
+
+started = time.time()
+import hypothesis
+
+imported = time.time()
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Read by flask_sqlalchemy on the first connection
+hypothesis.app.config['SQLALCHEMY_DATABASE_URI'] = sys.argv[1]
+client = hypothesis.app.test_client()
+assert client.get('/customers/').status_code == 200
+answered = time.time()
+assert client.get('/apispec_1.json').status_code == 200
+print(json.dumps([started, imported, answered, time.time(), rss]))
+'''
+
+
+def start_worker(uri, spec_file):
+    env = {**os.environ, 'API_SPEC_FILE': spec_file}
+    launched = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', WORKER, uri],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    started, imported, answered, specified, rss = json.loads(
+        output.splitlines()[-1]
+    )
+    return {
+        'process': (started - launched) * 1000,
+        'import': (imported - started) * 1000,
+        'request': (answered - imported) * 1000,
+        'spec': (specified - answered) * 1000,
+        # Kilobytes on Linux
+        'rss': rss / 1024,
+    }
+
+
+def measure(uri, spec_file, repeat, prepare):
+    runs = []
+    for _ in range(repeat):
+        prepare()
+        runs.append(start_worker(uri, spec_file))
+    return {
+        name: percentile([run[name] for run in runs], 0.5) for name in runs[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    with tempfile.TemporaryDirectory() as directory:
+        spec_file = os.path.join(directory, 'apispec.json')
+
+        def remove_spec():
+            if os.path.exists(spec_file):
+                os.remove(spec_file)
+
+        modes = [
+            ('flasgger', '', lambda: None),
+            ('spec file', spec_file, lambda: write_api_spec(app, spec_file)),
+            ('spec built', spec_file, remove_spec),
+        ]
+        print(
+            f'{"mode":<10} {"process":>8} {"import":>8} {"request":>8}'
+            f' {"spec":>8} {"rss (MB)":>9}'
+        )
+        for name, path, prepare in modes:
+            times = measure(uri, path, args.repeat, prepare)
+            print(
+                f'{name:<10} {times["process"]:>8.1f}'
+                f' {times["import"]:>8.1f} {times["request"]:>8.1f}'
+                f' {times["spec"]:>8.1f} {times["rss"]:>9.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Sustained transfers per second on a single hot account.
+
+Every client keeps posting transfers to and from the same customer through
+the application, at the end balances are checked against the transactions
+stored to make sure no update was lost.
+
+    python -m benchmarks.transfers --clients 64 --seconds 30
+    python -m benchmarks.transfers --clients 64 --mode ledger
+    python -m benchmarks.transfers --clients 64 --slots 8
+    python -m benchmarks.transfers --clients 16 --slots 8 --latency 1
+    python -m benchmarks.transfers --clients 64 --group-commit
+
+In ledger mode a compaction runs alongside the clients, as the background
+job would, and the rest of the ledger is compacted before checking. With
+--slots the hot account is sharded in that many balance slots first. With
+--latency (ms) every statement and commit waits that long before being
+sent, so rows stay locked as long as they would with the database over
+the network. On a single host the clients and Postgres share the CPUs,
+which bound transfers before the hot row lock does and hide the gain of
+--slots. With
+--group-commit transfers go through the group commit writer, see
+hypothesis.group_commit, with --group-size and --group-wait (ms).
+
+It needs the same environment variables as the application (.env) and
+uses its own database, so real data is never touched.
+"""
+import argparse
+import threading
+import time
+from decimal import Decimal
+
+from sqlalchemy import event, func
+
+from benchmarks.commons import create_benchmark_app, percentile
+from hypothesis.factory import db
+from hypothesis.ledger import compact_ledger
+from hypothesis.models import Customer, Transaction
+from hypothesis.slots import reshard
+
+INITIAL_BALANCE = Decimal('1000000')
+
+
+def create_customers(clients, slots):
+    db.drop_all()
+    db.create_all()
+    hot = Customer(name='hot-account', balance=INITIAL_BALANCE)
+    others = [
+        Customer(name=f'client-{i}', balance=INITIAL_BALANCE)
+        for i in range(clients)
+    ]
+    db.session.add_all([hot, *others])
+    db.session.commit()
+    if slots:
+        reshard(db.session, hot._id, slots)
+        db.session.commit()
+    return hot._id, [other._id for other in others]
+
+
+def add_latency(engine, seconds):
+    """Wait before every statement and commit of the engine"""
+
+    def wait(*args):
+        time.sleep(seconds)
+
+    event.listen(engine, 'before_cursor_execute', wait)
+    event.listen(engine, 'commit', wait)
+
+
+def run_client(app, hot_id, other_id, deadline, results):
+    client = app.test_client()
+    latencies, statuses = [], {}
+    iteration = 0
+    while time.monotonic() < deadline:
+        if iteration % 2:
+            payload = {'customer_source': hot_id, 'customer_target': other_id}
+        else:
+            payload = {'customer_source': other_id, 'customer_target': hot_id}
+        payload['value'] = 1
+
+        started = time.monotonic()
+        response = client.post('/transactions/', json=payload)
+        latencies.append(time.monotonic() - started)
+        statuses[response.status_code] = (
+            statuses.get(response.status_code, 0) + 1
+        )
+        iteration += 1
+    results.append((latencies, statuses))
+
+
+def run_compaction(app, deadline, applied):
+    with app.app_context():
+        while time.monotonic() < deadline:
+            count = compact_ledger(
+                db.session, app.config['LEDGER_COMPACT_SIZE']
+            )
+            db.session.commit()
+            applied.append(count)
+            if not count:
+                time.sleep(0.1)
+
+
+def check_drift(clients, hot_id):
+    total = db.session.query(func.sum(Customer.ledger_balance)).scalar()
+    expected_total = INITIAL_BALANCE * (clients + 1)
+
+    hot = Customer.query.get(hot_id)
+    received = db.session.query(
+        func.coalesce(func.sum(Transaction.value), 0)
+    ).filter(Transaction.customer_target == hot_id)
+    paid = db.session.query(
+        func.coalesce(func.sum(Transaction.value), 0)
+    ).filter(Transaction.customer_source == hot_id)
+    expected_hot = INITIAL_BALANCE + received.scalar() - paid.scalar()
+
+    return total - expected_total, hot.ledger_balance - expected_hot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument(
+        '--mode', choices=['balance', 'ledger'], default='balance'
+    )
+    parser.add_argument('--slots', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--group-commit', action='store_true')
+    parser.add_argument('--group-size', type=int, default=100)
+    parser.add_argument('--group-wait', type=float, default=2)
+    args = parser.parse_args()
+
+    app = create_benchmark_app(
+        {
+            'ACCOUNTING_MODE': args.mode,
+            'GROUP_COMMIT': args.group_commit,
+            'GROUP_COMMIT_SIZE': args.group_size,
+            'GROUP_COMMIT_WAIT_MS': args.group_wait,
+            'SQLALCHEMY_ENGINE_OPTIONS': {
+                'pool_size': args.clients + 2,
+                'max_overflow': 0,
+            },
+        }
+    )
+
+    with app.app_context():
+        hot_id, other_ids = create_customers(args.clients, args.slots)
+        if args.latency:
+            add_latency(db.engine, args.latency / 1000)
+
+    results = []
+    deadline = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(
+            target=run_client, args=(app, hot_id, other_id, deadline, results)
+        )
+        for other_id in other_ids
+    ]
+    compacted = []
+    if args.mode == 'ledger':
+        threads.append(
+            threading.Thread(
+                target=run_compaction, args=(app, deadline, compacted)
+            )
+        )
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies = [
+        latency
+        for client_latencies, _ in results
+        for latency in client_latencies
+    ]
+    statuses = {}
+    for _, client_statuses in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+    with app.app_context():
+        while compact_ledger(db.session, app.config['LEDGER_COMPACT_SIZE']):
+            db.session.commit()
+        total_drift, hot_drift = check_drift(args.clients, hot_id)
+
+    print(f'mode:              {args.mode}')
+    print(f'slots:             {args.slots}')
+    print(f'latency:           {args.latency}ms')
+    if args.group_commit:
+        print(
+            f'group commit:      {args.group_size} transfers'
+            f' or {args.group_wait}ms'
+        )
+    print(f'clients:           {args.clients}')
+    print(f'requests:          {len(latencies)} in {elapsed:.1f}s')
+    print(f'transfers/sec:     {statuses.get(201, 0) / elapsed:.1f}')
+    print(f'statuses:          {dict(sorted(statuses.items()))}')
+    print(f'latency p50:       {percentile(latencies, 0.50) * 1000:.1f}ms')
+    print(f'latency p99:       {percentile(latencies, 0.99) * 1000:.1f}ms')
+    if args.mode == 'ledger':
+        print(f'entries compacted: {sum(compacted)} while running')
+    print(f'total drift:       {total_drift}')
+    print(f'hot account drift: {hot_drift}')
+
+    if total_drift or hot_drift:
+        raise SystemExit('Balances drifted from the stored transactions')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,37 @@
 # https://pythonspeed.com/articles/gunicorn-in-docker/
 
+import gc
 import multiprocessing
+import os
+import shutil
+
+import decouple
 
 # http://docs.gunicorn.org/en/latest/design.html#how-many-workers
+# Database pools are sized from these in hypothesis.settings, keep the
+# defaults in sync. Names of this module are gunicorn settings, decouple's
+# config included.
 cpus = multiprocessing.cpu_count()
-WORKERS = (2 * cpus) + 1
-THREADS = WORKERS * 2
+WORKERS = decouple.config('WEB_WORKERS', default=(2 * cpus) + 1, cast=int)
+THREADS = decouple.config('WEB_THREADS', default=4, cast=int)
+
+# Workers write their Prometheus metrics in this directory, GET /metrics adds
+# them up. It must be set before the application is imported.
+METRICS_DIR = decouple.config(
+    'PROMETHEUS_MULTIPROC_DIR', default='/dev/shm/hypothesis-metrics'
+)
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = METRICS_DIR
+# The preloaded application writes its metrics files there when imported
+os.makedirs(METRICS_DIR, exist_ok=True)
 
 # Gunicorn configuration file.
 
+
 def get_timeout():
     # Below you could configure through decouple e.g.
     return 60
 
+
 #
 # Server socket
 #
@@ -83,6 +102,11 @@ threads = THREADS
 
 worker_connections = 1000
 
+# The master imports the application once and workers start from a copy of
+# it, sharing its memory until they write to it. Code changes need a
+# restart then, HUP only restarts the workers.
+preload_app = decouple.config('WEB_PRELOAD', default=True, cast=bool)
+
 timeout = get_timeout()
 keepalive = 5
 
@@ -155,9 +179,12 @@ tmp_upload_dir = None
 #
 
 errorlog = '-'
-loglevel = 'debug'
+loglevel = 'info'
 accesslog = '-'
-access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+# %(D)s is the time taken to answer, in microseconds
+access_log_format = (
+    '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
+)
 
 #
 # Process naming
@@ -191,21 +218,83 @@ proc_name = None
 #
 #       A callable that takes a server instance as the sole argument.
 #
+#   on_starting - Called just before the master process is initialized.
+#
+#       A callable that takes a server instance as the sole argument.
+#
+#   child_exit - Called just after a worker has been exited, in the
+#       master process.
+#
+#       A callable that takes a server and worker instance
+#       as arguments.
+#
+
+
+def on_starting(server):
+    # Metrics of a previous run would be added to the new ones
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
 
 def post_fork(server, worker):
+    # pylint: disable=import-outside-toplevel
+    from hypothesis.logs import queue_logger
+    from hypothesis.settings import Configuration
+
     server.log.info("Worker spawned (pid: %s)", worker.pid)
+    # Request threads only queue their access log lines, a thread of the
+    # worker writes them
+    queue_logger(
+        worker.log.access_log,
+        Configuration.LOG_QUEUE_SIZE,
+        Configuration.LOG_BATCH_SIZE,
+    )
+
+
+def post_worker_init(worker):
+    # pylint: disable=import-outside-toplevel
+    from hypothesis.customer_ids import get_customer_filter
+
+    # Customers identifiers are loaded before the first transfer
+    get_customer_filter(worker.wsgi)
+
+
+def child_exit(server, worker):
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+
+    # Gauges of the requests and connections in use by the worker are gone
+    # with it, its counters and histograms keep adding up
+    multiprocess.mark_process_dead(worker.pid)
+
 
 def pre_fork(server, worker):
-    pass
+    # Objects of the preloaded application are kept out of the garbage
+    # collections of the workers, which would write to every one of them
+    # and copy the memory pages they share
+    if preload_app:
+        gc.freeze()
+
 
 def pre_exec(server):
     server.log.info("Forked child, re-executing.")
 
+
 def when_ready(server):
     server.log.info("Server is ready. Spawning workers")
 
+
 def worker_int(worker):
+    # pylint: disable=import-outside-toplevel
+    from hypothesis.logs import stop_logging
+
     worker.log.info("worker received INT or QUIT signal")
+    stop_logging()
+
 
 def worker_abort(worker):
+    # pylint: disable=import-outside-toplevel
+    from hypothesis.logs import stop_logging
+
     worker.log.info("worker received SIGABRT signal")
+    stop_logging()
@@ -1,6 +1,11 @@
-from flask_migrate import Migrate
+import os
 
 from hypothesis.factory import create_app, db
 
 app = create_app()
-migrate = Migrate(app, db)
+
+# Only flask db needs it, alembic takes long to import
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+
+    migrate = Migrate(app, db)
@@ -0,0 +1,115 @@
+from sqlalchemy import text
+
+# Change of the balance of customer c by its transactions within bounds,
+# only run when needed
+MOVES = '''
+    SELECT coalesce(sum(amount), 0) AS amount FROM (
+        SELECT -value AS amount FROM transaction
+        WHERE customer_source = c.id AND {bounds}
+        UNION ALL
+        SELECT value FROM transaction
+        WHERE customer_target = c.id AND {bounds}
+    ) moves
+    WHERE {needed}
+'''
+
+# The latest transaction at or before :at storing the balance of a customer
+# after it, plus the transactions after it until :at, which don't store
+# theirs (sharded customers, ledger entries not compacted yet). Failing
+# that, the earliest one after :at storing the balance before it, less the
+# transactions in between, and failing that the current balance (with the
+# ledger entries not compacted yet) less the transactions after :at. Each
+# side of the transfer is a single descent on its covering index, plus a
+# range of it for the transactions without balances.
+BALANCES_AT = '''
+    SELECT c.id, coalesce(
+        latest.balance + since.amount,
+        earliest.balance - until.amount,
+        c.balance + (
+            SELECT coalesce(sum(s.balance), 0) FROM customer_balance_slot s
+            WHERE s.customer_id = c.id
+        ) + (
+            SELECT coalesce(sum(l.amount), 0) FROM ledger_entry l
+            WHERE l.customer_id = c.id
+        ) - later.amount
+    )
+    FROM customer c
+    LEFT JOIN LATERAL (
+        SELECT datetime, id, balance FROM (
+            (
+                SELECT datetime, id, customer_source_value AS balance
+                FROM transaction
+                WHERE customer_source = c.id AND datetime <= :at
+                    AND customer_source_value IS NOT NULL
+                ORDER BY datetime DESC, id DESC
+                LIMIT 1
+            )
+            UNION ALL
+            (
+                SELECT datetime, id, customer_target_value
+                FROM transaction
+                WHERE customer_target = c.id AND datetime <= :at
+                    AND customer_target_value IS NOT NULL
+                ORDER BY datetime DESC, id DESC
+                LIMIT 1
+            )
+        ) sides
+        ORDER BY datetime DESC, id DESC
+        LIMIT 1
+    ) latest ON true
+    LEFT JOIN LATERAL (
+        SELECT datetime, id, balance FROM (
+            (
+                SELECT datetime, id, customer_source_value + value AS balance
+                FROM transaction
+                WHERE customer_source = c.id AND datetime > :at
+                    AND customer_source_value IS NOT NULL
+                ORDER BY datetime, id
+                LIMIT 1
+            )
+            UNION ALL
+            (
+                SELECT datetime, id, customer_target_value - value
+                FROM transaction
+                WHERE customer_target = c.id AND datetime > :at
+                    AND customer_target_value IS NOT NULL
+                ORDER BY datetime, id
+                LIMIT 1
+            )
+        ) sides
+        WHERE latest.balance IS NULL
+        ORDER BY datetime, id
+        LIMIT 1
+    ) earliest ON true
+    CROSS JOIN LATERAL ({since}) since
+    CROSS JOIN LATERAL ({until}) until
+    CROSS JOIN LATERAL ({later}) later
+    WHERE c.id = ANY(:ids)
+'''.format(
+    since=MOVES.format(
+        bounds='datetime >= latest.datetime AND datetime <= :at '
+        'AND (datetime, id) > (latest.datetime, latest.id)',
+        needed='latest.balance IS NOT NULL',
+    ),
+    until=MOVES.format(
+        bounds='datetime > :at AND datetime <= earliest.datetime '
+        'AND (datetime, id) < (earliest.datetime, earliest.id)',
+        needed='earliest.balance IS NOT NULL',
+    ),
+    later=MOVES.format(
+        bounds='datetime > :at',
+        needed='latest.balance IS NULL AND earliest.balance IS NULL',
+    ),
+)
+
+
+def balances_at(session, customer_ids, at):
+    """
+    Return the balances of the customers found right after the transactions
+    made until ``at``, by identifier, from the running balances stored by
+    the transactions.
+    """
+    rows = session.execute(
+        text(BALANCES_AT), {'ids': list(customer_ids), 'at': at}
+    )
+    return dict(rows.all())
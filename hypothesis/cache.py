@@ -0,0 +1,443 @@
+"""
+Cache of GET /customers/?id= responses shared by the workers of a host.
+
+With CUSTOMER_CACHE_SIZE set, responses are kept in CUSTOMER_CACHE_PATH, a
+file in /dev/shm mapped in memory by every worker, under their normalized
+query string. Entries are spread on sets of WAYS slots by the hash of
+their key and the least recently used one of a set is evicted to make
+room, so the cache never holds more than CUSTOMER_CACHE_SIZE responses.
+
+Writes changing customers drop them with invalidate_customers: in the
+cache of the host once committed, and on every host by a notification
+sent in the same database transaction. One worker per host listens to
+those, holding the listener lock, and keeps a heartbeat in the cache
+while a notification it sends to itself keeps coming back. Without a
+recent one notifications may have been missed and the cache is bypassed,
+the listener empties it when it starts. Behind PgBouncer, which doesn't
+deliver notifications, the listener connects to DB_LISTEN_HOST and the
+cache is disabled without it.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import select
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from hypothesis.factory import db
+from hypothesis.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'customer_cache'
+# Customers by notification, their payload is limited to 8000 bytes
+NOTIFY_MAX_IDS = 500
+NOTIFY = text(
+    'SELECT pg_notify(:channel, payload) '
+    'FROM unnest(CAST(:payloads AS text[])) AS payload'
+)
+PENDING = 'customer_cache_pending'
+
+WAYS = 8
+SLOT_SIZE = 512
+# Seconds between heartbeats of the listener, the cache is bypassed when
+# the last one is older than STALE_AFTER
+HEARTBEAT = 1
+STALE_AFTER = 3 * HEARTBEAT
+
+MAGIC = b'HYC1'
+# Magic, sets, ways, slot size, LRU clock, heartbeat, epoch
+HEADER = struct.Struct('<4sIIIQdQ')
+HEADER_SIZE = 64
+# Version of a set, bumped by every invalidation of its keys
+VERSION = struct.Struct('<Q')
+# Key hash, last use, key length, value length
+SLOT = struct.Struct('<QQII')
+
+_lock = threading.Lock()
+
+
+def customer_key(customer_id):
+    """Cache key of the GET /customers/ lookup of a customer by id"""
+    return f'/customers/?id={customer_id}'
+
+
+def digest(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+
+class SharedCache:
+    """
+    Least recently used values by key in a file mapped in memory, shared
+    by the processes opening it and the threads of each.
+
+    get returns a token with the value. A value read elsewhere after a miss
+    is only put back with that token if no invalidation of its key, nor
+    clear, happened meanwhile, it could be outdated otherwise.
+    """
+
+    def __init__(self, path, size, slot_size=SLOT_SIZE):
+        self.path = path
+        self.sets = max(-(-size // WAYS), 1)
+        self.slot_size = slot_size
+        self.slots_offset = HEADER_SIZE + self.sets * VERSION.size
+        self.length = self.slots_offset + self.sets * WAYS * slot_size
+        self.thread_lock = threading.Lock()
+        self.fd = self.map = self.pid = None
+
+    def open(self):
+        # Locks are shared with the processes forked after opening the
+        # file, each one maps it again
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Replaced by another process while waiting for the lock
+            if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                break
+            os.close(fd)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            expected = (MAGIC, self.sets, WAYS, self.slot_size)
+            if (
+                len(header) < HEADER.size
+                or HEADER.unpack(header)[:4] != expected
+            ):
+                fd = self.create(fd)
+            self.map = mmap.mmap(fd, self.length)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self.fd, self.pid = fd, os.getpid()
+
+    def create(self, fd):
+        """
+        Write an empty cache in a new file replacing the one of fd, which is
+        still mapped by processes sized differently.
+        """
+        partial = f'{self.path}.{os.getpid()}'
+        new_fd = os.open(partial, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        fcntl.flock(new_fd, fcntl.LOCK_EX)
+        os.ftruncate(new_fd, self.length)
+        os.pwrite(
+            new_fd,
+            HEADER.pack(MAGIC, self.sets, WAYS, self.slot_size, 0, 0, 0),
+            0,
+        )
+        os.replace(partial, self.path)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        return new_fd
+
+    @contextmanager
+    def locked(self):
+        """Lock the cache against the threads and the other processes"""
+        with self.thread_lock:
+            if self.pid != os.getpid():
+                self.open()
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def read_header(self):
+        return list(HEADER.unpack_from(self.map, 0))
+
+    def write_header(self, header):
+        HEADER.pack_into(self.map, 0, *header)
+
+    def slot_offsets(self, index):
+        start = self.slots_offset + index * WAYS * self.slot_size
+        return range(start, start + WAYS * self.slot_size, self.slot_size)
+
+    def find(self, index, key, hashed):
+        for offset in self.slot_offsets(index):
+            slot = SLOT.unpack_from(self.map, offset)
+            if slot[0] != hashed or slot[2] != len(key):
+                continue
+            start = offset + SLOT.size
+            if self.map[start : start + len(key)] == key:
+                return offset, slot
+        return None, None
+
+    def get_token(self, header, index):
+        version = VERSION.unpack_from(
+            self.map, HEADER_SIZE + index * VERSION.size
+        )[0]
+        return header[6], version
+
+    def get(self, key):
+        """
+        (value, token) of a key, value None when missing and token None
+        when the cache can't be used.
+        """
+        key = key.encode()
+        hashed = digest(key)
+        index = hashed % self.sets
+        with self.locked():
+            header = self.read_header()
+            if time.time() - header[5] > STALE_AFTER:
+                CACHE_MISSES.inc()
+                return None, None
+            token = self.get_token(header, index)
+            offset, slot = self.find(index, key, hashed)
+            if offset is not None:
+                header[4] += 1
+                self.write_header(header)
+                SLOT.pack_into(self.map, offset, slot[0], header[4], *slot[2:])
+                start = offset + SLOT.size + slot[2]
+                value = self.map[start : start + slot[3]]
+        if offset is None:
+            CACHE_MISSES.inc()
+            return None, token
+        CACHE_HITS.inc()
+        return value, token
+
+    def put(self, key, value, token):
+        """Store the value of a key, return whether it was"""
+        key = key.encode()
+        if token is None or SLOT.size + len(key) + len(value) > self.slot_size:
+            return False
+        hashed = digest(key)
+        index = hashed % self.sets
+        evicted = False
+        with self.locked():
+            header = self.read_header()
+            if self.get_token(header, index) != token:
+                return False
+            offset, _ = self.find(index, key, hashed)
+            if offset is None:
+                # Empty slots have never been used or were invalidated
+                offset = min(
+                    self.slot_offsets(index),
+                    key=lambda offset: SLOT.unpack_from(self.map, offset)[1:3],
+                )
+                evicted = SLOT.unpack_from(self.map, offset)[2] != 0
+            header[4] += 1
+            self.write_header(header)
+            SLOT.pack_into(
+                self.map, offset, hashed, header[4], len(key), len(value)
+            )
+            start = offset + SLOT.size
+            self.map[start : start + len(key) + len(value)] = key + value
+        if evicted:
+            CACHE_EVICTIONS.inc()
+        return True
+
+    def invalidate(self, keys):
+        """Drop the keys, and values read before to be put back"""
+        with self.locked():
+            for key in keys:
+                key = key.encode()
+                hashed = digest(key)
+                index = hashed % self.sets
+                position = HEADER_SIZE + index * VERSION.size
+                version = VERSION.unpack_from(self.map, position)[0]
+                VERSION.pack_into(self.map, position, version + 1)
+                offset, _ = self.find(index, key, hashed)
+                if offset is not None:
+                    SLOT.pack_into(self.map, offset, 0, 0, 0, 0)
+
+    def clear(self):
+        """Drop every key, and values read before to be put back"""
+        with self.locked():
+            header = self.read_header()
+            header[6] += 1
+            self.write_header(header)
+            self.map[self.slots_offset : self.length] = bytes(
+                self.length - self.slots_offset
+            )
+
+    def beat(self):
+        """Tell readers the cache is kept up to date"""
+        with self.locked():
+            header = self.read_header()
+            header[5] = time.time()
+            self.write_header(header)
+
+
+def listener_url(app):
+    """
+    URL of the primary database for the connections listening to
+    notifications, DB_LISTEN_HOST when set. None behind PgBouncer without
+    it, as notifications would never get through.
+    """
+    with app.app_context():
+        url = db.get_engine(app).url
+    if not app.config['DB_LISTEN_HOST']:
+        return None if app.config['DB_PGBOUNCER'] else url
+    host, _, port = app.config['DB_LISTEN_HOST'].partition(':')
+    return url.set(host=host, port=int(port) if port else None)
+
+
+def connect_listener(app):
+    """
+    Connection of its own to the primary database, outside of the pool, in
+    autocommit mode to get notifications as soon as they are sent.
+    """
+    with app.app_context():
+        engine = db.get_engine(app)
+    args, kwargs = engine.dialect.create_connect_args(listener_url(app))
+    connection = engine.dialect.dbapi.connect(*args, **kwargs)
+    connection.autocommit = True
+    return connection
+
+
+class CacheListener:
+    """
+    Thread of each worker waiting for the listener lock of the cache. The
+    one holding it listens to the invalidations of every host.
+    """
+
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        # Threads don't survive a fork, each worker starts its own
+        if self.pid == os.getpid():
+            return
+        with _lock:
+            if self.pid != os.getpid():
+                self.thread = threading.Thread(
+                    target=self.run, name='cache-listener', daemon=True
+                )
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        fd = os.open(f'{self.cache.path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(HEARTBEAT)
+        while True:
+            try:
+                self.listen()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning(
+                    'Customer cache invalidations lost', exc_info=True
+                )
+                time.sleep(HEARTBEAT)
+
+    def listen(self):
+        connection = connect_listener(self.app)
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT pg_backend_pid()')
+            echo = f'{CHANNEL}_{cursor.fetchone()[0]}'
+            cursor.execute(f'LISTEN {CHANNEL}; LISTEN {echo}')
+            # Notifications sent before were missed
+            self.cache.clear()
+            while True:
+                # Comes back only while notifications get through, fails
+                # once the connection is lost
+                cursor.execute(f'NOTIFY {echo}')
+                deadline = time.monotonic() + HEARTBEAT
+                while time.monotonic() < deadline:
+                    connection.poll()
+                    ids, echoed = set(), False
+                    for notify in connection.notifies:
+                        if notify.channel == echo:
+                            echoed = True
+                        else:
+                            ids.update(notify.payload.split(','))
+                    connection.notifies.clear()
+                    if ids:
+                        self.cache.invalidate(
+                            [customer_key(id_) for id_ in ids]
+                        )
+                    if echoed:
+                        self.cache.beat()
+                    select.select(
+                        [connection],
+                        [],
+                        [],
+                        max(deadline - time.monotonic(), 0),
+                    )
+        finally:
+            connection.close()
+
+
+def get_customer_cache(app):
+    """The customer cache of the application, None when disabled"""
+    if not app.config['CUSTOMER_CACHE_SIZE']:
+        return None
+    with _lock:
+        if 'customer_cache' not in app.extensions:
+            if listener_url(app) is None:
+                logger.warning(
+                    'Customer cache disabled, set DB_LISTEN_HOST to listen '
+                    'to notifications behind PgBouncer'
+                )
+                app.extensions['customer_cache'] = None
+            else:
+                cache = SharedCache(
+                    app.config['CUSTOMER_CACHE_PATH'],
+                    app.config['CUSTOMER_CACHE_SIZE'],
+                )
+                app.extensions['customer_cache'] = (
+                    cache,
+                    CacheListener(app, cache),
+                )
+    if app.extensions['customer_cache'] is None:
+        return None
+    cache, listener = app.extensions['customer_cache']
+    listener.start()
+    return cache
+
+
+def customer_ids(transfers):
+    """Customers of TransactionSchema loaded transfers"""
+    ids = set()
+    for transfer in transfers:
+        ids.add(transfer['customer_source'])
+        ids.add(transfer['customer_target'])
+    return ids
+
+
+def invalidate_customers(session, ids):
+    """
+    Drop the cached customers once the database transaction of the session
+    commits, on every host.
+    """
+    if not ids or not current_app.config['CUSTOMER_CACHE_SIZE']:
+        return
+    ids = sorted(ids)
+    session.info.setdefault(PENDING, set()).update(ids)
+    session.execute(
+        NOTIFY,
+        {
+            'channel': CHANNEL,
+            'payloads': [
+                ','.join(map(str, ids[start : start + NOTIFY_MAX_IDS]))
+                for start in range(0, len(ids), NOTIFY_MAX_IDS)
+            ],
+        },
+    )
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    # Dropped at once on this host, before the notification comes back
+    ids = session.info.pop(PENDING, None)
+    if ids and has_app_context():
+        cache = get_customer_cache(current_app._get_current_object())
+        if cache:
+            cache.invalidate([customer_key(id_) for id_ in ids])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop(PENDING, None)
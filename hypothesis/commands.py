@@ -0,0 +1,235 @@
+import csv
+import os
+import time
+from datetime import date
+
+import click
+import psycopg2
+from flask import current_app
+from flask.cli import AppGroup
+
+from hypothesis.customer_import import import_customers
+from hypothesis.extensions import write_api_spec
+from hypothesis.factory import db
+from hypothesis.idempotency import get_ttl, purge_keys
+from hypothesis.ledger import compact_ledger
+from hypothesis.partitions import create_partitions
+from hypothesis.profiling import create_token, fold_stacks, merge_profiles
+from hypothesis.slots import reshard
+from hypothesis.statements import rebuild_daily_summaries
+
+apispec_cli = AppGroup('apispec', help='Manage the OpenAPI spec.')
+customers_cli = AppGroup('customers', help='Manage customers.')
+idempotency_cli = AppGroup(
+    'idempotency', help='Manage the transfers idempotency keys.'
+)
+ledger_cli = AppGroup('ledger', help='Manage the ledger accounting mode.')
+partitions_cli = AppGroup(
+    'partitions', help='Manage the transaction table partitions.'
+)
+profiling_cli = AppGroup('profiling', help='Profile live requests.')
+
+
+@customers_cli.command('import')
+@click.argument('file', type=click.File('rb'))
+@click.option(
+    '--format',
+    'input_format',
+    type=click.Choice(['csv', 'ndjson']),
+    help='Input format, guessed from the file extension by default.',
+)
+@click.option(
+    '--report',
+    type=click.File('w'),
+    help='Write the line, name and status of every input line as CSV.',
+)
+def import_command(file, input_format, report):
+    """
+    Create customers in bulk from a CSV (with a name and optionally a
+    balance column) or NDJSON file, skipping the ones that already exist.
+    """
+    if not input_format:
+        is_ndjson = file.name.endswith(('.ndjson', '.jsonl'))
+        input_format = 'ndjson' if is_ndjson else 'csv'
+
+    writer = csv.writer(report) if report else None
+    totals = {'created': 0, 'duplicate': 0, 'invalid': 0}
+    try:
+        for row in import_customers(db.session, file, input_format):
+            totals[row[2]] += 1
+            if writer:
+                writer.writerow(row)
+        db.session.commit()
+    except (ValueError, psycopg2.Error) as e:
+        db.session.rollback()
+        raise click.ClickException(str(e).splitlines()[0]) from e
+
+    click.echo(
+        f'{totals["created"]} created, {totals["duplicate"]} duplicates, '
+        f'{totals["invalid"]} invalid'
+    )
+
+
+@customers_cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """
+    Rebuild the customers daily summaries used by statements from all the
+    transactions, blocking new transactions meanwhile.
+    """
+    rebuild_daily_summaries(db.session)
+    db.session.commit()
+    click.echo('Daily summaries rebuilt')
+
+
+@partitions_cli.command('create')
+@click.option(
+    '--months',
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help='Number of monthly partitions to have from the start month on.',
+)
+@click.option(
+    '--start',
+    type=click.DateTime(formats=['%Y-%m']),
+    help='First month, formatted as YYYY-MM, the current month by default.',
+)
+def create_partitions_command(months, start):
+    """
+    Create the monthly partitions of the transaction table ahead of time,
+    meant to run periodically (e.g. daily from cron).
+    """
+    start = start.date() if start else date.today()
+    created = create_partitions(db.session, start, months)
+    db.session.commit()
+    click.echo(f'Created {", ".join(created)}' if created else 'Up to date')
+
+
+@customers_cli.command('reshard')
+@click.argument('customer_id', type=int)
+@click.option(
+    '--slots',
+    type=click.IntRange(min=0),
+    required=True,
+    help='Number of balance slots, 0 keeps the balance in the customer row.',
+)
+def reshard_command(customer_id, slots):
+    """
+    Split the balance of a customer receiving or paying lots of transfers
+    in balance slots, so they don't all wait for each other. Transfers
+    involving the customer only wait for the resharding to be committed.
+    """
+    balance = reshard(db.session, customer_id, slots)
+    if balance is None:
+        raise click.ClickException('Customer not found')
+    db.session.commit()
+    click.echo(f'Balance of {balance} split in {slots} slots')
+
+
+@ledger_cli.command('compact')
+@click.option(
+    '--interval',
+    type=float,
+    help='Keep compacting, waiting these seconds once the ledger is empty.',
+)
+def compact_command(interval):
+    """
+    Apply the ledger entries appended by transfers in ledger accounting mode
+    to the customers balances, until none is left.
+    """
+    size = current_app.config['LEDGER_COMPACT_SIZE']
+    while True:
+        applied = compact_ledger(db.session, size)
+        db.session.commit()
+        if applied:
+            click.echo(f'{applied} entries applied')
+        if applied < size:
+            if interval is None:
+                break
+            time.sleep(interval)
+
+
+@idempotency_cli.command('purge')
+def purge_command():
+    """
+    Delete the idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS, in
+    batches of IDEMPOTENCY_PURGE_SIZE committed one at a time so transfers
+    are never blocked for long. Meant to run periodically (e.g. from cron).
+    """
+    ttl = get_ttl(current_app)
+    size = current_app.config['IDEMPOTENCY_PURGE_SIZE']
+    total = 0
+    while True:
+        deleted = purge_keys(db.session, ttl, size)
+        db.session.commit()
+        total += deleted
+        if deleted < size:
+            break
+    click.echo(f'{total} keys purged')
+
+
+@profiling_cli.command('token')
+def token_command():
+    """
+    Print an X-Profile header value, requests sending it are profiled for
+    PROFILE_TOKEN_MAX_AGE seconds. Needs PROFILE_SECRET.
+    """
+    if not current_app.config['PROFILE_SECRET']:
+        raise click.ClickException('PROFILE_SECRET is not set')
+    click.echo(create_token(current_app))
+
+
+@profiling_cli.command('merge')
+@click.argument('endpoint')
+@click.option(
+    '--format',
+    'output_format',
+    type=click.Choice(['folded', 'pstats']),
+    default='folded',
+    help='Folded stacks for flamegraph.pl or speedscope, or pstats.',
+)
+@click.option(
+    '--output',
+    type=click.Path(dir_okay=False, writable=True),
+    help='File written, the standard output by default (folded only).',
+)
+def merge_command(endpoint, output_format, output):
+    """
+    Add up the profiles of an endpoint, a directory of PROFILE_DIR named
+    after the view and method, e.g. api.transaction.post.
+    """
+    directory = os.path.join(current_app.config['PROFILE_DIR'], endpoint)
+    stats = os.path.isdir(directory) and merge_profiles(directory)
+    if not stats:
+        raise click.ClickException(f'No profiles in {directory}')
+
+    if output_format == 'pstats':
+        if not output:
+            raise click.ClickException('--output is needed for pstats')
+        stats.dump_stats(output)
+        return
+
+    lines = [
+        f'{stack} {value}\n'
+        for stack, value in sorted(fold_stacks(stats).items())
+    ]
+    with click.open_file(output or '-', 'w') as folded:
+        folded.writelines(lines)
+
+
+@apispec_cli.command('build')
+@click.option(
+    '--output',
+    type=click.Path(dir_okay=False, writable=True),
+    help='File written, API_SPEC_FILE by default.',
+)
+def build_spec_command(output):
+    """
+    Write the OpenAPI spec served from API_SPEC_FILE, e.g. when building the
+    image, so that no worker builds it.
+    """
+    path = output or current_app.config['API_SPEC_FILE']
+    if not path:
+        raise click.ClickException('API_SPEC_FILE is not set')
+    write_api_spec(current_app, path)
+    click.echo(f'OpenAPI spec written to {path}')
@@ -1,16 +1,30 @@
+import base64
+import binascii
+import json
 import os
+from datetime import datetime
 from functools import lru_cache
 from pathlib import Path
 
 from flask import abort, jsonify, make_response, request
 from flask.views import MethodView
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 20
 
 
 class BaseView(MethodView):
+    # Columns used to seek when paginating with an ``after`` cursor, they
+    # must be unique together and match the order of an existing index.
+    cursor_columns = ()
+    # Serializes lists from the selected columns when set, see RowEncoder
+    encoder = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.data = {}
         self.page = 1
+        self.cursor = None
         self.query_string = request.args.to_dict()
         self.status_code = 200
 
@@ -20,13 +34,89 @@ class BaseView(MethodView):
         except ValueError:
             abort(make_response(jsonify(error="Invalid value for page"), 400))
 
+        if 'after' in self.query_string:
+            try:
+                self.cursor = decode_cursor(
+                    self.query_string['after'], self.cursor_columns
+                )
+            except ValueError:
+                abort(
+                    make_response(
+                        jsonify(error="Invalid value for after"), 400
+                    )
+                )
+
+    def get_argument(self, name, parse):
+        """Parse a query string argument, answering 400 when it's invalid"""
+        value = self.query_string.get(name)
+        if not value:
+            return None
+
+        try:
+            return parse(value)
+        except ValueError:
+            abort(
+                make_response(jsonify(error=f"Invalid value for {name}"), 400)
+            )
+
     def get_response(self):
+        if self.cursor is not None:
+            return self.response(self.get_keyset_page())
+
+        if self.encoder:
+            query = self.query.with_entities(*self.encoder.columns)
+            serialize = self.encoder
+        else:
+            query, serialize = self.query, self.schema.dump
+
         response = [
-            self.schema.dump(obj)
-            for obj in self.query.paginate(self.page, 20).items
+            serialize(obj)
+            for obj in query.paginate(self.page, PAGE_SIZE).items
         ]
         return self.response(response)
 
+    def get_keyset_query(self):
+        query = self.query
+        if self.cursor:
+            # The redundant bound on the first column is what Postgres can
+            # prune partitions with, row comparisons are never used for it
+            query = query.filter(
+                self.cursor_columns[0] >= self.cursor[0],
+                tuple_(*self.cursor_columns) > tuple_(*self.cursor),
+            )
+        # One extra row tells whether there is a next page without COUNT(*)
+        return query.order_by(*self.cursor_columns).limit(PAGE_SIZE + 1)
+
+    def get_keyset_page(self):
+        query = self.get_keyset_query()
+        if self.encoder:
+            query = query.with_entities(*self.encoder.columns)
+            serialize = self.encoder
+        else:
+            serialize = self.schema.dump
+
+        objs = query.all()
+        has_more = len(objs) > PAGE_SIZE
+        objs = objs[:PAGE_SIZE]
+
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(self.get_cursor_values(objs[-1]))
+
+        return {
+            'items': [serialize(obj) for obj in objs],
+            'next': next_cursor,
+            'has_more': has_more,
+        }
+
+    def get_cursor_values(self, obj):
+        if self.encoder:
+            return [
+                obj[self.encoder.index(column)]
+                for column in self.cursor_columns
+            ]
+        return [getattr(obj, column.key) for column in self.cursor_columns]
+
     def post(self):
         payload = request.get_json()
         self.data = self.schema.load(payload)
@@ -51,3 +141,57 @@ def get_app_version():
     file_path = get_version_file_path()
     with open(file_path, 'r', encoding='utf-8') as version_file:
         return version_file.read().replace('\n', '')
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def parse_datetime(value):
+    """
+    Parse an ISO 8601 timestamp, aware ones are converted to the local time
+    transactions are stored in.
+    """
+    value = datetime.fromisoformat(value)
+    if value.tzinfo:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps(
+        [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ],
+        separators=(',', ':'),
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """
+    Return the seek values of an opaque cursor, an empty cursor means the
+    first page. Raises ValueError when it doesn't match the given columns.
+    """
+    if not cursor:
+        return ()
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('Malformed cursor') from e
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Malformed cursor')
+
+    decoded = []
+    for value, column in zip(values, columns):
+        python_type = column.type.python_type
+        if python_type is datetime and isinstance(value, str):
+            decoded.append(datetime.fromisoformat(value))
+        elif isinstance(value, python_type) and not isinstance(value, bool):
+            decoded.append(value)
+        else:
+            raise ValueError('Malformed cursor')
+    return tuple(decoded)
@@ -0,0 +1,239 @@
+"""
+Filter of the customers identifiers of each worker.
+
+With CUSTOMER_ID_FILTER set, transfers naming customers which don't exist
+are rejected without querying the database, clients misconfigured or worse
+may send many of them. Each worker keeps a bitmap of the identifiers of the
+customers, which must never tell one doesn't exist when it does:
+
+- a listener thread LISTENs to the identifiers of the customers created,
+  notified once committed by a trigger of the customer table (see
+  hypothesis.models), before loading the existing ones, so none created in
+  between is missed
+- a customer created through another worker may be used before its
+  notification is read, an identifier missing from the bitmap is only
+  rejected once a notification sent to the listener itself after it was
+  looked up came back. Postgres delivers notifications in the order they
+  were committed, lookups waiting meanwhile share it and it reads no table
+
+Until the bitmap is loaded, while the listener connection is lost or when
+its round trip takes longer than SYNC_TIMEOUT, every transfer goes through
+to the database. Behind PgBouncer, which doesn't deliver notifications,
+the listener connects to DB_LISTEN_HOST and the filter is disabled
+without it.
+"""
+import logging
+import os
+import select
+import threading
+import time
+
+from flask import current_app
+
+from hypothesis.cache import connect_listener, customer_ids, listener_url
+from hypothesis.metrics import CUSTOMER_FILTER_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'customer_ids'
+LOAD_CHUNK_SIZE = 100000
+# Seconds the listener connection stays idle before being checked
+HEARTBEAT = 1
+# Seconds a lookup waits for a round trip of the listener
+SYNC_TIMEOUT = 1
+
+_lock = threading.Lock()
+
+
+def add_ids(bits, ids):
+    for customer_id in ids:
+        # Never given by the sequence, left to the database
+        if customer_id < 0:
+            continue
+        index = customer_id >> 3
+        if index >= len(bits):
+            bits.extend(bytes(max(index + 1, 2 * len(bits)) - len(bits)))
+        bits[index] |= 1 << (customer_id & 7)
+
+
+class CustomerIdFilter:
+    """
+    Bitmap of the customers identifiers kept up to date by a thread of the
+    worker, see find_unknown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.bits = bytearray()
+        self.condition = threading.Condition()
+        # Whether the bitmap is up to date, and when the last round trip of
+        # the listener started, or was last wanted by a lookup
+        self.ready = False
+        self.synced = self.wanted = 0.0
+        self.wakeup = None
+        self.thread = None
+        self.pid = None
+
+    def __contains__(self, customer_id):
+        bits = self.bits
+        index = customer_id >> 3
+        return 0 <= index < len(bits) and bool(
+            bits[index] & 1 << (customer_id & 7)
+        )
+
+    def find_unknown(self, ids):
+        """
+        Identifiers among ids which surely aren't of a customer, none when
+        the filter can't tell.
+        """
+        started = time.monotonic()
+        unknown = {
+            customer_id
+            for customer_id in ids
+            if customer_id >= 0 and customer_id not in self
+        }
+        if not unknown or not self.ready:
+            return set()
+
+        with self.condition:
+            if self.wanted < started:
+                self.wanted = started
+                try:
+                    os.write(self.wakeup[1], b'\0')
+                except BlockingIOError:
+                    # Already woken up
+                    pass
+            deadline = started + SYNC_TIMEOUT
+            while self.ready and self.synced < started:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+            if not self.ready or self.synced < started:
+                return set()
+
+        unknown = {
+            customer_id for customer_id in unknown if customer_id not in self
+        }
+        if unknown:
+            CUSTOMER_FILTER_REJECTIONS.inc()
+        return unknown
+
+    def start(self):
+        # Threads don't survive a fork, each worker starts its own and
+        # loads the bitmap again
+        if self.pid == os.getpid():
+            return
+        with _lock:
+            if self.pid != os.getpid():
+                self.ready = False
+                self.wakeup = os.pipe()
+                os.set_blocking(self.wakeup[1], False)
+                self.thread = threading.Thread(
+                    target=self.run, name='customer-id-filter', daemon=True
+                )
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning(
+                    'Customer identifiers notifications lost', exc_info=True
+                )
+            with self.condition:
+                self.ready = False
+                self.condition.notify_all()
+            time.sleep(HEARTBEAT)
+
+    def listen(self):
+        connection = connect_listener(self.app)
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT pg_backend_pid()')
+            echo = f'{CHANNEL}_{cursor.fetchone()[0]}'
+            cursor.execute(f'LISTEN {CHANNEL}; LISTEN {echo}')
+            bits = self.load(cursor)
+            with self.condition:
+                self.bits = bits
+                self.ready = True
+
+            while True:
+                readable = select.select(
+                    [connection, self.wakeup[0]], [], [], HEARTBEAT
+                )[0]
+                if self.wakeup[0] in readable:
+                    os.read(self.wakeup[0], 4096)
+                with self.condition:
+                    wanted = self.wanted > self.synced
+                if wanted or not readable:
+                    # Comes back after the notifications committed before,
+                    # fails once the connection is lost
+                    cursor.execute(
+                        'SELECT pg_notify(%s, %s)',
+                        (echo, repr(time.monotonic())),
+                    )
+                connection.poll()
+                synced = None
+                for notify in connection.notifies:
+                    if notify.channel == echo:
+                        synced = float(notify.payload)
+                    else:
+                        add_ids(self.bits, map(int, notify.payload.split(',')))
+                connection.notifies.clear()
+                if synced is not None:
+                    with self.condition:
+                        self.synced = max(self.synced, synced)
+                        self.condition.notify_all()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def load(cursor):
+        """Bitmap of the customers committed so far"""
+        bits, last = bytearray(), -1
+        while True:
+            cursor.execute(
+                'SELECT id FROM customer WHERE id > %s ORDER BY id LIMIT %s',
+                (last, LOAD_CHUNK_SIZE),
+            )
+            ids = [row[0] for row in cursor]
+            if not ids:
+                return bits
+            add_ids(bits, ids)
+            last = ids[-1]
+
+
+def get_customer_filter(app):
+    """The customer id filter of the application, None when disabled"""
+    if not app.config['CUSTOMER_ID_FILTER']:
+        return None
+    with _lock:
+        if 'customer_id_filter' not in app.extensions:
+            customer_filter = None
+            if listener_url(app) is None:
+                logger.warning(
+                    'Customer id filter disabled, set DB_LISTEN_HOST to '
+                    'listen to notifications behind PgBouncer'
+                )
+            else:
+                customer_filter = CustomerIdFilter(app)
+            app.extensions['customer_id_filter'] = customer_filter
+    customer_filter = app.extensions['customer_id_filter']
+    if customer_filter is None:
+        return None
+    customer_filter.start()
+    return customer_filter
+
+
+def find_unknown_customers(transfers):
+    """
+    Customers of TransactionSchema loaded transfers which surely don't
+    exist, none when the filter is disabled.
+    """
+    customer_filter = get_customer_filter(current_app._get_current_object())
+    if customer_filter is None:
+        return set()
+    return customer_filter.find_unknown(customer_ids(transfers))
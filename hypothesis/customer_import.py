@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+
+COLUMNS = ('name', 'balance')
+NDJSON_BATCH_SIZE = 1000
+REPORT_FETCH_SIZE = 10000
+
+CREATE_STAGING_TABLES = '''
+    CREATE TEMP TABLE customer_import (
+        line bigserial, name text, balance numeric(14, 2)
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE customer_import_created (name text) ON COMMIT DROP;
+'''
+
+MERGE_CUSTOMERS = '''
+    WITH created AS (
+        INSERT INTO customer (name, balance)
+        SELECT DISTINCT ON (name) name, coalesce(balance, 0)
+        FROM customer_import
+        WHERE length(name) BETWEEN 1 AND 50
+        ORDER BY name, line
+        ON CONFLICT (name) DO NOTHING
+        RETURNING name
+    )
+    INSERT INTO customer_import_created SELECT name FROM created;
+    ANALYZE customer_import_created;
+'''
+
+REPORT = '''
+    SELECT
+        s.line,
+        s.name,
+        CASE
+            WHEN s.name IS NULL OR length(s.name) NOT BETWEEN 1 AND 50
+                THEN 'invalid'
+            WHEN c.name IS NOT NULL AND row_number() OVER (
+                PARTITION BY s.name ORDER BY s.line
+            ) = 1
+                THEN 'created'
+            ELSE 'duplicate'
+        END
+    FROM customer_import s
+    LEFT JOIN customer_import_created c ON c.name = s.name
+    ORDER BY s.line
+'''
+
+
+class IteratorReader(io.RawIOBase):
+    """Read-only file object over an iterator of bytes, as COPY expects"""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def read_csv(stream, chunk_size=65536):
+    """
+    Return the columns of a CSV stream header and an iterator over the rest
+    of it, which is sent to COPY as it is.
+    """
+    header = next(csv.reader([stream.readline().decode('utf-8')]), [])
+    columns = [column.strip() for column in header]
+    if 'name' not in columns or not set(columns) <= set(COLUMNS):
+        raise ValueError(
+            'The CSV header must have a name column and optionally balance'
+        )
+    return columns, iter(lambda: stream.read(chunk_size), b'')
+
+
+def read_ndjson(stream):
+    """
+    Return the columns and an iterator converting NDJSON lines to CSV,
+    a few lines at a time so the input never has to fit in memory.
+    """
+
+    def chunks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                customer = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'Invalid JSON on line {number}') from e
+
+            name, balance = customer.get('name'), customer.get('balance')
+            if balance is not None and (
+                isinstance(balance, bool)
+                or not isinstance(balance, (int, float))
+            ):
+                raise ValueError(f'Invalid balance on line {number}')
+
+            # A non-string name is written as NULL and reported as invalid
+            writer.writerow([name if isinstance(name, str) else None, balance])
+            if number % NDJSON_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    return list(COLUMNS), chunks()
+
+
+def import_customers(session, stream, input_format):
+    """
+    Create customers from a CSV or NDJSON stream using COPY into a staging
+    table merged into customer, skipping names that already exist.
+
+    It yields (line, name, status) for every input line, status being
+    created, duplicate or invalid, and must be fully consumed before the
+    session is committed.
+    """
+    if input_format == 'ndjson':
+        columns, chunks = read_ndjson(stream)
+    else:
+        columns, chunks = read_csv(stream)
+
+    connection = session.connection().connection
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_STAGING_TABLES)
+        cursor.copy_expert(
+            f'COPY customer_import ({", ".join(columns)}) '
+            'FROM STDIN WITH (FORMAT csv)',
+            IteratorReader(chunks),
+        )
+        cursor.execute(MERGE_CUSTOMERS)
+
+    with connection.cursor(name='customer_import_report') as cursor:
+        cursor.itersize = REPORT_FETCH_SIZE
+        cursor.execute(REPORT)
+        yield from cursor
+
+
+def write_report(rows, file):
+    """
+    Write the (line, name, status) rows of import_customers to a binary
+    file as NDJSON, ended by the totals of each status.
+    """
+    totals = {'created': 0, 'duplicate': 0, 'invalid': 0}
+    for line, name, status in rows:
+        totals[status] += 1
+        file.write(
+            json.dumps({'line': line, 'name': name, 'status': status}).encode()
+            + b'\n'
+        )
+    file.write(json.dumps({'totals': totals}).encode() + b'\n')
@@ -0,0 +1,162 @@
+import tempfile
+from datetime import datetime, timedelta
+
+import psycopg2
+from flask import Response, abort, current_app, jsonify, make_response, request
+from sqlalchemy import select
+from werkzeug.wsgi import wrap_file
+
+from hypothesis.balances import balances_at
+from hypothesis.commons import BaseView, parse_date, parse_datetime
+from hypothesis.customer_import import import_customers, write_report
+from hypothesis.factory import db
+from hypothesis.models import Customer
+from hypothesis.schemas import CustomerDailySummarySchema
+from hypothesis.statements import (
+    applied_balance,
+    changes_after,
+    daily_summaries,
+)
+
+MONTH = timedelta(days=30)
+
+
+class CustomerImportView(BaseView):
+    def post(self):
+        """
+        file: ../flasgger/post_customers_import.yml
+        """
+        input_format = 'csv'
+        if request.mimetype == 'application/x-ndjson':
+            input_format = 'ndjson'
+
+        # Written out before committing, so the client reads it at its own
+        # pace without holding the transaction or its connection
+        report = tempfile.TemporaryFile()
+        try:
+            write_report(
+                import_customers(db.session, request.stream, input_format),
+                report,
+            )
+            db.session.commit()
+        except (ValueError, psycopg2.Error) as e:
+            db.session.rollback()
+            report.close()
+            self.status_code = 400
+            return self.response({'error': str(e).splitlines()[0]})
+
+        report.seek(0)
+        return Response(
+            wrap_file(request.environ, report),
+            mimetype='application/x-ndjson',
+            direct_passthrough=True,
+        )
+
+
+class CustomerStatementView(BaseView):
+    schema = CustomerDailySummarySchema(many=True)
+
+    def get(self, customer_id):
+        """
+        file: ../flasgger/get_customer_statement.yml
+        """
+        date_to = self.get_argument('to', parse_date) or datetime.now()
+        date_to = date_to.date()
+        date_from = self.get_argument('from', parse_date)
+        date_from = date_from.date() if date_from else date_to - MONTH
+        if date_from > date_to:
+            abort(make_response(jsonify(error='Invalid value for from'), 400))
+
+        customer = Customer.query.get(customer_id)
+        if not customer:
+            self.status_code = 404
+            return self.response({'error': 'Customer not found'})
+
+        summaries = daily_summaries(customer_id, date_from).subquery()
+        days = db.session.execute(
+            select(summaries)
+            .where(summaries.c.day <= date_to)
+            .order_by(summaries.c.day)
+        ).all()
+        if days:
+            first = days[0]
+            opening_balance = (
+                first.closing_balance + first.debit_total - first.credit_total
+            )
+            closing_balance = days[-1].closing_balance
+        else:
+            # Nothing changed the balance in between
+            opening_balance = closing_balance = db.session.execute(
+                select(
+                    applied_balance(customer_id)
+                    - changes_after(customer_id, date_to)
+                )
+            ).scalar()
+
+        return self.response(
+            {
+                'customer_id': customer_id,
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat(),
+                'opening_balance': float(opening_balance),
+                'closing_balance': float(closing_balance),
+                'days': self.schema.dump(days),
+            }
+        )
+
+
+class CustomerBalanceView(BaseView):
+    def get(self, customer_id):
+        """
+        file: ../flasgger/get_customer_balance.yml
+        """
+        at = self.get_at()
+        balances = balances_at(db.session, [customer_id], at)
+        if customer_id not in balances:
+            self.status_code = 404
+            return self.response({'error': 'Customer not found'})
+
+        return self.response(
+            {
+                'customer_id': customer_id,
+                'at': at.isoformat(),
+                'balance': float(balances[customer_id]),
+            }
+        )
+
+    def get_at(self):
+        return self.get_argument('at', parse_datetime) or datetime.now()
+
+
+class CustomerBalancesView(CustomerBalanceView):
+    def get(self):  # pylint: disable=arguments-differ
+        """
+        file: ../flasgger/get_customers_balances.yml
+        """
+        customer_ids = self.get_argument('ids', parse_ids)
+        if not customer_ids or len(customer_ids) > (
+            current_app.config['BALANCES_MAX_CUSTOMERS']
+        ):
+            abort(make_response(jsonify(error='Invalid value for ids'), 400))
+
+        at = self.get_at()
+        balances = balances_at(db.session, customer_ids, at)
+
+        # Unknown customers are left out, the others keep the order asked
+        return self.response(
+            {
+                'at': at.isoformat(),
+                'balances': [
+                    {
+                        'customer_id': customer_id,
+                        'balance': float(balances[customer_id]),
+                    }
+                    for customer_id in dict.fromkeys(customer_ids)
+                    if customer_id in balances
+                ],
+            }
+        )
+
+
+def parse_ids(value):
+    return [int(customer_id) for customer_id in value.split(',')]
@@ -0,0 +1,60 @@
+from marshmallow import fields
+
+# How marshmallow serializes each field type supported, values are never
+# None when called
+CONVERTERS = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: str,
+    fields.DateTime: lambda value: value.isoformat(),
+}
+
+
+class RowEncoder:
+    """
+    Serialize rows selected with the schema columns the same way the schema
+    dumps model objects, without hydrating them through the ORM.
+
+    The encoding function is generated once per schema, so each row costs a
+    single dict literal. Only fields without a custom format are supported.
+    """
+
+    def __init__(self, schema, model):
+        self.columns, self.keys = [], []
+        converters = []
+
+        for name, field in schema.dump_fields.items():
+            if (
+                type(field) not in CONVERTERS
+                or getattr(field, 'format', None) not in (None, 'iso')
+                or getattr(field, 'as_string', False)
+            ):
+                raise TypeError(f'Field {name} is not supported by RowEncoder')
+
+            self.columns.append(getattr(model, field.attribute or name))
+            self.keys.append(field.data_key or name)
+            converters.append(CONVERTERS[type(field)])
+
+        items = ', '.join(
+            f'{key!r}: None if row[{index}] is None '
+            f'else convert_{index}(row[{index}])'
+            for index, key in enumerate(self.keys)
+        )
+        namespace = {
+            f'convert_{index}': converter
+            for index, converter in enumerate(converters)
+        }
+        exec(  # pylint: disable=exec-used
+            f'def encode(row):\n    return {{{items}}}\n', namespace
+        )
+        self.encode = namespace['encode']
+
+    def __call__(self, row):
+        return self.encode(row)
+
+    def index(self, column):
+        """Position of a column in the rows selected"""
+        for index, selected in enumerate(self.columns):
+            if selected is column:
+                return index
+        raise ValueError(f'{column} is not selected by the encoder')
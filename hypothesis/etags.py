@@ -0,0 +1,93 @@
+"""
+HTTP caching of GET /transactions/.
+
+Transactions never change once committed, so pages whose transactions are
+all dated more than SETTLE_TIME ago can't change anymore either: they are
+cached as immutable, under an ETag made of their URL only, and
+If-None-Match is answered without touching the database.
+
+Other pages must be revalidated. Their ETag is made of what changes when
+transactions are added to them: the count of the transactions of their
+filter dated after a boundary moving every SETTLE_TIME, older ones are all
+committed already, or the identifiers of a cursor page. Checking it costs
+one aggregate query over the latest transactions instead of loading and
+serializing the page.
+
+In ledger accounting mode compactions fill the balances of transactions
+after their ledger entries: ETags include the count and highest identifier
+of the entries left, and pages are only immutable before the oldest one.
+"""
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import Response, current_app, request
+from sqlalchemy import func, select
+
+from hypothesis.models import LedgerEntry
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+# Transfers are dated once their customers are locked and committed right
+# after, within the worker timeout, clocks of the hosts may be a bit apart too
+SETTLE_TIME = timedelta(minutes=5)
+
+
+def make_etag(*version):
+    """ETag of the current URL, whatever the order of its arguments"""
+    value = repr(
+        (
+            request.path,
+            sorted(request.args.items(multi=True)),
+            current_app.config['VERSION'],
+            version,
+        )
+    )
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+def get_ledger_state(session):
+    """
+    Count and highest identifier of the ledger entries not compacted yet,
+    changed by every transfer and compaction, and the oldest one's date.
+    """
+    return tuple(
+        session.execute(
+            select(
+                func.count(),
+                func.max(LedgerEntry._id),
+                func.min(LedgerEntry.datetime),
+            )
+        ).one()
+    )
+
+
+def settled_before(ledger_state=None):
+    """Datetime before which transactions can't change anymore"""
+    before = datetime.now() - SETTLE_TIME
+    if ledger_state and ledger_state[2] is not None:
+        before = min(before, ledger_state[2])
+    return before
+
+
+def counted_since():
+    """
+    Datetime after which transactions are counted by ETags, before any still
+    being added. It only moves every SETTLE_TIME, so do the ETags.
+    """
+    before = datetime.now() - SETTLE_TIME
+    return datetime.min + (before - datetime.min) // SETTLE_TIME * SETTLE_TIME
+
+
+def is_fresh(etag):
+    """Whether the client already has the representation of the ETag"""
+    return request.if_none_match.contains_weak(etag)
+
+
+def set_cache_headers(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified(etag, cache_control):
+    return set_cache_headers(Response(status=304), etag, cache_control)
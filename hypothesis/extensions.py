@@ -1,6 +1,74 @@
-from flasgger import Swagger
+"""
+OpenAPI spec and Swagger UI, by flasgger.
+
+By default flasgger is imported with the application, serves /apidocs and
+builds the spec from the docstrings and yml files of the views on the
+first GET /apispec_1.json. With API_SPEC_FILE set, flasgger and what it
+imports are left out of the processes serving requests: the spec is read
+from that file, written by flask apispec build or, when missing, by the
+first request, and /apidocs isn't served.
+"""
+import os
+import threading
+
+from flask import Response, current_app, json
+
 from hypothesis.settings import Configuration
 
+SPEC_ENDPOINT = 'apispec_1'
+SPEC_URL = f'/{SPEC_ENDPOINT}.json'
+
+_lock = threading.Lock()
 
+
+# pylint: disable=import-outside-toplevel
 def init_swagger(app):
+    if app.config['API_SPEC_FILE']:
+        app.add_url_rule(SPEC_URL, 'apispec', serve_api_spec)
+        return None
+
+    from flasgger import Swagger
+
     return Swagger(app, template=Configuration.SWAGGER_TEMPLATE)
+
+
+def build_api_spec(app):
+    """The OpenAPI spec of the application, as flasgger serves it"""
+    swagger = getattr(app, 'swag', None)
+    if swagger is None:
+        from hypothesis.factory import create_app
+
+        app = create_app({**app.config, 'API_SPEC_FILE': ''})
+        swagger = app.swag
+    with app.app_context():
+        return json.dumps(swagger.get_apispecs(SPEC_ENDPOINT))
+
+
+def write_api_spec(app, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Renamed once complete, workers may read it meanwhile
+    partial = f'{path}.{os.getpid()}'
+    with open(partial, 'w') as file:
+        file.write(build_api_spec(app))
+    os.replace(partial, path)
+
+
+def load_api_spec(app):
+    """Contents of API_SPEC_FILE, written first if missing"""
+    spec = app.extensions.get('api_spec')
+    if spec is not None:
+        return spec
+    with _lock:
+        if 'api_spec' not in app.extensions:
+            path = app.config['API_SPEC_FILE']
+            if not os.path.exists(path):
+                write_api_spec(app, path)
+            with open(path, 'rb') as file:
+                app.extensions['api_spec'] = file.read()
+    return app.extensions['api_spec']
+
+
+def serve_api_spec():
+    return Response(load_api_spec(current_app), mimetype='application/json')
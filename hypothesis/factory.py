@@ -1,12 +1,57 @@
 import os
+import time
 
-from flask import Blueprint, Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, g, has_app_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
 
 from hypothesis.extensions import init_swagger
+from hypothesis.pool import TimedQueuePool
 
 PKG_NAME = os.path.dirname(os.path.realpath(__file__)).split('/')[-1]
-db = SQLAlchemy()
+
+
+class RoutingSession(SignallingSession):
+    """Session reading from the replica chosen for the request, if any"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_app_context() and g.get('replica') is not None:
+            return g.replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine_opts.setdefault('poolclass', TimedQueuePool)
+        return super().create_engine(sa_url, engine_opts)
+
+
+db = RoutingSQLAlchemy()
+
+
+# Seconds whether an extension is installed is trusted, so one created or
+# dropped while the workers run is noticed without restarting them
+EXTENSION_TTL = 60
+
+_extensions = {}
+
+
+def has_extension(name):
+    """Whether a Postgres extension is installed, checked once in a while"""
+    key = (str(db.engine.url), name)
+    installed, checked = _extensions.get(key, (None, None))
+    now = time.monotonic()
+    if checked is None or now - checked >= EXTENSION_TTL:
+        query = (
+            'SELECT exists(SELECT 1 FROM pg_extension WHERE extname = :name)'
+        )
+        installed = db.session.execute(query, {'name': name}).scalar()
+        _extensions[key] = (installed, now)
+    return installed
+
 
 # pylint: disable=import-outside-toplevel,dangerous-default-value
 def create_app(settings_override={}):
@@ -16,22 +61,96 @@ def create_app(settings_override={}):
 
     db.init_app(app)
 
+    from hypothesis.metrics import init_metrics
+    from hypothesis.queries import init_queries
+    from hypothesis.replicas import init_replicas
+
+    init_metrics(app)
+    init_queries(app)
+    init_replicas(app)
+
     init_swagger(app)
 
     blueprint = Blueprint('api', __name__)
 
+    from hypothesis.commands import (
+        apispec_cli,
+        customers_cli,
+        idempotency_cli,
+        ledger_cli,
+        partitions_cli,
+        profiling_cli,
+    )
+    from hypothesis.customer_views import (
+        CustomerBalancesView,
+        CustomerBalanceView,
+        CustomerImportView,
+        CustomerStatementView,
+    )
+    from hypothesis.monitoring_views import MetricsView, PoolView
+    from hypothesis.profiling import profile_view
+    from hypothesis.transaction_views import (
+        TransactionBatchView,
+        TransactionExportView,
+    )
     from hypothesis.views import CustomerView, TransactionView
 
     blueprint.add_url_rule(
         '/customers/',
-        view_func=CustomerView.as_view('customer'),
+        view_func=profile_view(app, CustomerView.as_view('customer')),
         methods=['GET', 'POST'],
     )
+    blueprint.add_url_rule(
+        '/customers/import',
+        view_func=CustomerImportView.as_view('customer_import'),
+        methods=['POST'],
+    )
+    blueprint.add_url_rule(
+        '/customers/balances',
+        view_func=CustomerBalancesView.as_view('customer_balances'),
+        methods=['GET'],
+    )
+    blueprint.add_url_rule(
+        '/customers/<int:customer_id>/balance',
+        view_func=CustomerBalanceView.as_view('customer_balance'),
+        methods=['GET'],
+    )
+    blueprint.add_url_rule(
+        '/customers/<int:customer_id>/statement',
+        view_func=CustomerStatementView.as_view('customer_statement'),
+        methods=['GET'],
+    )
     blueprint.add_url_rule(
         '/transactions/',
-        view_func=TransactionView.as_view('transaction'),
+        view_func=profile_view(app, TransactionView.as_view('transaction')),
         methods=['GET', 'POST'],
     )
+    blueprint.add_url_rule(
+        '/transactions/export',
+        view_func=TransactionExportView.as_view('transaction_export'),
+        methods=['GET'],
+    )
+    blueprint.add_url_rule(
+        '/transactions/batch',
+        view_func=TransactionBatchView.as_view('transaction_batch'),
+        methods=['POST'],
+    )
+    blueprint.add_url_rule(
+        '/metrics',
+        view_func=MetricsView.as_view('metrics'),
+        methods=['GET'],
+    )
+    blueprint.add_url_rule(
+        '/pool',
+        view_func=PoolView.as_view('pool'),
+        methods=['GET'],
+    )
 
     app.register_blueprint(blueprint)
+    app.cli.add_command(apispec_cli)
+    app.cli.add_command(customers_cli)
+    app.cli.add_command(idempotency_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(profiling_cli)
     return app
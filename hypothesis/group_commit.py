@@ -0,0 +1,240 @@
+"""
+Group commit of single transfers.
+
+With GROUP_COMMIT set, POST /transactions/ hands its transfer to a writer
+thread of the worker process instead of committing it. The writer applies
+whatever transfers are waiting, up to GROUP_COMMIT_SIZE or those arriving
+within GROUP_COMMIT_WAIT_MS of the first one, in a single database
+transaction, so they share one commit and one WAL flush. Each request gets
+its own outcome once the commit is done. Transfers the database rejects,
+e.g. overflowing a balance, only fail on their own.
+
+Idempotency keys are claimed in the same database transaction as the
+group, see hypothesis.idempotency.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from marshmallow import ValidationError
+from sqlalchemy.exc import DBAPIError
+
+from hypothesis.cache import customer_ids, invalidate_customers
+from hypothesis.factory import db
+from hypothesis.idempotency import (
+    claim_keys,
+    get_responses,
+    release_keys,
+    store_responses,
+)
+from hypothesis.ledger import append_batch
+from hypothesis.schemas import TransactionSchema
+from hypothesis.transfers import transfer_batch
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+
+
+class GroupCommitWriter:
+    def __init__(self, app, size, wait):
+        self.app = app
+        self.schema = TransactionSchema()
+        self.size = size
+        self.wait = wait
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, data, key=None):
+        """
+        Queue the transfer of TransactionSchema loaded data and return a
+        Future of the data completed once committed, or of the
+        ValidationError when it can't be made.
+
+        Key is the (idempotency key, fingerprint) of the request, if any. A
+        transfer whose key was already used is not made again, its Future
+        gets the StoredResponse of the key instead.
+        """
+        self.start()
+        future = Future()
+        self.queue.put((data, key, future))
+        return future
+
+    def start(self):
+        # Threads don't survive a fork, workers forked from a master which
+        # already used the writer start their own
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with _lock:
+            if self.pid != os.getpid():
+                self.queue = queue.Queue()
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='group-commit', daemon=True
+                )
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            self.write(self.collect())
+
+    def collect(self):
+        """
+        Wait for a transfer and take the ones following it, until the group
+        is full or the wait is over.
+        """
+        group = [self.queue.get()]
+        deadline = time.monotonic() + self.wait
+        while len(group) < self.size:
+            try:
+                group.append(
+                    self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except queue.Empty:
+                break
+        return group
+
+    def write(self, group):
+        """
+        Apply and commit a group of (data, key, future) in a single database
+        transaction, then resolve every future.
+        """
+        try:
+            with self.app.app_context():
+                try:
+                    applied, errors, replayed = self.apply(group)
+                    db.session.commit()
+                    responses = replayed and get_responses(
+                        db.session, {key[0] for _, key, _ in replayed}
+                    )
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Group of %s transfers failed', len(group))
+            for _, _, future in group:
+                future.set_exception(e)
+            return
+
+        for (data, _, future), error in zip(applied, errors):
+            if isinstance(error, Exception):
+                future.set_exception(error)
+            elif error:
+                future.set_exception(ValidationError(error['_schema']))
+            else:
+                future.set_result(data)
+        for _, key, future in replayed:
+            future.set_result(responses[key[0]])
+
+    def apply(self, group):
+        """
+        Claim the idempotency keys of the group and apply the transfers not
+        made before, storing their responses. Return the entries applied,
+        their errors and the entries to replay.
+        """
+        keys = {}
+        for _, key, _ in group:
+            if key:
+                keys.setdefault(*key)
+        claimed = claim_keys(db.session, keys)
+
+        # Only the first transfer of a key is applied, even in the group
+        applied, replayed = [], []
+        for entry in group:
+            key = entry[1]
+            if key and key[0] not in claimed:
+                replayed.append(entry)
+                continue
+            if key:
+                claimed.remove(key[0])
+            applied.append(entry)
+
+        errors = self.apply_transfers([data for data, _, _ in applied])
+
+        # Keys of transfers failed in the database are left to their retries
+        release_keys(
+            db.session,
+            [
+                key[0]
+                for (_, key, _), error in zip(applied, errors)
+                if key and isinstance(error, Exception)
+            ],
+        )
+        store_responses(
+            db.session,
+            {
+                key[0]: (
+                    (400, {'error': error})
+                    if error
+                    else (201, self.schema.dump(data))
+                )
+                for (data, key, _), error in zip(applied, errors)
+                if key and not isinstance(error, Exception)
+            },
+        )
+        invalidate_customers(
+            db.session,
+            customer_ids(
+                data
+                for (data, _, _), error in zip(applied, errors)
+                if not error
+            ),
+        )
+        return applied, errors, replayed
+
+    def apply_transfers(self, items):
+        """
+        Apply TransactionSchema loaded data and return one error (or None
+        when applied) per item, the exception raised by the database for
+        the ones it rejected.
+
+        The group is applied at once in a savepoint. When the database
+        rejects it, each transfer is applied again in a savepoint of its
+        own, so only the failing ones fail.
+        """
+        if self.app.config['ACCOUNTING_MODE'] == 'ledger':
+            apply = append_batch
+        else:
+            apply = transfer_batch
+        if not items:
+            return []
+
+        try:
+            with db.session.begin_nested():
+                return apply(db.session, items, atomic=False)
+        except DBAPIError as e:
+            if len(items) == 1:
+                logger.exception('Transfer of a group failed')
+                return [e]
+            logger.warning(
+                'Group of %s transfers failed, applying them one by one',
+                len(items),
+                exc_info=True,
+            )
+
+        errors = []
+        for item in items:
+            try:
+                with db.session.begin_nested():
+                    errors.extend(apply(db.session, [item], atomic=False))
+            except DBAPIError as e:
+                logger.exception('Transfer of a group failed')
+                errors.append(e)
+        return errors
+
+
+def get_group_writer(app):
+    """The group commit writer of the application, created on first use"""
+    with _lock:
+        if 'group_commit' not in app.extensions:
+            app.extensions['group_commit'] = GroupCommitWriter(
+                app,
+                app.config['GROUP_COMMIT_SIZE'],
+                app.config['GROUP_COMMIT_WAIT_MS'] / 1000,
+            )
+    return app.extensions['group_commit']
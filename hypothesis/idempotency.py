@@ -0,0 +1,195 @@
+"""
+Idempotency keys of POST /transactions/.
+
+A key is claimed by inserting its row in the database transaction making
+the transfer, and its response is stored in that same transaction. A retry
+arriving while the first request is still in flight blocks on the unique
+key until it is committed, then gets the stored response back instead of
+transferring again. When the first request rolls back, the retry claims the
+key itself.
+
+Each worker keeps the last responses in a ResponseCache, so most retries
+are answered without touching the database.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB, insert
+
+from hypothesis.models import IdempotencyKey
+
+key_table = IdempotencyKey.__table__
+
+KEY_MAX_LENGTH = 255
+
+_lock = threading.Lock()
+
+StoredResponse = namedtuple(
+    'StoredResponse', ['fingerprint', 'status_code', 'response']
+)
+
+# Keys locked by a concurrent purge or claim are skipped, the next batch
+# takes them
+PURGE_KEYS = '''
+    DELETE FROM idempotency_key
+    WHERE key IN (
+        SELECT key FROM idempotency_key
+        WHERE created_at < :before
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+'''
+
+
+def fingerprint(payload):
+    """Hash of a JSON payload, whatever the order of its keys"""
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def claim_keys(session, keys):
+    """
+    Insert the keys, mapped to the fingerprints of their requests, and
+    return the ones inserted. Keys of requests in flight are waited for,
+    the others not returned already have a response stored.
+    """
+    if not keys:
+        return set()
+    # Rows are inserted in the order of their values, claims waiting on
+    # each other's keys always wait for the lowest one first and never
+    # deadlock
+    return set(
+        session.execute(
+            insert(key_table)
+            .values(
+                [
+                    {'key': key, 'fingerprint': keys[key]}
+                    for key in sorted(keys)
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=[key_table.c.key])
+            .returning(key_table.c.key)
+        ).scalars()
+    )
+
+
+def release_keys(session, keys):
+    """Delete keys claimed in the current database transaction"""
+    if keys:
+        session.execute(delete(key_table).where(key_table.c.key.in_(keys)))
+
+
+def get_responses(session, keys):
+    """StoredResponse of the keys found, by key"""
+    rows = session.execute(
+        select(
+            key_table.c.key,
+            key_table.c.fingerprint,
+            key_table.c.status_code,
+            key_table.c.response,
+        ).where(key_table.c.key.in_(keys))
+    )
+    return {row.key: StoredResponse(*row[1:]) for row in rows}
+
+
+def store_responses(session, responses):
+    """
+    Store the (status code, response) of keys claimed in the current
+    database transaction, by key.
+    """
+    if not responses:
+        return
+    session.execute(
+        update(key_table)
+        .where(key_table.c.key == bindparam('stored_key'))
+        .values(
+            status_code=bindparam('stored_status_code'),
+            response=bindparam('stored_response', type_=JSONB),
+        ),
+        [
+            {
+                'stored_key': key,
+                'stored_status_code': status_code,
+                'stored_response': response,
+            }
+            for key, (status_code, response) in responses.items()
+        ],
+    )
+
+
+def store_response(session, key, value, status_code, response):
+    """
+    Claim the key and store its response at once, for requests failed
+    before claiming it. A response already stored for the key is kept.
+    """
+    session.execute(
+        insert(key_table)
+        .values(
+            key=key,
+            fingerprint=value,
+            status_code=status_code,
+            response=response,
+        )
+        .on_conflict_do_nothing(index_elements=[key_table.c.key])
+    )
+
+
+def purge_keys(session, ttl, limit):
+    """
+    Delete up to limit keys created more than ttl ago and return how many
+    were deleted.
+    """
+    return session.execute(
+        text(PURGE_KEYS),
+        {'before': datetime.now() - ttl, 'limit': limit},
+    ).rowcount
+
+
+class ResponseCache:
+    """
+    Least recently used StoredResponses by key, shared by the threads of a
+    worker. Responses older than ttl are dropped like the purged keys.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored, expires = entry
+            if expires < datetime.now():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return stored
+
+    def put(self, key, stored):
+        with self.lock:
+            self.entries[key] = (stored, datetime.now() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+def get_response_cache(app):
+    """The idempotency response cache of the application"""
+    with _lock:
+        if 'idempotency_cache' not in app.extensions:
+            app.extensions['idempotency_cache'] = ResponseCache(
+                app.config['IDEMPOTENCY_CACHE_SIZE'], get_ttl(app)
+            )
+    return app.extensions['idempotency_cache']
+
+
+def get_ttl(app):
+    return timedelta(hours=app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
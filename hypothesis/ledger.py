@@ -0,0 +1,150 @@
+from datetime import datetime
+
+from marshmallow import ValidationError
+from sqlalchemy import bindparam, insert, select, text, update
+
+from hypothesis.models import Customer, LedgerEntry, Transaction
+from hypothesis.statements import record_balance_changes
+from hypothesis.transfers import (
+    apply_balances,
+    insert_transactions,
+    lock_customers,
+    write_balances,
+)
+
+ledger_table = LedgerEntry.__table__
+transaction_table = Transaction.__table__
+
+# Compactions run one at a time, each filling the balances after the ones
+# the previous compaction filled
+COMPACT_LOCK = "SELECT pg_advisory_xact_lock(hashtext('ledger_compact'))"
+
+# Entries are only taken once the transactions started before theirs are
+# over (or from this one), uncommitted entries are invisible here and could
+# come before them in (datetime, transaction) order otherwise, the order
+# balance lookups at a point in time follow
+TAKE_ENTRIES = '''
+    DELETE FROM ledger_entry
+    WHERE id IN (
+        SELECT id FROM ledger_entry
+        WHERE age(xmin) > age(pg_snapshot_xmin(pg_current_snapshot())::xid)
+            OR xmin = pg_current_xact_id_if_assigned()::xid
+        ORDER BY datetime, transaction_id
+        LIMIT :limit
+    )
+    RETURNING id, customer_id, transaction_id, datetime, amount
+'''
+
+
+def append_transaction(session, data):
+    """
+    Append the transfer of TransactionSchema loaded data to the ledger,
+    raising ValidationError when it can't be made.
+    """
+    errors = append_batch(session, [data])
+    if errors[0]:
+        raise ValidationError(errors[0]['_schema'])
+    return data
+
+
+def append_batch(session, items, atomic=True):
+    """
+    Ledger accounting version of hypothesis.transfers.transfer_batch, the
+    transactions are inserted along with their ledger entries and no
+    customer row is written.
+
+    Only the sources are locked, to guard them against overdrafts, so
+    transfers into the same customer never wait for each other. The balances
+    after each transfer are left empty until the entries are compacted.
+    """
+    sources = {item['customer_source'] for item in items}
+    targets = {item['customer_target'] for item in items}
+    lock_customers(session, sources)
+
+    # Read in a statement of its own, so the snapshot includes the entries
+    # committed while waiting for the locks
+    balances = dict(
+        session.execute(
+            select(Customer._id, Customer.ledger_balance).where(
+                Customer._id.in_(sources | targets)
+            )
+        ).all()
+    )
+    errors, applied, _ = apply_balances(items, balances)
+
+    if not applied or (atomic and len(applied) != len(items)):
+        return errors
+
+    # Stamped while the sources are locked, see
+    # hypothesis.transfers.create_transaction
+    moment = datetime.now()
+    for item in applied:
+        item['datetime'] = moment
+        item['customer_source_value'] = item['customer_target_value'] = None
+    insert_transactions(session, applied)
+
+    session.execute(
+        insert(ledger_table),
+        [
+            {
+                'customer_id': customer_id,
+                'transaction_id': item['_id'],
+                'datetime': item['datetime'],
+                'amount': amount,
+            }
+            for item in applied
+            for customer_id, amount in (
+                (item['customer_source'], -item['value']),
+                (item['customer_target'], item['value']),
+            )
+        ],
+    )
+    return errors
+
+
+def compact_ledger(session, limit):
+    """
+    Apply up to limit ledger entries to the customers balances, in the order
+    of their transactions, filling the balances after each transaction and
+    the daily summaries. Return the number of entries applied.
+    """
+    session.execute(text(COMPACT_LOCK))
+    entries = sorted(
+        session.execute(text(TAKE_ENTRIES), {'limit': limit}),
+        key=lambda entry: (entry.datetime, entry.transaction_id, entry.id),
+    )
+    if not entries:
+        return 0
+
+    balances, slots = lock_customers(
+        session, {entry.customer_id for entry in entries}
+    )
+    changes, sides = [], {'source': [], 'target': []}
+    for entry in entries:
+        balance = balances[entry.customer_id] + entry.amount
+        balances[entry.customer_id] = balance
+
+        changes.append((entry.customer_id, entry.datetime, entry.amount))
+        sides['source' if entry.amount < 0 else 'target'].append(
+            {
+                'transaction_id': entry.transaction_id,
+                'moment': entry.datetime,
+                'balance': balance,
+            }
+        )
+
+    write_balances(session, balances, slots)
+    # The datetime lets Postgres prune the partitions of each update
+    for side, values in sides.items():
+        if values:
+            session.execute(
+                update(transaction_table)
+                .where(
+                    transaction_table.c.id == bindparam('transaction_id'),
+                    transaction_table.c.datetime == bindparam('moment'),
+                )
+                .values({f'customer_{side}_value': bindparam('balance')}),
+                values,
+            )
+    record_balance_changes(session, changes, slots)
+    return len(entries)
@@ -0,0 +1,207 @@
+"""
+Logging off the request path.
+
+Handlers made by create_queue_handler only put records in a bounded queue,
+a thread of each process formats them and writes them in batches. Threads
+logging never wait on the stream: when it backs up and the queue is full,
+records are dropped, counted in log_records_dropped and reported once the
+writes go through again.
+
+Gunicorn workers move their access log behind a queue the same way with
+queue_logger, and flush everything with stop_logging when they stop. A
+stream stuck then is given STOP_TIMEOUT seconds, the records it hasn't
+taken by then are counted as dropped.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from hypothesis.metrics import LOG_RECORDS_DROPPED
+
+# Seconds each handler may take to write its records when stopping
+STOP_TIMEOUT = 5
+
+_lock = threading.Lock()
+_handlers = []
+
+
+class BatchStreamHandler(logging.StreamHandler):
+    """StreamHandler writing and flushing its records batch_size at a time"""
+
+    def __init__(self, stream=None, batch_size=100):
+        super().__init__(stream)
+        self.batch_size = batch_size
+        self.batch = []
+
+    def emit(self, record):
+        try:
+            self.batch.append(self.format(record) + self.terminator)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.batch:
+                return
+            lines, self.batch = ''.join(self.batch), []
+            try:
+                self.stream.write(lines)
+                super().flush()
+            except Exception:  # pylint: disable=broad-except
+                # The listener thread would die with it
+                self.handleError(
+                    logging.makeLogRecord({'msg': lines, 'args': None})
+                )
+
+
+class BatchQueueListener(QueueListener):
+    def __init__(self, queue_, handler, on_idle):
+        super().__init__(queue_, handler, respect_handler_level=True)
+        self.on_idle = on_idle
+
+    def dequeue(self, block):
+        # The batch is written whenever there's nothing left to add to it
+        if block and self.queue.empty():
+            self.on_idle()
+        return self.queue.get(block)
+
+    def stop(self, timeout=None):
+        """
+        Stop the thread once it handled the records queued, waiting up to
+        timeout seconds. Return None once stopped, the number of records
+        left in the queue otherwise.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            # The queue may be full, the thread makes room for it
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            return self.queue.qsize()
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # Less the sentinel
+            return max(self.queue.qsize() - 1, 0)
+        self._thread = None
+        return None
+
+
+class QueueLogHandler(QueueHandler):
+    """
+    Puts records in a queue of queue_size records for a thread of the
+    process to hand them to target, dropping them when the queue is full.
+    """
+
+    def __init__(self, target, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        with _lock:
+            _handlers.append(self)
+
+    def setFormatter(self, fmt):
+        # Records are formatted by the target, from the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Arguments are merged before they can change, formatting waits
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Threads don't survive a fork, forked workers start their own
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def start(self):
+        with _lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.listener = BatchQueueListener(
+                self.queue, self.target, self.flush_target
+            )
+            self.listener.start()
+            self.pid = os.getpid()
+
+    def flush_target(self):
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self.target.handle(
+                logging.makeLogRecord(
+                    {
+                        'name': __name__,
+                        'levelno': logging.WARNING,
+                        'levelname': 'WARNING',
+                        'msg': f'{dropped} log records dropped, queue full',
+                    }
+                )
+            )
+        self.target.flush()
+
+    def stop(self):
+        """
+        Write the records queued and stop the listener thread, giving up
+        after STOP_TIMEOUT seconds.
+        """
+        with _lock:
+            if self.pid != os.getpid():
+                return
+            listener, self.pid = self.listener, None
+        left = listener.stop(STOP_TIMEOUT)
+        if left is None:
+            self.flush_target()
+            return
+        # The target is stuck, it wouldn't write the report either
+        with self.lock:
+            self.dropped += left
+        LOG_RECORDS_DROPPED.inc(left)
+
+
+def create_queue_handler(stream=None, queue_size=10000, batch_size=100):
+    """QueueLogHandler writing to a stream in batches, for dictConfig"""
+    return QueueLogHandler(BatchStreamHandler(stream, batch_size), queue_size)
+
+
+def queue_logger(logger, queue_size=10000, batch_size=100):
+    """Move the handlers of a logger behind queues"""
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueLogHandler):
+            continue
+        target = handler
+        if type(handler) is logging.StreamHandler:
+            target = BatchStreamHandler(handler.stream, batch_size)
+            target.setLevel(handler.level)
+            target.setFormatter(handler.formatter)
+        logger.removeHandler(handler)
+        logger.addHandler(QueueLogHandler(target, queue_size))
+
+
+def stop_logging():
+    """Write the records queued by every QueueLogHandler of the process"""
+    for handler in list(_handlers):
+        handler.stop()
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,124 @@
+"""
+Prometheus metrics, served by GET /metrics.
+
+Under gunicorn every worker writes its metrics to files in
+PROMETHEUS_MULTIPROC_DIR, set by gunicorn_settings.py before the workers
+start, and /metrics adds up those of all the workers, whichever answers.
+Without it, metrics are those of the current process.
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+FAST_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Time to answer requests, by view',
+    ['method', 'endpoint', 'status'],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight',
+    'Requests being answered',
+    multiprocess_mode='livesum',
+)
+# Observed by hypothesis.queries
+QUERY_DURATION = Histogram(
+    'db_query_duration_seconds',
+    'Time to run SQL statements',
+    buckets=FAST_BUCKETS,
+)
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds',
+    'Time waited for a database connection, opening it included',
+    buckets=FAST_BUCKETS,
+)
+POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts', 'Waits for a database connection which timed out'
+)
+POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out_connections',
+    'Database connections in use',
+    multiprocess_mode='livesum',
+)
+
+# Observed by hypothesis.cache, bypassed lookups are misses
+CACHE_HITS = Counter(
+    'customer_cache_hits', 'Customer lookups answered from the cache'
+)
+CACHE_MISSES = Counter(
+    'customer_cache_misses', 'Customer lookups read from the database'
+)
+CACHE_EVICTIONS = Counter(
+    'customer_cache_evictions',
+    'Cached customers dropped to make room for others',
+)
+
+# Observed by hypothesis.customer_ids
+CUSTOMER_FILTER_REJECTIONS = Counter(
+    'customer_filter_rejections',
+    'Lookups finding unknown customers without querying the database',
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped', 'Log records dropped, their queue being full'
+)
+
+
+def render_metrics():
+    """Metrics in the Prometheus text format, of all the workers if any"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_metrics(app):
+    """Measure the requests of the application"""
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def measure_request(response):
+        if 'request_start' in g:
+            REQUEST_DURATION.labels(
+                request.method,
+                # Unknown URLs are counted together, whatever their path
+                request.endpoint or 'unknown',
+                response.status_code,
+            ).observe(time.perf_counter() - g.request_start)
+        return response
+
+    @app.teardown_request
+    def end_request(exc):  # pylint: disable=unused-argument
+        if g.pop('request_start', None) is not None:
+            REQUESTS_IN_FLIGHT.dec()
@@ -1,15 +1,57 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, Numeric, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    Numeric,
+    String,
+    case,
+    event,
+    func,
+    select,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import column_property, relationship
 
 from hypothesis.factory import db
 
 
 class Transaction(db.Model):
+    """
+    Transfers between customers, the table is partitioned by month on
+    datetime, which is why it is part of the primary key. Partitions are
+    created ahead by ``flask partitions create``, rows out of their ranges
+    land in the default partition.
+    """
 
     __tablename__ = 'transaction'
+    __table_args__ = (
+        Index('ix_transaction_datetime', 'datetime'),
+        # Besides the customer filters, they cover balance lookups at a
+        # point in time, which read the running balances from the index only
+        Index(
+            'ix_transaction_customer_source_balance',
+            'customer_source',
+            'datetime',
+            'id',
+            postgresql_include=['customer_source_value', 'value'],
+        ),
+        Index(
+            'ix_transaction_customer_target_balance',
+            'customer_target',
+            'datetime',
+            'id',
+            postgresql_include=['customer_target_value', 'value'],
+        ),
+        {'postgresql_partition_by': 'RANGE (datetime)'},
+    )
 
     _id = Column('id', Integer, autoincrement=True, primary_key=True)
-    datetime = Column(DateTime, nullable=False)
+    datetime = Column(DateTime, primary_key=True, nullable=False)
     customer_source = Column(
         Integer, ForeignKey('customer.id'), nullable=False
     )
@@ -17,21 +59,44 @@ class Transaction(db.Model):
         Integer, ForeignKey('customer.id'), nullable=False
     )
     value = Column(Numeric(precision=14, scale=2), nullable=False)
-    customer_source_value = Column(
-        Numeric(precision=14, scale=2), nullable=False
-    )
-    customer_target_value = Column(
-        Numeric(precision=14, scale=2), nullable=False
-    )
+    # Balances after the transfer, in ledger accounting mode they are only
+    # known once its ledger entries are compacted
+    customer_source_value = Column(Numeric(precision=14, scale=2))
+    customer_target_value = Column(Numeric(precision=14, scale=2))
+
+    # Identifiers come from a sequence, so they stay unique on their own
+    __mapper_args__ = {'primary_key': [_id]}
+
+
+event.listen(
+    Transaction.__table__,
+    'after_create',
+    DDL('CREATE TABLE transaction_default PARTITION OF transaction DEFAULT'),
+)
 
 
 class Customer(db.Model):
 
     __tablename__ = 'customer'
+    __table_args__ = (
+        # Serves prefix searches, the pg_trgm index on name used by contains
+        # and fuzzy searches is only created by migrations, as it depends
+        # on the extension being available
+        Index(
+            'ix_customer_name_pattern',
+            'name',
+            postgresql_ops={'name': 'varchar_pattern_ops'},
+        ),
+    )
 
     _id = Column('id', Integer, autoincrement=True, primary_key=True)
     name = Column(String(50), nullable=False, unique=True)
     balance = Column(Numeric(precision=14, scale=2), nullable=False, default=0)
+    # Number of CustomerBalanceSlot rows holding the balance of a sharded
+    # customer, its own balance is then always 0
+    balance_slots = Column(
+        Integer, nullable=False, default=0, server_default='0'
+    )
     payments = relationship(
         'Transaction',
         backref='customer_payer',
@@ -42,3 +107,144 @@ class Customer(db.Model):
         backref='customer_receiver',
         foreign_keys='Transaction.customer_target',
     )
+
+
+# Identifiers of the customers created, however they are, notified once
+# committed to the filters of hypothesis.customer_ids
+event.listen(
+    Customer.__table__,
+    'after_create',
+    DDL(
+        '''
+        CREATE OR REPLACE FUNCTION notify_customer_ids() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('customer_ids', string_agg(id::text, ','))
+            FROM (
+                SELECT id, (row_number() OVER (ORDER BY id) - 1) / 500 AS chunk
+                FROM created_customer
+            ) AS created
+            GROUP BY chunk;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER customer_ids AFTER INSERT ON customer
+        REFERENCING NEW TABLE AS created_customer
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_customer_ids();
+        '''
+    ),
+)
+
+
+class LedgerEntry(db.Model):
+    """
+    Balance changes appended by transfers in ledger accounting mode, which
+    never update the customers rows. They are removed once compacted into
+    the customers balances, see hypothesis.ledger.
+    """
+
+    __tablename__ = 'ledger_entry'
+    __table_args__ = (
+        Index(
+            'ix_ledger_entry_customer_id',
+            'customer_id',
+            postgresql_include=['amount'],
+        ),
+    )
+
+    _id = Column('id', BigInteger, autoincrement=True, primary_key=True)
+    customer_id = Column(Integer, ForeignKey('customer.id'), nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+    datetime = Column(DateTime, nullable=False)
+    # Negative for the source of the transfer
+    amount = Column(Numeric(precision=14, scale=2), nullable=False)
+
+
+class CustomerBalanceSlot(db.Model):
+    """
+    Sub-balances of a sharded customer, transfers into or out of it only
+    lock one of them, see hypothesis.slots.
+    """
+
+    __tablename__ = 'customer_balance_slot'
+
+    customer_id = Column(
+        Integer, ForeignKey('customer.id'), primary_key=True, nullable=False
+    )
+    slot = Column(Integer, primary_key=True, nullable=False)
+    balance = Column(Numeric(precision=14, scale=2), nullable=False)
+
+
+# The balance including the balance slots of sharded customers, the others
+# never read them. Deferred like ledger_balance, only loaded where returned
+Customer.current_balance = column_property(
+    Customer.balance
+    + case(
+        (
+            Customer.balance_slots > 0,
+            select(func.coalesce(func.sum(CustomerBalanceSlot.balance), 0))
+            .where(CustomerBalanceSlot.customer_id == Customer._id)
+            .scalar_subquery(),
+        ),
+        else_=0,
+    ),
+    deferred=True,
+)
+# The balance in ledger accounting mode, including the ledger entries not
+# compacted yet
+Customer.ledger_balance = column_property(
+    Customer.current_balance.expression
+    + select(func.coalesce(func.sum(LedgerEntry.amount), 0))
+    .where(LedgerEntry.customer_id == Customer._id)
+    .scalar_subquery(),
+    deferred=True,
+)
+
+
+class CustomerDailySummary(db.Model):
+    """
+    Daily totals of each customer kept up to date by every transfer, so
+    statements never have to read the transactions.
+
+    Sharded customers spread their days on as many rows as balance slots.
+    Closing balances are worked out from the current balance and the days
+    after, see hypothesis.statements.
+    """
+
+    __tablename__ = 'customer_daily_summary'
+
+    customer_id = Column(
+        Integer, ForeignKey('customer.id'), primary_key=True, nullable=False
+    )
+    day = Column(Date, primary_key=True, nullable=False)
+    slot = Column(
+        Integer,
+        primary_key=True,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+    debit_total = Column(Numeric(precision=14, scale=2), nullable=False)
+    debit_count = Column(Integer, nullable=False)
+    credit_total = Column(Numeric(precision=14, scale=2), nullable=False)
+    credit_count = Column(Integer, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Responses of the transfers made with an Idempotency-Key header, retries
+    with the same key get them back instead of transferring again, see
+    hypothesis.idempotency.
+    """
+
+    __tablename__ = 'idempotency_key'
+
+    key = Column(String(255), primary_key=True)
+    # Hash of the request payload, a key can't be reused for another one
+    fingerprint = Column(String(64), nullable=False)
+    # Empty until the transfer is made, in the same database transaction
+    status_code = Column(Integer)
+    response = Column(JSONB)
+    created_at = Column(
+        DateTime, nullable=False, server_default=func.now(), index=True
+    )
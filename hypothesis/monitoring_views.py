@@ -0,0 +1,32 @@
+from flask import Response, current_app
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from hypothesis.commons import BaseView
+from hypothesis.factory import db
+from hypothesis.metrics import render_metrics
+from hypothesis.pool import get_pool_stats
+
+
+class MetricsView(BaseView):
+    def get(self):
+        """
+        file: ../flasgger/get_metrics.yml
+        """
+        return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
+
+class PoolView(BaseView):
+    def get(self):
+        """
+        file: ../flasgger/get_pool.yml
+        """
+        binds = [None, *(current_app.config.get('SQLALCHEMY_BINDS') or ())]
+        return self.response(
+            {
+                bind
+                or 'default': get_pool_stats(
+                    db.get_engine(current_app, bind=bind)
+                )
+                for bind in binds
+            }
+        )
@@ -0,0 +1,61 @@
+from datetime import date
+
+from sqlalchemy import text
+
+DEFAULT_PARTITION = 'transaction_default'
+
+# Rows already in the default partition for the new month are moved to it
+# before attaching, attaching checks the default has none of them left.
+# Transfers are kept from adding more to the default meanwhile. Attaching
+# locks the default partition in ACCESS EXCLUSIVE mode until the commit,
+# which blocks the reads scanning it too, only those pruned to other
+# partitions (e.g. filtered on datetime) go on. Created ahead of time, the
+# default partition is mostly empty and the lock short.
+CREATE_PARTITION = '''
+    CREATE TABLE {name} (LIKE transaction INCLUDING DEFAULTS);
+    LOCK TABLE {default} IN SHARE ROW EXCLUSIVE MODE;
+    WITH moved AS (
+        DELETE FROM {default}
+        WHERE datetime >= :start AND datetime < :end
+        RETURNING *
+    )
+    INSERT INTO {name} SELECT * FROM moved;
+    ALTER TABLE transaction ATTACH PARTITION {name}
+        FOR VALUES FROM (:start) TO (:end);
+'''
+
+
+def add_months(month, count):
+    """First day of the month ``count`` months after the given one"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'transaction_y{month.year}m{month.month:02}'
+
+
+def create_partitions(session, start, months):
+    """
+    Create the monthly transaction partitions from the month of ``start`` on,
+    skipping the ones that already exist, and return the names created.
+    """
+    month = start.replace(day=1)
+    created = []
+    for _ in range(months):
+        name = partition_name(month)
+        exists = session.execute(
+            text('SELECT to_regclass(:name) IS NOT NULL'), {'name': name}
+        ).scalar()
+        if not exists:
+            session.execute(
+                text(
+                    CREATE_PARTITION.format(
+                        name=name, default=DEFAULT_PARTITION
+                    )
+                ),
+                {'start': month, 'end': add_months(month, 1)},
+            )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
@@ -0,0 +1,97 @@
+"""
+Database connection pools.
+
+Pools are sized in hypothesis.settings from the gunicorn workers and threads
+and the connections budget of the server (DB_MAX_CONNECTIONS), so all the
+workers together never open more than Postgres, or PgBouncer, accepts.
+
+Each worker keeps the time its threads waited for a connection, served by
+GET /pool and in the metrics of all the workers by GET /metrics, to tell a
+pool too small from a slow database.
+"""
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from hypothesis.metrics import POOL_CHECKED_OUT, POOL_TIMEOUTS, POOL_WAIT
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.lock = threading.Lock()
+
+    def record(self, wait, timeout=False):
+        POOL_WAIT.observe(wait)
+        if timeout:
+            POOL_TIMEOUTS.inc()
+        with self.lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(
+                    self.wait_total / max(self.checkouts, 1) * 1000, 3
+                ),
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool keeping the time taken to get each connection, opening it
+    included when the pool had to.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timeout=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        POOL_CHECKED_OUT.inc()
+        return connection
+
+    def _do_return_conn(self, conn):
+        POOL_CHECKED_OUT.dec()
+        super()._do_return_conn(conn)
+
+    def recreate(self):
+        # Disposing the engine recreates its pool, the stats go on
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def get_pool_stats(engine):
+    """Usage of the pool of an engine and the waits for its connections"""
+    pool = engine.pool
+    usage = {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+    }
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        usage.update(stats.as_dict())
+    return usage
@@ -0,0 +1,150 @@
+"""
+Profiling of live requests to the customers and transactions views.
+
+With PROFILE_SAMPLE_RATE set, that fraction of the requests is profiled.
+With PROFILE_SECRET set, requests sending an X-Profile header signed with
+it (flask profiling token) are profiled too. Without either, the views are
+left as they are, so profiling costs nothing.
+
+Each profile is written by cProfile in PROFILE_DIR, in a directory per
+endpoint and method. flask profiling merge adds them up, as pstats or as
+folded stacks for flamegraph.pl or speedscope.
+"""
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import random
+import time
+from collections import Counter
+
+from flask import current_app, request
+from itsdangerous import BadSignature, TimestampSigner
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+TOKEN_VALUE = b'profile'
+# Deepest stack folded, and least time (seconds) a call must take to be
+# folded, the number of stacks would grow without end otherwise
+MAX_DEPTH = 64
+MIN_TIME = 0.00001
+
+
+def get_signer(app):
+    return TimestampSigner(app.config['PROFILE_SECRET'], salt='profiling')
+
+
+def create_token(app):
+    """X-Profile header value, valid PROFILE_TOKEN_MAX_AGE seconds"""
+    return get_signer(app).sign(TOKEN_VALUE).decode()
+
+
+def is_requested(app):
+    """Whether the request sent a valid X-Profile header"""
+    token = request.headers.get(PROFILE_HEADER)
+    if not token or not app.config['PROFILE_SECRET']:
+        return False
+    try:
+        value = get_signer(app).unsign(
+            token, max_age=app.config['PROFILE_TOKEN_MAX_AGE']
+        )
+    except BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def profile_view(app, view):
+    """The view, profiled when profiling is enabled"""
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if not rate and not app.config['PROFILE_SECRET']:
+        return view
+
+    @functools.wraps(view)
+    def profiled(*args, **kwargs):
+        if random.random() >= rate and not is_requested(app):
+            return view(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(view, *args, **kwargs)
+        finally:
+            save_profile(profiler)
+
+    return profiled
+
+
+def get_profile_dir(endpoint, method):
+    return os.path.join(
+        current_app.config['PROFILE_DIR'], f'{endpoint}.{method.lower()}'
+    )
+
+
+def save_profile(profiler):
+    directory = get_profile_dir(request.endpoint, request.method)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(
+            os.path.join(directory, f'{os.getpid()}-{time.time_ns()}.prof')
+        )
+    except OSError:
+        logger.warning('Profile not saved in %s', directory, exc_info=True)
+
+
+def merge_profiles(directory):
+    """pstats.Stats adding up the profiles of a directory, None if empty"""
+    paths = sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith('.prof')
+    )
+    if not paths:
+        return None
+    return pstats.Stats(*paths)
+
+
+def function_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-ins, e.g. <method 'execute' of 'psycopg2.extensions.cursor'>
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def fold_stacks(stats):
+    """
+    Microseconds spent in each stack, by stack of function names separated
+    by semicolons. cProfile only keeps who called whom, so the time of a
+    function called from many places is shared between their stacks in
+    proportion to the time of each call site.
+    """
+    callees = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+
+    folded = Counter()
+
+    def fold(func, share, stack):
+        # share is the fraction of the calls to func made from this stack
+        own = stats.stats[func][2]
+        stack = stack + [function_name(func)]
+        folded[';'.join(stack)] += own * share * 1e6
+        if len(stack) >= MAX_DEPTH:
+            return
+        for callee, time_called in callees.get(func, ()):
+            callee_cumulative = stats.stats[callee][3]
+            if (
+                share * time_called < MIN_TIME
+                or function_name(callee) in stack
+            ):
+                continue
+            fold(callee, share * time_called / callee_cumulative, stack)
+
+    for root in roots:
+        fold(root, 1.0, [])
+    return {stack: round(value) for stack, value in folded.items() if value}
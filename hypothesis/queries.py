@@ -0,0 +1,169 @@
+"""
+SQL statements run by each request.
+
+Every statement is timed and handed to the QueryRecorders active in the
+current context: the one of the request being answered, and those of
+record_queries, which tests use to count statements.
+
+Responses carry the number of statements and the time spent running them in
+a Server-Timing header. Requests running more than QUERY_LOG_MAX_COUNT
+statements or spending more than QUERY_LOG_MAX_DB_MS in them are logged
+with their statements. A statement run QUERY_REPEAT_THRESHOLD times with
+the same shape, only its parameters changing, is logged as a likely N+1
+along with where it is run from.
+"""
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from hypothesis.metrics import QUERY_DURATION
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.realpath(__file__))
+STACK_DEPTH = 3
+
+_recorders = ContextVar('query_recorders', default=())
+
+PARAMETER = re.compile(r"%\(\w+\)s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+VALUES = re.compile(r'\(\?(?:, \?)*\)')
+ROWS = re.compile(r'\(\.\.\.\)(?:, \(\.\.\.\))+')
+SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize(statement):
+    """
+    Shape of a statement, its parameters and literals replaced by ? and
+    lists of them by (...), however many there are.
+    """
+    shape = SPACES.sub(' ', PARAMETER.sub('?', statement)).strip()
+    return ROWS.sub('(...)', VALUES.sub('(...)', shape))
+
+
+def stack_snippet():
+    """Last frames of the application code running a statement"""
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(PACKAGE_DIR)
+        and frame.filename != __file__
+    ]
+    return ''.join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+class QueryRecorder:
+    def __init__(self, repeat_threshold=None):
+        self.repeat_threshold = repeat_threshold
+        # Shape and duration of each statement, in the order they ran
+        self.statements = []
+        self.duration = 0.0
+        self.shapes = Counter()
+        # Where the shapes repeated were run from, by shape
+        self.repeated = {}
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, statement, duration):
+        shape = normalize(statement)
+        self.statements.append((shape, duration))
+        self.duration += duration
+        self.shapes[shape] += 1
+        if self.shapes[shape] == self.repeat_threshold:
+            self.repeated[shape] = stack_snippet()
+
+
+@contextmanager
+def record_queries(repeat_threshold=None):
+    """Record the statements run in the current context while open"""
+    recorder = QueryRecorder(repeat_threshold)
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument,too-many-arguments
+    start = getattr(context, 'query_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    QUERY_DURATION.observe(duration)
+    for recorder in _recorders.get():
+        recorder.record(statement, duration)
+
+
+def init_queries(app):
+    """Record and report the statements run by each request"""
+
+    @app.before_request
+    def start_recording():
+        g.queries = QueryRecorder(app.config['QUERY_REPEAT_THRESHOLD'])
+        g.queries_token = _recorders.set(_recorders.get() + (g.queries,))
+
+    @app.after_request
+    def report_queries(response):
+        queries = g.get('queries')
+        if queries is None:
+            return response
+
+        milliseconds = queries.duration * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={milliseconds:.1f};desc="{queries.count} queries"',
+        )
+
+        if (
+            queries.count > app.config['QUERY_LOG_MAX_COUNT']
+            or milliseconds > app.config['QUERY_LOG_MAX_DB_MS']
+        ):
+            logger.warning(
+                '%s %s ran %s statements in %.1f ms:\n%s',
+                request.method,
+                request.full_path,
+                queries.count,
+                milliseconds,
+                '\n'.join(
+                    f'{count} x {shape}'
+                    for shape, count in queries.shapes.most_common()
+                ),
+            )
+        for shape, snippet in queries.repeated.items():
+            logger.warning(
+                '%s %s ran %s times, N+1? %s\n%s',
+                request.method,
+                request.full_path,
+                queries.shapes[shape],
+                shape,
+                snippet,
+            )
+        return response
+
+    @app.teardown_request
+    def stop_recording(exc):  # pylint: disable=unused-argument
+        token = g.pop('queries_token', None)
+        if token is not None:
+            _recorders.reset(token)
+        g.pop('queries', None)
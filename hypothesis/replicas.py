@@ -0,0 +1,191 @@
+"""
+Read replicas.
+
+With DB_REPLICA_HOSTS set, GET requests read from the replicas in turn and
+everything else from the primary. Replicas replaying the WAL more than
+REPLICA_MAX_LAG_SECONDS behind the primary are skipped. They are checked
+against the WAL position of the primary read just before: a replica which
+replayed it is caught up, otherwise it is as late as the last transaction
+it replayed, which keeps growing while its WAL receiver is stalled.
+
+Responses to writes carry the LSN of the primary right after them, in the
+X-Min-LSN header and the min_lsn cookie. Reads sending it back only go to
+replicas which replayed the WAL up to it, so clients always read their own
+writes, falling back to the primary until a replica caught up.
+"""
+import itertools
+import logging
+import time
+
+from flask import g, request
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from hypothesis.factory import db
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+LSN_HEADER = 'X-Min-LSN'
+LSN_COOKIE = 'min_lsn'
+
+# The replay timestamp is the commit time on the primary of the last
+# transaction replayed
+REPLICA_STATUS = '''
+    SELECT pg_last_wal_replay_lsn()::text,
+        extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+'''
+PRIMARY_LSN = 'SELECT pg_current_wal_lsn()::text'
+
+
+def parse_lsn(value):
+    """Position in the WAL of an LSN formatted as Postgres does (0/16B3748)"""
+    high, low = value.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    def __init__(self, app, bind):
+        self.app = app
+        self.bind = bind
+        # Last WAL position replayed, None when it couldn't be checked
+        self.lsn = None
+        self.lag = None
+        self.checked = None
+
+    def read_status(self):
+        """
+        Last WAL position replayed, None when the server isn't a replica,
+        and seconds since the last transaction replayed was committed.
+        """
+        engine = db.get_engine(self.app, bind=self.bind)
+        with engine.connect() as connection:
+            lsn, age = connection.execute(text(REPLICA_STATUS)).one()
+        return (None if lsn is None else parse_lsn(lsn)), age
+
+    def refresh(self, primary_lsn=None):
+        """Check the replica against the WAL position of the primary"""
+        self.checked = time.monotonic()
+        try:
+            lsn, age = self.read_status()
+        except SQLAlchemyError:
+            logger.warning('Replica %s unavailable', self.bind, exc_info=True)
+            self.lsn = self.lag = None
+            return
+
+        if lsn is None:
+            logger.warning('%s is not a replica', self.bind)
+            self.lsn = self.lag = None
+        elif primary_lsn is not None and lsn >= primary_lsn:
+            self.lsn, self.lag = lsn, 0.0
+        else:
+            self.lsn = lsn
+            self.lag = float('inf') if age is None else float(age)
+
+
+class ReplicaRouter:
+    """
+    Chooses replicas round-robin, checking their replay position and lag
+    at most every interval seconds, or again when a client needs them to
+    have replayed further.
+    """
+
+    def __init__(self, app, binds, max_lag, interval):
+        self.app = app
+        self.replicas = [Replica(app, bind) for bind in binds]
+        self.max_lag = max_lag
+        self.interval = interval
+        self.turns = itertools.count()
+
+    def read_primary_lsn(self):
+        """Current WAL position of the primary, None when unavailable"""
+        try:
+            with db.get_engine(self.app).connect() as connection:
+                return parse_lsn(
+                    connection.execute(text(PRIMARY_LSN)).scalar()
+                )
+        except SQLAlchemyError:
+            logger.warning('Primary WAL position unavailable', exc_info=True)
+            return None
+
+    def choose(self, min_lsn=0):
+        """Bind key of the next replica usable, None to use the primary"""
+        start = next(self.turns)
+        primary_lsn = None
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            stale = (
+                replica.checked is None
+                or time.monotonic() - replica.checked >= self.interval
+                or (replica.lsn is not None and replica.lsn < min_lsn)
+            )
+            if stale:
+                # Read before the replicas, which can't be further
+                if primary_lsn is None:
+                    primary_lsn = self.read_primary_lsn()
+                replica.refresh(primary_lsn)
+            if (
+                replica.lsn is not None
+                and replica.lag <= self.max_lag
+                and replica.lsn >= min_lsn
+            ):
+                return replica.bind
+        return None
+
+
+def get_min_lsn():
+    """
+    LSN the client needs to read its own writes, 0 without any and None
+    when it can't be parsed, in which case reads go to the primary.
+    """
+    value = request.headers.get(LSN_HEADER) or request.cookies.get(LSN_COOKIE)
+    if not value:
+        return 0
+    try:
+        return parse_lsn(value)
+    except ValueError:
+        return None
+
+
+def init_replicas(app):
+    """Route the reads of the application to its replicas, if any"""
+    binds = sorted(
+        bind
+        for bind in app.config.get('SQLALCHEMY_BINDS') or ()
+        if bind.startswith('replica_')
+    )
+    if not binds:
+        return None
+
+    router = ReplicaRouter(
+        app,
+        binds,
+        app.config['REPLICA_MAX_LAG_SECONDS'],
+        app.config['REPLICA_CHECK_INTERVAL_SECONDS'],
+    )
+    app.extensions['replicas'] = router
+
+    @app.before_request
+    def route_reads():
+        if request.method not in READ_METHODS:
+            return
+        min_lsn = get_min_lsn()
+        bind = router.choose(min_lsn) if min_lsn is not None else None
+        if bind:
+            g.replica = db.get_engine(app, bind=bind)
+
+    @app.after_request
+    def track_writes(response):
+        if request.method in READ_METHODS or response.status_code >= 400:
+            return response
+        lsn = db.session.execute(text(PRIMARY_LSN)).scalar()
+        response.headers[LSN_HEADER] = lsn
+        response.set_cookie(
+            LSN_COOKIE,
+            lsn,
+            max_age=app.config['REPLICA_STICKY_SECONDS'],
+            httponly=True,
+        )
+        return response
+
+    return router
@@ -1,9 +1,8 @@
-from datetime import datetime
-
 from marshmallow import EXCLUDE, Schema, ValidationError, fields, post_load
 from marshmallow.validate import Length, Range
 
-from hypothesis.models import Customer
+# The largest amount a Numeric(14, 2) column stores
+MAX_VALUE = 999999999999.99
 
 
 # pylint: disable=unused-argument,no-self-use
@@ -13,7 +12,8 @@ class TransactionSchema(Schema):
     customer_source = fields.Integer(required=True)
     customer_target = fields.Integer(required=True)
     value = fields.Float(
-        required=True, validate=Range(min=0, min_inclusive=False)
+        required=True,
+        validate=[Range(min=0, min_inclusive=False), Range(max=MAX_VALUE)],
     )
     customer_source_value = fields.Float()
     customer_target_value = fields.Float()
@@ -23,37 +23,44 @@ class TransactionSchema(Schema):
 
     @post_load
     def prepare_object(self, data, **kwargs):
-        data['datetime'] = datetime.now().isoformat()
-
         if data['customer_source'] == data['customer_target']:
             raise ValidationError(
                 'Customers should not be the same to create a transaction'
             )
 
-        data['source_obj'] = Customer.query.get(data['customer_source'])
-        data['target_obj'] = Customer.query.get(data['customer_target'])
-
-        if not data['source_obj'] or not data['target_obj']:
-            raise ValidationError(
-                'Invalid identifier(s), customer(s) not found'
-            )
-
-        data['customer_source'] = data['source_obj']._id
-        data['customer_target'] = data['target_obj']._id
-
-        data['customer_source_value'] = (
-            float(data['source_obj'].balance) - data['value']
-        )
-        data['customer_target_value'] = (
-            float(data['target_obj'].balance) + data['value']
-        )
+        # Balances after the transfer and its datetime are set by
+        # hypothesis.transfers while both customers are locked, never trust
+        # the ones sent by clients
+        data.pop('datetime', None)
+        data.pop('customer_source_value', None)
+        data.pop('customer_target_value', None)
         return data
 
 
 class CustomerSchema(Schema):
     _id = fields.Integer(attribute='_id')
     name = fields.String(required=True, validate=Length(min=1, max=50))
-    balance = fields.Float()
+    balance = fields.Float(load_only=True)
+    # Dumped as balance, it includes the balance slots of sharded customers
+    current_balance = fields.Float(dump_only=True, data_key='balance')
 
     class Meta:
         unknown = EXCLUDE
+
+
+class LedgerCustomerSchema(CustomerSchema):
+    """Customers in ledger accounting mode"""
+
+    # Including the ledger entries not compacted yet
+    current_balance = fields.Float(
+        attribute='ledger_balance', dump_only=True, data_key='balance'
+    )
+
+
+class CustomerDailySummarySchema(Schema):
+    day = fields.Date()
+    debit_total = fields.Float()
+    debit_count = fields.Integer()
+    credit_total = fields.Float()
+    credit_count = fields.Integer()
+    closing_balance = fields.Float()
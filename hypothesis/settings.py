@@ -1,7 +1,8 @@
 import logging
 import logging.config
+import multiprocessing
 
-from decouple import config
+from decouple import Csv, config
 
 from hypothesis.commons import get_app_version
 
@@ -20,10 +21,157 @@ class Configuration:
         f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/hypothesis'
     )
 
+    # Gunicorn worker processes and threads, gunicorn_settings.py reads the
+    # same variables with the same defaults
+    WEB_WORKERS = config(
+        'WEB_WORKERS', default=2 * multiprocessing.cpu_count() + 1, cast=int
+    )
+    WEB_THREADS = config('WEB_THREADS', default=4, cast=int)
+
+    # PgBouncer in transaction pooling mode, it checks and recycles the
+    # server connections itself. psycopg2 never prepares statements on the
+    # server, which PgBouncer couldn't keep between transactions.
+    DB_PGBOUNCER = config('DB_PGBOUNCER', default=False, cast=bool)
+    # Postgres itself (host or host:port) for the connections listening to
+    # notifications, which PgBouncer doesn't keep between transactions.
+    # Without it they go to DB_HOST, unless behind PgBouncer where the
+    # features listening are disabled.
+    DB_LISTEN_HOST = config('DB_LISTEN_HOST', default='')
+
+    # GET /customers/?id= responses cached in memory shared by the workers
+    # of a host, up to CUSTOMER_CACHE_SIZE of them, 0 disables it. Writes
+    # drop the customers they change on every host through notifications,
+    # listened to by one more connection per host, see hypothesis.cache
+    CUSTOMER_CACHE_SIZE = config('CUSTOMER_CACHE_SIZE', default=0, cast=int)
+    CUSTOMER_CACHE_PATH = config(
+        'CUSTOMER_CACHE_PATH', default='/dev/shm/hypothesis-customers.cache'
+    )
+
+    # Transfers naming customers which don't exist are rejected without
+    # querying the database by a filter of the customers identifiers in
+    # each worker, kept up to date through notifications listened to by one
+    # more connection per worker, see hypothesis.customer_ids
+    CUSTOMER_ID_FILTER = config('CUSTOMER_ID_FILTER', default=False, cast=bool)
+
+    # Connections all the workers may open together to each database, keep
+    # it under max_connections (max_client_conn with PgBouncer). Every
+    # thread and the group commit writer of a worker keep a connection, so
+    # do the listeners of the customer id filter and of the customer cache
+    # (counted in every worker though one per host opens it), outside of
+    # the pool. The rest of the worker share only opens under load.
+    DB_MAX_CONNECTIONS = config('DB_MAX_CONNECTIONS', default=90, cast=int)
+    DB_LISTENERS = int(CUSTOMER_ID_FILTER) + int(CUSTOMER_CACHE_SIZE > 0)
+    DB_POOL_SIZE = config(
+        'DB_POOL_SIZE',
+        default=min(
+            WEB_THREADS + 1,
+            max(DB_MAX_CONNECTIONS // WEB_WORKERS - DB_LISTENERS, 1),
+        ),
+        cast=int,
+    )
+    DB_MAX_OVERFLOW = config(
+        'DB_MAX_OVERFLOW',
+        default=max(
+            DB_MAX_CONNECTIONS // WEB_WORKERS - DB_LISTENERS - DB_POOL_SIZE,
+            0,
+        ),
+        cast=int,
+    )
+    DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=10, cast=float)
+    DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': not DB_PGBOUNCER,
+        'pool_recycle': -1 if DB_PGBOUNCER else DB_POOL_RECYCLE,
+    }
+
+    # Read replicas (host or host:port) GET requests are spread on, see
+    # hypothesis.replicas
+    DB_REPLICA_HOSTS = config('DB_REPLICA_HOSTS', default='', cast=Csv())
+    SQLALCHEMY_BINDS = {}
+    for index, host in enumerate(DB_REPLICA_HOSTS):
+        SQLALCHEMY_BINDS[
+            f'replica_{index}'
+        ] = f'postgresql://{DB_USER}:{DB_PASSWORD}@{host}/hypothesis'
+    REPLICA_MAX_LAG_SECONDS = config(
+        'REPLICA_MAX_LAG_SECONDS', default=1, cast=float
+    )
+    REPLICA_CHECK_INTERVAL_SECONDS = config(
+        'REPLICA_CHECK_INTERVAL_SECONDS', default=1, cast=float
+    )
+    # How long clients read from replicas caught up with their last write
+    REPLICA_STICKY_SECONDS = config(
+        'REPLICA_STICKY_SECONDS', default=60, cast=int
+    )
+
+    TRANSACTION_BATCH_MAX_SIZE = config(
+        'TRANSACTION_BATCH_MAX_SIZE', default=50000, cast=int
+    )
+
+    EXPORT_FETCH_SIZE = config('EXPORT_FETCH_SIZE', default=1000, cast=int)
+
+    # balance updates the customers balances on every transfer, ledger only
+    # appends ledger entries, compacted by flask ledger compact
+    ACCOUNTING_MODE = config('ACCOUNTING_MODE', default='balance')
+    LEDGER_COMPACT_SIZE = config(
+        'LEDGER_COMPACT_SIZE', default=10000, cast=int
+    )
+
+    # Single transfers are committed in groups by a writer thread of each
+    # worker, see hypothesis.group_commit
+    GROUP_COMMIT = config('GROUP_COMMIT', default=False, cast=bool)
+    GROUP_COMMIT_SIZE = config('GROUP_COMMIT_SIZE', default=100, cast=int)
+    GROUP_COMMIT_WAIT_MS = config(
+        'GROUP_COMMIT_WAIT_MS', default=2, cast=float
+    )
+
+    # Responses of transfers made with an Idempotency-Key are kept this long
+    # (purged by flask idempotency purge), the last ones in each worker too
+    IDEMPOTENCY_KEY_TTL_HOURS = config(
+        'IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=float
+    )
+    IDEMPOTENCY_CACHE_SIZE = config(
+        'IDEMPOTENCY_CACHE_SIZE', default=10000, cast=int
+    )
+    IDEMPOTENCY_PURGE_SIZE = config(
+        'IDEMPOTENCY_PURGE_SIZE', default=1000, cast=int
+    )
+
+    # Requests running more SQL statements, or spending longer running
+    # them, are logged with their statements, and statements repeated this
+    # many times by a request as likely N+1, see hypothesis.queries
+    QUERY_LOG_MAX_COUNT = config('QUERY_LOG_MAX_COUNT', default=50, cast=int)
+    QUERY_LOG_MAX_DB_MS = config(
+        'QUERY_LOG_MAX_DB_MS', default=250, cast=float
+    )
+    QUERY_REPEAT_THRESHOLD = config(
+        'QUERY_REPEAT_THRESHOLD', default=10, cast=int
+    )
+
+    # Requests to the customers and transactions views are profiled when
+    # sampled, or when sent with an X-Profile header signed with the secret
+    # (flask profiling token), see hypothesis.profiling
+    PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0, cast=float)
+    PROFILE_SECRET = config('PROFILE_SECRET', default='')
+    PROFILE_TOKEN_MAX_AGE = config(
+        'PROFILE_TOKEN_MAX_AGE', default=3600, cast=int
+    )
+    PROFILE_DIR = config('PROFILE_DIR', default='/tmp/hypothesis-profiles')
+
+    BALANCES_MAX_CUSTOMERS = config(
+        'BALANCES_MAX_CUSTOMERS', default=1000, cast=int
+    )
+
     # Logging configuration
     LOG_LEVEL = config('LOG_LEVEL', default='INFO', cast=str)
     LOG_VARS = config('LOG_VARS', cast=str).replace("'", '').replace('"', '')
     JSON_LOGS = config('JSON_LOGS', default=False, cast=bool)
+    # Records are written by a thread of each process, LOG_BATCH_SIZE at a
+    # time, and dropped past LOG_QUEUE_SIZE waiting, see hypothesis.logs
+    LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+    LOG_BATCH_SIZE = config('LOG_BATCH_SIZE', default=100, cast=int)
     if JSON_LOGS:
         log_format = ' '.join(
             [f'%({variable})' for variable in LOG_VARS.split()]
@@ -43,9 +191,11 @@ class Configuration:
         },
         'handlers': {
             'console': {
-                'class': 'logging.StreamHandler',
+                '()': 'hypothesis.logs.create_queue_handler',
                 'stream': 'ext://sys.stdout',  # Default is stderr
                 'formatter': 'default',
+                'queue_size': LOG_QUEUE_SIZE,
+                'batch_size': LOG_BATCH_SIZE,
             }
         },
         'loggers': {
@@ -72,6 +222,12 @@ class Configuration:
 
     VERSION = get_app_version()
 
+    # OpenAPI spec file served by GET /apispec_1.json instead of flasgger,
+    # which isn't imported then, nor /apidocs served. flask apispec build
+    # writes it, the first request does when missing, see
+    # hypothesis.extensions
+    API_SPEC_FILE = config('API_SPEC_FILE', default='')
+
     SWAGGER_TEMPLATE = {
         'swagger': '2.0',
         'info': {
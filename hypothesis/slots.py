@@ -0,0 +1,192 @@
+"""
+Sharded customers keep their balance in N balance slots instead of their
+own row, so transfers into and out of a hot customer lock one slot each
+instead of all queueing on the customer row.
+
+Sharded customers rows are only locked in shared mode by transfers, which
+keeps them from being resharded meanwhile, their balance is always 0.
+Their balance after each transfer isn't known without locking every slot,
+most of their transactions leave it empty. One transfer in
+CHECKPOINT_EVERY gathers the slots instead and stores it, so balances at a
+point in time only add up the transfers since the latest one, see
+hypothesis.balances.
+"""
+import random
+from decimal import Decimal
+
+from sqlalchemy import bindparam, delete, insert, select, text, update
+
+from hypothesis.models import Customer, CustomerBalanceSlot
+
+customer_table = Customer.__table__
+slot_table = CustomerBalanceSlot.__table__
+
+CENTS = Decimal('0.01')
+# One transfer of a sharded customer in this many stores its exact balance
+CHECKPOINT_EVERY = 100
+
+# Moves an amount into a random slot able to cover it. The other slots stay
+# unlocked, so the customer balance right after the move is never known.
+MOVE_TO_SLOT = '''
+    UPDATE customer_balance_slot AS s
+    SET balance = s.balance + :amount
+    WHERE (s.customer_id, s.slot) = (
+        SELECT customer_id, slot FROM customer_balance_slot
+        WHERE customer_id = :customer_id AND balance + :amount >= 0
+        ORDER BY random()
+        LIMIT 1
+        FOR NO KEY UPDATE {skip_locked}
+    )
+    RETURNING s.slot
+'''
+
+
+def lock_sharded_customers(session, ids, lock_slots=True):
+    """
+    Lock the customers rows in shared mode and return their balances and
+    numbers of slots by identifier.
+
+    When lock_slots is set the slots of the sharded ones are locked as well
+    and their balances are the sums of the slots, otherwise they are None.
+    Customers no longer sharded have a count of 0 and no balance.
+    """
+    customers = {
+        customer_id: [None, count]
+        for customer_id, count in session.execute(
+            select(customer_table.c.id, customer_table.c.balance_slots)
+            .where(customer_table.c.id.in_(ids))
+            .order_by(customer_table.c.id)
+            .with_for_update(read=True, key_share=True)
+        )
+    }
+    sharded = [
+        customer_id for customer_id, (_, count) in customers.items() if count
+    ]
+    if not sharded or not lock_slots:
+        return customers
+
+    rows = session.execute(
+        select(slot_table.c.customer_id, slot_table.c.balance)
+        .where(slot_table.c.customer_id.in_(sharded))
+        .order_by(slot_table.c.customer_id, slot_table.c.slot)
+        .with_for_update(key_share=True)
+    )
+    for customer_id, balance in rows:
+        customers[customer_id][0] = (customers[customer_id][0] or 0) + balance
+    return customers
+
+
+def move_to_slot(session, customer_id, amount):
+    """
+    Add amount (negative for debits) to a slot of a sharded customer and
+    return whether one could cover it.
+
+    A free slot is taken when there is one, transfers wait for a random
+    slot able to cover them otherwise.
+    """
+    params = {'customer_id': customer_id, 'amount': amount}
+    for skip_locked in ('SKIP LOCKED', ''):
+        slot = session.execute(
+            text(MOVE_TO_SLOT.format(skip_locked=skip_locked)), params
+        ).scalar()
+        if slot is not None:
+            return True
+    return False
+
+
+def takes_checkpoint():
+    """Whether a transfer gathers the slots to store the balance after it"""
+    return random.randrange(CHECKPOINT_EVERY) == 0
+
+
+def gather_slots(session, customer_id, amount):
+    """
+    Lock every slot of a sharded customer, in order, and spread its balance
+    plus amount evenly on them. Return the balance after the move, exact
+    since every transfer before it is committed and every one after waits,
+    None when it doesn't cover the amount.
+    """
+    balances = (
+        session.execute(
+            select(slot_table.c.balance)
+            .where(slot_table.c.customer_id == customer_id)
+            .order_by(slot_table.c.slot)
+            .with_for_update(key_share=True)
+        )
+        .scalars()
+        .all()
+    )
+    balance = sum(balances, Decimal(0)) + amount
+    if balance < 0:
+        return None
+
+    spread_balance(session, customer_id, balance, len(balances))
+    return balance
+
+
+def split(balance, count):
+    """Split a balance in count parts, the first ones take the extra cents"""
+    cents = int(balance / CENTS)
+    part, extra = divmod(cents, count)
+    return [(part + (index < extra)) * CENTS for index in range(count)]
+
+
+def spread_balance(session, customer_id, balance, count):
+    """Spread the balance evenly on the customer slots, which are locked"""
+    session.execute(
+        update(slot_table)
+        .where(
+            slot_table.c.customer_id == bindparam('slot_customer_id'),
+            slot_table.c.slot == bindparam('slot_index'),
+        )
+        .values(balance=bindparam('slot_balance')),
+        [
+            {
+                'slot_customer_id': customer_id,
+                'slot_index': index,
+                'slot_balance': part,
+            }
+            for index, part in enumerate(split(balance, count))
+        ],
+    )
+
+
+def reshard(session, customer_id, count):
+    """
+    Move the customer balance to count slots, or back to its own row when
+    count is 0. Transfers involving the customer wait for it to be
+    committed, which should follow right away.
+
+    Return the customer balance, None when the customer doesn't exist.
+    """
+    balance = session.execute(
+        select(customer_table.c.balance)
+        .where(customer_table.c.id == customer_id)
+        .with_for_update()
+    ).scalar()
+    if balance is None:
+        return None
+
+    balance += sum(
+        session.execute(
+            delete(slot_table)
+            .where(slot_table.c.customer_id == customer_id)
+            .returning(slot_table.c.balance)
+        ).scalars(),
+        Decimal(0),
+    )
+    if count:
+        session.execute(
+            insert(slot_table),
+            [
+                {'customer_id': customer_id, 'slot': index, 'balance': part}
+                for index, part in enumerate(split(balance, count))
+            ],
+        )
+
+    session.execute(
+        update(customer_table)
+        .where(customer_table.c.id == customer_id)
+        .values(balance=0 if count else balance, balance_slots=count)
+    )
+    return balance
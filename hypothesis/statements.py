@@ -0,0 +1,210 @@
+import random
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from hypothesis.models import (
+    Customer,
+    CustomerBalanceSlot,
+    CustomerDailySummary,
+)
+
+customer_table = Customer.__table__
+slot_table = CustomerBalanceSlot.__table__
+summary_table = CustomerDailySummary.__table__
+
+# Rebuilds the summaries from the transactions
+REBUILD_SUMMARIES = '''
+    DELETE FROM customer_daily_summary;
+    INSERT INTO customer_daily_summary (
+        customer_id, day, debit_total, debit_count, credit_total,
+        credit_count
+    )
+    SELECT
+        customer_id,
+        day,
+        coalesce(sum(debit), 0),
+        count(debit),
+        coalesce(sum(credit), 0),
+        count(credit)
+    FROM (
+        SELECT
+            customer_source AS customer_id, datetime::date AS day,
+            value AS debit, NULL::numeric AS credit
+        FROM transaction
+        UNION ALL
+        SELECT customer_target, datetime::date, NULL, value
+        FROM transaction
+    ) entries
+    GROUP BY customer_id, day
+'''
+
+
+def record_daily_summaries(session, transactions, slots=None):
+    """
+    Add transactions to the daily summaries of their customers, inside the
+    same database transaction that creates them.
+
+    Transactions are TransactionSchema loaded data already applied. Slots
+    holds the numbers of balance slots of the customers by identifier.
+    """
+    record_balance_changes(
+        session,
+        [
+            change
+            for transaction in transactions
+            for change in (
+                (
+                    transaction['customer_source'],
+                    transaction['datetime'],
+                    -transaction['value'],
+                ),
+                (
+                    transaction['customer_target'],
+                    transaction['datetime'],
+                    transaction['value'],
+                ),
+            )
+        ],
+        slots,
+    )
+
+
+def record_balance_changes(session, changes, slots=None):
+    """
+    Add (customer_id, datetime, amount) changes to the daily summaries,
+    negative amounts are debits.
+
+    Changes of sharded customers, by their numbers of balance slots in
+    slots, go to a random summary row of the day so concurrent transfers
+    don't all wait on the same one.
+    """
+    slots = slots or {}
+    picked = {
+        customer_id: random.randrange(slots[customer_id])
+        for customer_id in {change[0] for change in changes}
+        if slots.get(customer_id)
+    }
+    summaries = {}
+    for customer_id, moment, amount in changes:
+        day = moment.date()
+        slot = picked.get(customer_id, 0)
+        summary = summaries.setdefault(
+            (customer_id, day, slot),
+            {
+                'customer_id': customer_id,
+                'day': day,
+                'slot': slot,
+                'debit_total': 0,
+                'debit_count': 0,
+                'credit_total': 0,
+                'credit_count': 0,
+            },
+        )
+        kind = 'debit' if amount < 0 else 'credit'
+        summary[f'{kind}_total'] += abs(amount)
+        summary[f'{kind}_count'] += 1
+
+    if not summaries:
+        return
+
+    statement = insert(summary_table)
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[
+                summary_table.c.customer_id,
+                summary_table.c.day,
+                summary_table.c.slot,
+            ],
+            set_={
+                column: summary_table.c[column] + statement.excluded[column]
+                for column in (
+                    'debit_total',
+                    'debit_count',
+                    'credit_total',
+                    'credit_count',
+                )
+            },
+        ),
+        list(summaries.values()),
+    )
+
+
+def applied_balance(customer_id):
+    """
+    Balance of the customer made of the changes the daily summaries hold,
+    the ledger entries not compacted yet are left out.
+    """
+    return (
+        select(
+            customer_table.c.balance
+            + select(func.coalesce(func.sum(slot_table.c.balance), 0))
+            .where(slot_table.c.customer_id == customer_id)
+            .scalar_subquery()
+        )
+        .where(customer_table.c.id == customer_id)
+        .scalar_subquery()
+    )
+
+
+def daily_summaries(customer_id, since):
+    """
+    Query of the customer daily summaries from since, one row per day
+    whatever the number of rows the day is spread on.
+
+    The closing balance of each day is the current one less the changes of
+    the days after it, read in the same snapshot, so it holds whatever the
+    order transfers were applied in.
+    """
+    days = (
+        select(
+            summary_table.c.day,
+            func.sum(summary_table.c.debit_total).label('debit_total'),
+            func.sum(summary_table.c.debit_count).label('debit_count'),
+            func.sum(summary_table.c.credit_total).label('credit_total'),
+            func.sum(summary_table.c.credit_count).label('credit_count'),
+        )
+        .where(
+            summary_table.c.customer_id == customer_id,
+            summary_table.c.day >= since,
+        )
+        .group_by(summary_table.c.day)
+        .subquery()
+    )
+    later = func.sum(days.c.credit_total - days.c.debit_total).over(
+        order_by=days.c.day.desc(), rows=(None, -1)
+    )
+    return select(
+        days,
+        (applied_balance(customer_id) - func.coalesce(later, 0)).label(
+            'closing_balance'
+        ),
+    )
+
+
+def changes_after(customer_id, day):
+    """Total change of the customer balance after the day"""
+    return (
+        select(
+            func.coalesce(
+                func.sum(
+                    summary_table.c.credit_total - summary_table.c.debit_total
+                ),
+                0,
+            )
+        )
+        .where(
+            summary_table.c.customer_id == customer_id,
+            summary_table.c.day > day,
+        )
+        .scalar_subquery()
+    )
+
+
+def rebuild_daily_summaries(session):
+    """
+    Recompute every daily summary from the transactions, new transactions
+    wait for the rebuild to be committed.
+    """
+    session.execute(text('LOCK TABLE transaction IN SHARE MODE'))
+    session.execute(text(REBUILD_SUMMARIES))
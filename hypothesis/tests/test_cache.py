@@ -0,0 +1,198 @@
+import time
+
+import psycopg2.extensions
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+from hypothesis import cache as cache_module
+from hypothesis.cache import (
+    WAYS,
+    SharedCache,
+    customer_key,
+    get_customer_cache,
+)
+from .conftest import address, database
+
+
+def get_counter(name):
+    return REGISTRY.get_sample_value(f'customer_cache_{name}_total')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def cache_path(tmp_path):
+    return str(tmp_path / 'customers.cache')
+
+
+@pytest.fixture()
+def shared_cache(cache_path):
+    cache = SharedCache(cache_path, WAYS)
+    cache.beat()
+    return cache
+
+
+@pytest.fixture()
+def customer_cache(app, monkeypatch, cache_path):
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_SIZE', 64)
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_PATH', cache_path)
+    cache = get_customer_cache(app)
+    # Used once the listener is up
+    wait_for(lambda: cache.get('ready')[1] is not None)
+    yield cache
+    app.extensions.pop('customer_cache')
+
+
+def test_values_are_shared_through_the_file(shared_cache, cache_path):
+    other = SharedCache(cache_path, WAYS)
+    value, token = shared_cache.get('key')
+    assert value is None
+
+    assert shared_cache.put('key', b'value', token)
+    assert other.get('key')[0] == b'value'
+
+
+def test_cache_is_bypassed_without_heartbeat(cache_path):
+    cache = SharedCache(cache_path, WAYS)
+    assert cache.get('key') == (None, None)
+    assert not cache.put('key', b'value', None)
+
+
+def test_values_read_before_an_invalidation_are_not_put(shared_cache):
+    _, token = shared_cache.get('key')
+    shared_cache.invalidate(['key'])
+    assert not shared_cache.put('key', b'value', token)
+
+    _, token = shared_cache.get('key')
+    shared_cache.clear()
+    assert not shared_cache.put('key', b'value', token)
+
+    _, token = shared_cache.get('key')
+    assert shared_cache.put('key', b'value', token)
+    shared_cache.invalidate(['key'])
+    assert shared_cache.get('key')[0] is None
+
+
+def test_least_recently_used_value_is_evicted(shared_cache):
+    # A single set
+    for index in range(WAYS):
+        key = str(index)
+        shared_cache.put(key, key.encode(), shared_cache.get(key)[1])
+    assert shared_cache.get('0')[0] == b'0'
+    evictions = get_counter('evictions')
+
+    shared_cache.put('new', b'new', shared_cache.get('new')[1])
+
+    assert get_counter('evictions') == evictions + 1
+    assert shared_cache.get('1')[0] is None
+    assert shared_cache.get('0')[0] == b'0'
+    assert shared_cache.get('new')[0] == b'new'
+
+
+def test_large_values_are_not_cached(shared_cache):
+    _, token = shared_cache.get('key')
+    assert not shared_cache.put('key', b'x' * shared_cache.slot_size, token)
+
+
+def test_file_is_replaced_for_another_size(shared_cache, cache_path):
+    shared_cache.put('key', b'value', shared_cache.get('key')[1])
+
+    larger = SharedCache(cache_path, 8 * WAYS)
+    larger.beat()
+    assert larger.get('key')[0] is None
+    assert larger.put('key', b'other', larger.get('key')[1])
+    assert larger.get('key')[0] == b'other'
+
+
+@pytest.mark.usefixtures('session')
+def test_customers_are_cached_until_changed(
+    app, customer_cache, transaction_payload, headers
+):
+    client = app.test_client()
+    source_id = transaction_payload['customer_source']
+    url = f'/customers/?id={source_id}'
+    hits = get_counter('hits')
+
+    response = client.get(url)
+    assert response.json[0]['balance'] == 10000
+    assert get_counter('hits') == hits
+    # Ignored arguments are left out of the key
+    cached = client.get(f'/customers/?id=0{source_id}&match=prefix')
+    assert cached.get_data() == response.get_data()
+    assert cached.mimetype == 'application/json'
+    assert get_counter('hits') == hits + 1
+
+    client.post('/transactions/', json=transaction_payload, headers=headers)
+    assert client.get(url).json[0]['balance'] == 9950
+    client.post('/transactions/batch', json=[transaction_payload])
+    assert client.get(url).json[0]['balance'] == 9900
+
+    assert client.get('/customers/?id=0').json == []
+    assert customer_cache.get(customer_key(0))[0] is None
+
+
+@pytest.mark.usefixtures('session')
+def test_notified_customers_are_invalidated(
+    app, customer_cache, transaction_payload
+):
+    source_id = transaction_payload['customer_source']
+    app.test_client().get(f'/customers/?id={source_id}')
+    assert customer_cache.get(customer_key(source_id))[0] is not None
+
+    # As another host would
+    engine = create_engine(
+        f'{address}/{database}', isolation_level='AUTOCOMMIT'
+    )
+    engine.execute(f"SELECT pg_notify('customer_cache', '{source_id}')")
+    engine.dispose()
+
+    wait_for(lambda: customer_cache.get(customer_key(source_id))[0] is None)
+
+
+class UnlistenCursor(psycopg2.extensions.cursor):
+    """Forgets LISTEN at once, as PgBouncer does after each transaction"""
+
+    def execute(self, query, vars=None):
+        super().execute(query, vars)
+        if query.startswith('LISTEN'):
+            super().execute('UNLISTEN *')
+
+
+def test_cache_is_bypassed_when_notifications_dont_get_through(
+    app, monkeypatch, cache_path
+):
+    connect_listener = cache_module.connect_listener
+
+    def connect_unlistening(app):
+        connection = connect_listener(app)
+        connection.cursor_factory = UnlistenCursor
+        return connection
+
+    monkeypatch.setattr(cache_module, 'connect_listener', connect_unlistening)
+    monkeypatch.setattr(cache_module, 'HEARTBEAT', 0.05)
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_SIZE', 64)
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_PATH', cache_path)
+    cache = get_customer_cache(app)
+    try:
+        # The listener cleared the cache, so it is up
+        wait_for(lambda: cache.read_header()[6] if cache.map else False)
+        time.sleep(0.2)
+        assert cache.get('key') == (None, None)
+    finally:
+        app.extensions.pop('customer_cache')
+
+
+def test_cache_is_disabled_behind_pgbouncer_without_listen_host(
+    app, monkeypatch, cache_path
+):
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_SIZE', 64)
+    monkeypatch.setitem(app.config, 'CUSTOMER_CACHE_PATH', cache_path)
+    monkeypatch.setitem(app.config, 'DB_PGBOUNCER', True)
+    assert get_customer_cache(app) is None
+    app.extensions.pop('customer_cache')
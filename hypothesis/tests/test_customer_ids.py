@@ -0,0 +1,169 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+from hypothesis.cache import listener_url
+from hypothesis.customer_ids import add_ids, get_customer_filter
+from hypothesis.queries import record_queries
+from .conftest import address, database
+
+NOT_FOUND = {'_schema': ['Invalid identifier(s), customer(s) not found']}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def engine():
+    # Commits on its own, as another worker would
+    engine = create_engine(
+        f'{address}/{database}', isolation_level='AUTOCOMMIT'
+    )
+    yield engine
+    engine.dispose()
+
+
+def create_customers(engine, *names):
+    return [
+        engine.execute(
+            'INSERT INTO customer (name, balance) VALUES (%s, 10000) '
+            'RETURNING id',
+            name,
+        ).scalar()
+        for name in names
+    ]
+
+
+@pytest.fixture()
+def customer_ids(engine):
+    return create_customers(engine, 'filter-x', 'filter-y')
+
+
+@pytest.fixture()
+def customer_filter(app, monkeypatch, customer_ids):
+    monkeypatch.setitem(app.config, 'CUSTOMER_ID_FILTER', True)
+    customer_filter = get_customer_filter(app)
+    wait_for(lambda: customer_filter.ready)
+    yield customer_filter
+    app.extensions.pop('customer_id_filter')
+
+
+def test_bitmap_grows_with_identifiers():
+    bits = bytearray()
+    add_ids(bits, [3, 100, -1])
+    assert len(bits) == 13
+    assert bits[0] == 0b1000
+    assert bits[12] == 0b10000
+    assert sum(bits) == 0b11000
+
+
+@pytest.mark.usefixtures('session')
+def test_unknown_customers_are_rejected_without_queries(
+    app, customer_filter, customer_ids, headers
+):
+    source_id, target_id = customer_ids
+    assert source_id in customer_filter and target_id in customer_filter
+    client = app.test_client()
+    payload = {'customer_source': source_id, 'value': 50}
+
+    with record_queries() as recorder:
+        response = client.post(
+            '/transactions/',
+            json={**payload, 'customer_target': target_id + 1000},
+            headers=headers,
+        )
+    assert response.status_code == 400
+    assert response.json == {'error': NOT_FOUND}
+    assert recorder.count == 0
+
+    response = client.post(
+        '/transactions/',
+        json={**payload, 'customer_target': target_id},
+        headers=headers,
+    )
+    assert response.status_code == 201
+
+
+@pytest.mark.usefixtures('session')
+def test_customers_created_elsewhere_are_never_rejected(
+    app, customer_filter, engine, headers
+):
+    client = app.test_client()
+    for index in range(10):
+        source_id, target_id = create_customers(
+            engine, f'new-x-{index}', f'new-y-{index}'
+        )
+        # Before the listener gets their notification
+        response = client.post(
+            '/transactions/',
+            json={
+                'customer_source': source_id,
+                'customer_target': target_id,
+                'value': 50,
+            },
+            headers=headers,
+        )
+        assert response.status_code == 201
+
+
+@pytest.mark.usefixtures('session')
+def test_batch_items_of_unknown_customers_are_rejected(
+    app, customer_filter, customer_ids
+):
+    source_id, target_id = customer_ids
+    client = app.test_client()
+    items = [
+        {'customer_source': source_id, 'customer_target': 0, 'value': 5},
+        {
+            'customer_source': source_id,
+            'customer_target': target_id,
+            'value': 5,
+        },
+    ]
+
+    with record_queries() as recorder:
+        response = client.post('/transactions/batch', json=items)
+    assert response.status_code == 400
+    assert response.json['results'][0] == {'status': 400, 'error': NOT_FOUND}
+    assert response.json['results'][1]['status'] == 424
+    assert recorder.count == 0
+
+    response = client.post('/transactions/batch?mode=best_effort', json=items)
+    assert [result['status'] for result in response.json['results']] == [
+        400,
+        201,
+    ]
+
+
+@pytest.mark.usefixtures('session')
+def test_unknown_customers_are_let_through_when_out_of_date(
+    customer_filter, customer_ids
+):
+    unknown = max(customer_ids) + 1000
+    assert customer_filter.find_unknown([unknown]) == {unknown}
+
+    customer_filter.ready = False
+    assert customer_filter.find_unknown([unknown]) == set()
+
+
+def test_filter_is_disabled_behind_pgbouncer_without_listen_host(
+    app, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CUSTOMER_ID_FILTER', True)
+    monkeypatch.setitem(app.config, 'DB_PGBOUNCER', True)
+    assert get_customer_filter(app) is None
+    app.extensions.pop('customer_id_filter')
+
+
+def test_listeners_connect_to_the_listen_host(app, monkeypatch):
+    assert listener_url(app).host == '127.0.0.1'
+
+    monkeypatch.setitem(app.config, 'DB_PGBOUNCER', True)
+    monkeypatch.setitem(app.config, 'DB_LISTEN_HOST', 'postgres:5433')
+    url = listener_url(app)
+    assert (url.host, url.port, url.database) == ('postgres', 5433, database)
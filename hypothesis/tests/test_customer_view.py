@@ -1,8 +1,16 @@
+import json
 from decimal import Decimal
 
 import pytest
 
-from hypothesis.models import Customer
+from hypothesis.factory import db, has_extension
+from hypothesis.models import Customer, Transaction
+from hypothesis.queries import record_queries
+from hypothesis.statements import rebuild_daily_summaries
+
+
+def read_ndjson(response):
+    return [json.loads(line) for line in response.get_data().splitlines()]
 
 
 # pylint: disable=too-many-arguments
@@ -115,3 +123,356 @@ def test_list_customers_search_by_identifier(client, headers):
     assert response.status_code == 200
     assert len(content) == 1
     assert content[0]['name'] == 'pizza-planet-1'
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_list_customers_with_cursor(client, headers):
+    response = client.get('/customers/?after=', headers=headers)
+
+    content = response.json
+
+    assert response.status_code == 200
+    assert len(content['items']) == 20
+    assert content['items'][0]['_id'] == 1
+    assert content['items'][19]['_id'] == 20
+    assert content['has_more'] is True
+
+    ids = [item['_id'] for item in content['items']]
+    while content['has_more']:
+        response = client.get(
+            f'/customers/?after={content["next"]}', headers=headers
+        )
+        content = response.json
+        ids += [item['_id'] for item in content['items']]
+
+    assert ids == list(range(1, 101))
+    assert content['next'] is None
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_list_customers_with_invalid_cursor(client, headers):
+    response = client.get('/customers/?after=not-a-cursor', headers=headers)
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid value for after'
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_import_customers_csv(client):
+    body = 'name,balance\nnew-1,10.5\ncompany-x,1\nnew-2,\nnew-1,3\n,1\n'
+
+    response = client.post(
+        '/customers/import', data=body, content_type='text/csv'
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert read_ndjson(response) == [
+        {'line': 1, 'name': 'new-1', 'status': 'created'},
+        {'line': 2, 'name': 'company-x', 'status': 'duplicate'},
+        {'line': 3, 'name': 'new-2', 'status': 'created'},
+        {'line': 4, 'name': 'new-1', 'status': 'duplicate'},
+        {'line': 5, 'name': None, 'status': 'invalid'},
+        {'totals': {'created': 2, 'duplicate': 2, 'invalid': 1}},
+    ]
+    assert Customer.query.filter_by(name='new-1').one().balance == Decimal(
+        '10.5'
+    )
+    assert Customer.query.filter_by(name='new-2').one().balance == 0
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_import_customers_ndjson(client):
+    body = '{"name": "new-1"}\n{"name": "pizza-planet-1"}\n{"name": 1}\n'
+
+    response = client.post(
+        '/customers/import', data=body, content_type='application/x-ndjson'
+    )
+
+    assert response.status_code == 200
+    assert read_ndjson(response)[-1] == {
+        'totals': {'created': 1, 'duplicate': 1, 'invalid': 1}
+    }
+
+
+@pytest.mark.usefixtures('session')
+def test_import_customers_commits_before_answering(app, client, monkeypatch):
+    events = []
+    commit = db.session.commit
+    monkeypatch.setattr(
+        db.session, 'commit', lambda: events.append(commit() or 'commit')
+    )
+
+    def after_request(response):
+        events.append('after_request')
+        return response
+
+    # Where read-your-writes tracks the position of the commit
+    monkeypatch.setitem(
+        app.after_request_funcs,
+        None,
+        [*app.after_request_funcs.get(None, ()), after_request],
+    )
+    body = ''.join(f'new-{index}\n' for index in range(5))
+
+    response = client.post(
+        '/customers/import', data='name\n' + body, content_type='text/csv'
+    )
+
+    assert len(read_ndjson(response)) == 6
+    assert events == ['commit', 'after_request']
+    assert Customer.query.count() == 5
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize(
+    'body,content_type',
+    [
+        ('id,name\n1,new-1\n', 'text/csv'),
+        ('name,balance\nnew-1,xyz\n', 'text/csv'),
+        ('{"name": "new-1"}\nnot json\n', 'application/x-ndjson'),
+    ],
+)
+def test_import_customers_badrequest(client, body, content_type):
+    response = client.post(
+        '/customers/import', data=body, content_type=content_type
+    )
+
+    assert response.status_code == 400
+    assert not Customer.query.first()
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+@pytest.mark.parametrize(
+    'name,match,expected_length',
+    [
+        ('pizza-planet-1', 'prefix', 11),
+        ('planet-1', 'prefix', 0),
+        ('pizza%', 'prefix', 0),
+        ('company', 'contains', 2),
+        ('_', 'contains', 0),
+    ],
+)
+def test_list_customers_search_by_name_match(
+    client, headers, name, match, expected_length
+):
+    response = client.get(
+        f'/customers/?name={name}&match={match}', headers=headers
+    )
+
+    assert response.status_code == 200
+    assert len(response.json) == expected_length
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_list_customers_reads_no_ledger_entries(client, headers):
+    with record_queries() as recorder:
+        response = client.get('/customers/?name=company', headers=headers)
+        Customer.query.filter_by(name='company-x').one()
+
+    assert [customer['balance'] for customer in response.json] == [
+        10000,
+        10000,
+    ]
+    statements = [shape for shape, _ in recorder.statements]
+    assert 'FROM customer_balance_slot' in statements[0]
+    assert not any('ledger_entry' in shape for shape in statements)
+    assert 'FROM customer_balance_slot' not in statements[-1]
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_list_customers_search_by_name_fuzzy(client, headers):
+    response = client.get(
+        '/customers/?name=COMPANY-X&match=fuzzy', headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.json[0]['name'] == 'company-x'
+
+
+@pytest.mark.usefixtures('session')
+def test_extensions_are_checked_again_after_a_while(monkeypatch):
+    with record_queries() as recorder:
+        assert not has_extension('not_installed')
+        assert not has_extension('not_installed')
+    assert recorder.count == 1
+
+    monkeypatch.setattr('hypothesis.factory.EXTENSION_TTL', 0)
+    with record_queries() as recorder:
+        assert not has_extension('not_installed')
+    assert recorder.count == 1
+
+
+@pytest.mark.usefixtures('session')
+def test_list_customers_search_by_name_invalid_match(client, headers):
+    response = client.get('/customers/?name=x&match=regex', headers=headers)
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid value for match'
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_customer_statement(client, headers, transaction_payload):
+    customer_id = transaction_payload['customer_source']
+    response = client.get(
+        f'/customers/{customer_id}/statement?from=2025-05-01&to=2025-05-10',
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    statement = response.json
+    assert statement['from'] == '2025-05-01'
+    assert statement['to'] == '2025-05-10'
+    assert [day['day'] for day in statement['days']] == [
+        f'2025-05-{day:02}' for day in range(1, 11)
+    ]
+
+    balance = statement['opening_balance']
+    for day in statement['days']:
+        balance += day['credit_total'] - day['debit_total']
+        assert day['closing_balance'] == pytest.approx(balance)
+    assert statement['closing_balance'] == pytest.approx(balance)
+
+    last = (
+        Transaction.query.filter(
+            (Transaction.customer_source == customer_id)
+            | (Transaction.customer_target == customer_id),
+            Transaction.datetime < '2025-05-01',
+        )
+        .order_by(Transaction.datetime.desc(), Transaction._id.desc())
+        .first()
+    )
+    if last.customer_source == customer_id:
+        opening_balance = last.customer_source_value
+    else:
+        opening_balance = last.customer_target_value
+    assert statement['opening_balance'] == float(opening_balance)
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_customer_statement_matches_rebuilt_summaries(
+    client, headers, transaction_payload
+):
+    url = (
+        f'/customers/{transaction_payload["customer_target"]}/statement'
+        '?from=2025-04-01&to=2025-06-30'
+    )
+    recorded = client.get(url, headers=headers).json
+
+    rebuild_daily_summaries(db.session)
+    db.session.commit()
+
+    assert client.get(url, headers=headers).json == recorded
+    assert recorded['opening_balance'] == 10000
+    assert recorded['closing_balance'] == float(
+        Customer.query.get(transaction_payload['customer_target']).balance
+    )
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_customer_statement_without_transactions(client, headers):
+    customer = Customer.query.filter_by(name='company-x').first()
+    response = client.get(
+        f'/customers/{customer._id}/statement', headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.json['days'] == []
+    assert response.json['opening_balance'] == 10000
+    assert response.json['closing_balance'] == 10000
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize(
+    'query_string, status_code',
+    [('', 404), ('?from=2025-05-10&to=2025-05-01', 400), ('?to=x', 400)],
+)
+def test_customer_statement_badrequest(
+    client, headers, query_string, status_code
+):
+    response = client.get(
+        f'/customers/999999/statement{query_string}', headers=headers
+    )
+
+    assert response.status_code == status_code
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+@pytest.mark.parametrize(
+    'at',
+    ['2025-04-01', '2025-04-25T00:00:00', '2025-05-10T12:00', '2030-01-01'],
+)
+def test_customer_balance_at(client, headers, transaction_payload, at):
+    customer_id = transaction_payload['customer_source']
+    response = client.get(
+        f'/customers/{customer_id}/balance?at={at}', headers=headers
+    )
+
+    # Replays the transactions up to at from the initial balance
+    expected = Decimal('10000')
+    for transaction in Transaction.query.filter(Transaction.datetime <= at):
+        if transaction.customer_source == customer_id:
+            expected -= transaction.value
+        elif transaction.customer_target == customer_id:
+            expected += transaction.value
+
+    assert response.status_code == 200
+    assert response.json['customer_id'] == customer_id
+    assert response.json['balance'] == float(expected)
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_customer_balance_without_transactions(client, headers):
+    customer = Customer.query.filter_by(name='company-x').first()
+    response = client.get(
+        f'/customers/{customer._id}/balance', headers=headers
+    )
+
+    assert response.status_code == 200
+    assert response.json['balance'] == 10000
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize(
+    'query_string, status_code', [('', 404), ('?at=yesterday', 400)]
+)
+def test_customer_balance_badrequest(
+    client, headers, query_string, status_code
+):
+    response = client.get(
+        f'/customers/999999/balance{query_string}', headers=headers
+    )
+
+    assert response.status_code == status_code
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_customers_balances(client, headers, transaction_payload):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+    at = '2025-05-10T12:00:00'
+    response = client.get(
+        f'/customers/balances?ids={target_id},999999,{source_id}&at={at}',
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    assert response.json['at'] == at
+    assert response.json['balances'] == [
+        {
+            'customer_id': customer_id,
+            'balance': client.get(
+                f'/customers/{customer_id}/balance?at={at}', headers=headers
+            ).json['balance'],
+        }
+        for customer_id in (target_id, source_id)
+    ]
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize('ids', ['', '1,x', ','.join(['1'] * 1001)])
+def test_customers_balances_badrequest(client, headers, ids):
+    response = client.get(f'/customers/balances?ids={ids}', headers=headers)
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid value for ids'
@@ -0,0 +1,48 @@
+import json
+from datetime import datetime
+
+import pytest
+from marshmallow import Schema, fields
+
+from hypothesis.encoders import RowEncoder
+from hypothesis.models import Customer, Transaction
+from hypothesis.schemas import CustomerSchema, TransactionSchema
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+@pytest.mark.parametrize(
+    'schema,model',
+    [(TransactionSchema(), Transaction), (CustomerSchema(), Customer)],
+)
+def test_row_encoder_matches_schema_dump(schema, model):
+    encoder = RowEncoder(schema, model)
+
+    objs = model.query.order_by(model._id).all()
+    rows = model.query.with_entities(*encoder.columns).order_by(model._id)
+
+    expected = [schema.dump(obj) for obj in objs]
+    encoded = [encoder(row) for row in rows]
+
+    assert json.dumps(encoded) == json.dumps(expected)
+
+
+def test_row_encoder_keeps_none():
+    encoder = RowEncoder(TransactionSchema(), Transaction)
+    transaction = Transaction(
+        _id=1,
+        datetime=datetime(2025, 4, 20, 10, 30),
+        customer_source=1,
+        customer_target=2,
+    )
+
+    row = tuple(getattr(transaction, column.key) for column in encoder.columns)
+
+    assert encoder(row) == TransactionSchema().dump(transaction)
+
+
+def test_row_encoder_rejects_unsupported_fields():
+    class FormattedSchema(Schema):
+        datetime = fields.DateTime(format='%Y-%m-%d')
+
+    with pytest.raises(TypeError):
+        RowEncoder(FormattedSchema(), Transaction)
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from hypothesis.factory import create_app
+
+
+@pytest.fixture()
+def spec_file(tmp_path):
+    return tmp_path / 'specs' / 'apispec.json'
+
+
+@pytest.fixture()
+def spec_file_app(spec_file):
+    return create_app({'TESTING': True, 'API_SPEC_FILE': str(spec_file)})
+
+
+def test_spec_is_written_by_the_first_request(app, spec_file_app, spec_file):
+    client = spec_file_app.test_client()
+    assert client.get('/apidocs/').status_code == 404
+
+    response = client.get('/apispec_1.json')
+    assert response.status_code == 200
+    assert response.json == app.test_client().get('/apispec_1.json').json
+    assert '/customers/' in response.json['paths']
+    assert json.loads(spec_file.read_text()) == response.json
+
+
+def test_spec_is_served_from_the_file(spec_file_app, spec_file):
+    spec_file.parent.mkdir()
+    spec_file.write_text('{"swagger": "2.0"}')
+
+    response = spec_file_app.test_client().get('/apispec_1.json')
+    assert response.json == {'swagger': '2.0'}
+
+
+def test_build_spec_command(app, tmp_path):
+    output = tmp_path / 'apispec.json'
+    result = app.test_cli_runner().invoke(
+        args=['apispec', 'build', '--output', str(output)]
+    )
+    assert result.exit_code == 0
+    assert '/transactions/' in json.loads(output.read_text())['paths']
+
+    result = app.test_cli_runner().invoke(args=['apispec', 'build'])
+    assert result.exit_code == 1
+    assert 'API_SPEC_FILE is not set' in result.output
@@ -0,0 +1,135 @@
+from concurrent.futures import Future
+from decimal import Decimal
+
+import pytest
+from marshmallow import ValidationError
+from sqlalchemy.exc import DBAPIError
+
+from hypothesis.factory import db
+from hypothesis.group_commit import GroupCommitWriter
+from hypothesis.idempotency import StoredResponse
+from hypothesis.models import Customer, IdempotencyKey, Transaction
+from hypothesis.schemas import TransactionSchema
+
+
+def test_collect_groups_up_to_size(app):
+    writer = GroupCommitWriter(app, size=3, wait=0.01)
+    for index in range(5):
+        writer.queue.put((index, None, None))
+
+    assert [data for data, _, _ in writer.collect()] == [0, 1, 2]
+    assert [data for data, _, _ in writer.collect()] == [3, 4]
+
+
+@pytest.mark.usefixtures('session')
+def test_write_resolves_each_transfer(app, transaction_payload):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+    payloads = [
+        transaction_payload,
+        {**transaction_payload, 'value': 20000},
+        {**transaction_payload, 'customer_target': 0},
+        {**transaction_payload, 'value': 25},
+    ]
+    group = [
+        (TransactionSchema().load(payload), None, Future())
+        for payload in payloads
+    ]
+
+    GroupCommitWriter(app, size=10, wait=0).write(group)
+
+    futures = [future for _, _, future in group]
+    assert futures[0].result()['customer_source_value'] == Decimal('9950')
+    assert futures[3].result()['customer_source_value'] == Decimal('9925')
+    for future, message in (
+        (futures[1], 'Insufficient funds'),
+        (futures[2], 'Invalid identifier(s), customer(s) not found'),
+    ):
+        assert isinstance(future.exception(), ValidationError)
+        assert future.exception().normalized_messages() == {
+            '_schema': [message]
+        }
+
+    assert Transaction.query.count() == 2
+    assert Customer.query.get(source_id).balance == Decimal('9925')
+    assert Customer.query.get(target_id).balance == Decimal('10075')
+
+
+@pytest.mark.usefixtures('session', 'group_commit')
+def test_create_transaction_with_group_commit(
+    client, headers, transaction_payload
+):
+    response = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+
+    assert response.status_code == 201
+    assert response.json['customer_source_value'] == 9950
+    assert response.json['customer_target_value'] == 10050
+    assert Transaction.query.get(response.json['_id']) is not None
+
+    response = client.post(
+        '/transactions/',
+        json={**transaction_payload, 'value': 20000},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert response.json['error'] == {'_schema': ['Insufficient funds']}
+
+
+@pytest.mark.usefixtures('session')
+def test_write_applies_idempotency_keys_once(app, transaction_payload):
+    source_id = transaction_payload['customer_source']
+    payloads = [transaction_payload, transaction_payload, transaction_payload]
+    keys = [('key-1', 'a'), ('key-1', 'a'), ('key-2', 'b')]
+    group = [
+        (TransactionSchema().load(payload), key, Future())
+        for payload, key in zip(payloads, keys)
+    ]
+
+    GroupCommitWriter(app, size=10, wait=0).write(group)
+
+    first, duplicate, other = [future.result() for _, _, future in group]
+    assert first['customer_source_value'] == Decimal('9950')
+    assert other['customer_source_value'] == Decimal('9900')
+    assert isinstance(duplicate, StoredResponse)
+    assert duplicate.status_code == 201
+    assert duplicate.response['_id'] == first['_id']
+    assert Customer.query.get(source_id).balance == Decimal('9900')
+
+
+@pytest.mark.usefixtures('session')
+def test_write_fails_only_the_transfers_rejected_by_the_database(
+    app, transaction_payload
+):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+    # Transfers into it overflow its balance
+    Customer.query.get(source_id).balance = Decimal('999999999990')
+    db.session.commit()
+    payloads = [
+        transaction_payload,
+        {
+            **transaction_payload,
+            'customer_source': target_id,
+            'customer_target': source_id,
+            'value': 100,
+        },
+        {**transaction_payload, 'value': 25},
+    ]
+    keys = [None, ('key-1', 'a'), None]
+    group = [
+        (TransactionSchema().load(payload), key, Future())
+        for payload, key in zip(payloads, keys)
+    ]
+
+    GroupCommitWriter(app, size=10, wait=0).write(group)
+
+    futures = [future for _, _, future in group]
+    assert isinstance(futures[1].exception(), DBAPIError)
+    assert futures[0].result()['customer_target_value'] == Decimal('10050')
+    assert futures[2].result()['customer_target_value'] == Decimal('10075')
+    assert Transaction.query.count() == 2
+    assert Customer.query.get(target_id).balance == Decimal('10075')
+    # Left to a retry
+    assert IdempotencyKey.query.count() == 0
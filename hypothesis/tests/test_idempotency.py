@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from hypothesis.factory import db
+from hypothesis.idempotency import (
+    ResponseCache,
+    StoredResponse,
+    claim_keys,
+    fingerprint,
+)
+from hypothesis.models import Customer, IdempotencyKey, Transaction
+
+
+def post(client, headers, payload, key):
+    return client.post(
+        '/transactions/',
+        json=payload,
+        headers={**headers, 'Idempotency-Key': key},
+    )
+
+
+def test_fingerprint_ignores_keys_order():
+    assert fingerprint({'a': 1, 'b': 2}) == fingerprint({'b': 2, 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 2})
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(size=2, ttl=timedelta(hours=1))
+    for key in ('a', 'b'):
+        cache.put(key, StoredResponse(key, 201, {}))
+    cache.get('a')
+    cache.put('c', StoredResponse('c', 201, {}))
+
+    assert cache.get('b') is None
+    assert cache.get('a').fingerprint == 'a'
+
+    cache = ResponseCache(size=2, ttl=timedelta(0))
+    cache.put('a', StoredResponse('a', 201, {}))
+    assert cache.get('a') is None
+
+
+@pytest.mark.usefixtures('session')
+def test_retry_replays_the_response(app, client, headers, transaction_payload):
+    source_id = transaction_payload['customer_source']
+
+    first = post(client, headers, transaction_payload, 'retry-1')
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    stored = IdempotencyKey.query.get('retry-1')
+    assert (stored.status_code, stored.response) == (201, first.json)
+
+    # Served from the worker cache first, then from the database
+    for _ in range(2):
+        retry = post(client, headers, transaction_payload, 'retry-1')
+        assert retry.status_code == 201
+        assert retry.json == first.json
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        app.extensions.pop('idempotency_cache')
+
+    assert Transaction.query.count() == 1
+    assert Customer.query.get(source_id).balance == Decimal('9950')
+
+
+@pytest.mark.usefixtures('session', 'group_commit')
+def test_retry_replays_the_response_with_group_commit(
+    app, client, headers, transaction_payload
+):
+    first = post(client, headers, transaction_payload, 'retry-2')
+    app.extensions.pop('idempotency_cache')
+    retry = post(client, headers, transaction_payload, 'retry-2')
+
+    assert (first.status_code, retry.status_code) == (201, 201)
+    assert retry.json == first.json
+    assert Transaction.query.count() == 1
+
+
+@pytest.mark.usefixtures('session')
+def test_key_reused_for_another_request(client, headers, transaction_payload):
+    assert (
+        post(client, headers, transaction_payload, 'reused').status_code == 201
+    )
+
+    response = post(
+        client, headers, {**transaction_payload, 'value': 10}, 'reused'
+    )
+    assert response.status_code == 422
+    assert Transaction.query.count() == 1
+
+
+@pytest.mark.usefixtures('session')
+def test_failed_transfer_response_is_stored(
+    client, headers, transaction_payload
+):
+    payload = {**transaction_payload, 'value': 20000}
+
+    response = post(client, headers, payload, 'failed')
+    assert response.status_code == 400
+
+    stored = IdempotencyKey.query.get('failed')
+    assert (stored.status_code, stored.response) == (400, response.json)
+
+
+@pytest.mark.usefixtures('session')
+def test_invalid_key(client, headers, transaction_payload):
+    response = post(client, headers, transaction_payload, 'x' * 256)
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid value for Idempotency-Key'}
+
+
+@pytest.mark.usefixtures('session')
+def test_keys_are_claimed_in_order():
+    keys = {'c': 'x', 'a': 'y', 'b': 'z'}
+    assert claim_keys(db.session, keys) == {'a', 'b', 'c'}
+
+    # Inserted, and locked, one after the other
+    rows = db.session.execute(
+        'SELECT key, fingerprint FROM idempotency_key ORDER BY ctid'
+    )
+    assert list(rows) == [('a', 'y'), ('b', 'z'), ('c', 'x')]
+
+
+@pytest.mark.usefixtures('session')
+def test_purge_command(app):
+    old = datetime.now() - timedelta(hours=25)
+    db.session.add_all(
+        [
+            IdempotencyKey(key='old', fingerprint='a', created_at=old),
+            IdempotencyKey(key='new', fingerprint='b'),
+        ]
+    )
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['idempotency', 'purge'])
+
+    assert result.exit_code == 0
+    assert '1 keys purged' in result.output
+    assert [key.key for key in IdempotencyKey.query] == ['new']
@@ -0,0 +1,133 @@
+from decimal import Decimal
+
+import pytest
+from freezegun import freeze_time
+
+from hypothesis.factory import db
+from hypothesis.ledger import compact_ledger
+from hypothesis.models import (
+    Customer,
+    CustomerDailySummary,
+    LedgerEntry,
+    Transaction,
+)
+
+
+def get_balance(client, headers, customer_id):
+    response = client.get(f'/customers/?id={customer_id}', headers=headers)
+    return response.json[0]['balance']
+
+
+@pytest.mark.usefixtures('session', 'ledger_mode')
+def test_create_transaction_appends_ledger_entries(
+    client, headers, transaction_payload
+):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+
+    response = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+
+    assert response.status_code == 201
+    assert response.json['customer_source_value'] is None
+    assert response.json['customer_target_value'] is None
+    assert Customer.query.get(source_id).balance == Decimal('10000')
+    assert Customer.query.get(target_id).balance == Decimal('10000')
+    assert sorted(
+        (entry.customer_id, entry.amount) for entry in LedgerEntry.query
+    ) == sorted([(source_id, Decimal('-50')), (target_id, Decimal('50'))])
+
+    # Balances read by the API include the entries not compacted yet
+    assert get_balance(client, headers, source_id) == 9950
+    assert get_balance(client, headers, target_id) == 10050
+
+
+@pytest.mark.usefixtures('session', 'ledger_mode')
+def test_create_transaction_insufficient_funds_with_pending_entries(
+    client, headers, transaction_payload
+):
+    transaction_payload['value'] = 6000
+    first = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+    second = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+
+    assert first.status_code == 201
+    assert second.status_code == 400
+    assert second.json['error'] == {'_schema': ['Insufficient funds']}
+
+
+@pytest.mark.usefixtures('session', 'ledger_mode')
+def test_compact_ledger(client, headers, transaction_payload):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+    reverse = {
+        **transaction_payload,
+        'customer_source': target_id,
+        'customer_target': source_id,
+        'value': 20,
+    }
+    response = client.post(
+        '/transactions/batch',
+        json=[transaction_payload, reverse, transaction_payload],
+        headers=headers,
+    )
+    assert response.status_code == 201
+
+    assert compact_ledger(db.session, 4) == 4
+    assert compact_ledger(db.session, 4) == 2
+    assert compact_ledger(db.session, 4) == 0
+    db.session.commit()
+
+    assert LedgerEntry.query.count() == 0
+    assert Customer.query.get(source_id).balance == Decimal('9920')
+    assert Customer.query.get(target_id).balance == Decimal('10080')
+    assert [
+        (transaction.customer_source_value, transaction.customer_target_value)
+        for transaction in Transaction.query.order_by(Transaction._id)
+    ] == [
+        (Decimal('9950'), Decimal('10050')),
+        (Decimal('10030'), Decimal('9970')),
+        (Decimal('9920'), Decimal('10080')),
+    ]
+
+    summary = CustomerDailySummary.query.filter_by(customer_id=source_id).one()
+    assert (summary.debit_count, summary.debit_total) == (2, Decimal('100'))
+    assert (summary.credit_count, summary.credit_total) == (1, Decimal('20'))
+    response = client.get(f'/customers/{source_id}/statement', headers=headers)
+    assert response.json['closing_balance'] == 9920
+
+
+@pytest.mark.usefixtures('session', 'ledger_mode')
+def test_compact_ledger_in_transactions_order(
+    client, headers, transaction_payload
+):
+    for day in ('2025-04-21', '2025-04-20'):
+        with freeze_time(day):
+            client.post(
+                '/transactions/', json=transaction_payload, headers=headers
+            )
+
+    assert compact_ledger(db.session, 10) == 4
+    assert [
+        (transaction.datetime.day, transaction.customer_source_value)
+        for transaction in Transaction.query.order_by(Transaction._id)
+    ] == [(21, Decimal('9900')), (20, Decimal('9950'))]
+
+
+@pytest.mark.usefixtures('session', 'ledger_mode')
+def test_balance_at_with_pending_entries(client, headers, transaction_payload):
+    source_id = transaction_payload['customer_source']
+    with freeze_time('2025-04-20'):
+        client.post(
+            '/transactions/', json=transaction_payload, headers=headers
+        )
+
+    url = f'/customers/{source_id}/balance?at='
+    before = client.get(f'{url}2025-04-19T00:00:00', headers=headers)
+    assert before.json['balance'] == 10000
+    after = client.get(f'{url}2025-04-21T00:00:00', headers=headers)
+    assert after.json['balance'] == 9950
@@ -0,0 +1,127 @@
+import io
+import logging
+import threading
+import time
+
+from hypothesis import logs
+from hypothesis.logs import (
+    BatchStreamHandler,
+    QueueLogHandler,
+    create_queue_handler,
+    queue_logger,
+)
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+class BlockingHandler(logging.Handler):
+    """Handler stuck on its first record until released"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.entered.set()
+        self.released.wait(5)
+        self.messages.append(record.getMessage())
+
+
+def get_logger(name, handler):
+    logger = logging.getLogger(f'hypothesis.tests.{name}')
+    logger.propagate = False
+    logger.handlers = [handler]
+    return logger
+
+
+def test_records_are_written_in_batches():
+    stream = CountingStream()
+    handler = BatchStreamHandler(stream, batch_size=10)
+    logger = get_logger('batches', handler)
+
+    for i in range(25):
+        logger.warning('record %s', i)
+    assert stream.writes == 2
+
+    handler.flush()
+    assert stream.writes == 3
+    assert stream.getvalue().splitlines() == [f'record {i}' for i in range(25)]
+
+
+def test_records_are_written_by_a_thread():
+    stream = CountingStream()
+    handler = create_queue_handler(stream, queue_size=100, batch_size=10)
+    handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+    logger = get_logger('thread', handler)
+    values = [1]
+
+    logger.warning('values %s', values)
+    # Arguments are the ones at the time of the call
+    values.append(2)
+    handler.stop()
+
+    assert stream.getvalue() == 'WARNING values [1]\n'
+    assert handler.listener._thread is None
+
+
+def test_records_are_dropped_when_the_queue_is_full():
+    target = BlockingHandler()
+    handler = QueueLogHandler(target, queue_size=2)
+    logger = get_logger('full', handler)
+
+    logger.warning('first')
+    assert target.entered.wait(5)
+    for i in range(5):
+        logger.warning('queued %s', i)
+    assert handler.dropped == 3
+
+    target.released.set()
+    handler.stop()
+    assert target.messages == [
+        'first',
+        'queued 0',
+        'queued 1',
+        '3 log records dropped, queue full',
+    ]
+
+
+def test_stop_gives_up_on_a_stuck_target(monkeypatch):
+    monkeypatch.setattr(logs, 'STOP_TIMEOUT', 0.1)
+    target = BlockingHandler()
+    handler = QueueLogHandler(target, queue_size=2)
+    logger = get_logger('stuck', handler)
+
+    logger.warning('first')
+    assert target.entered.wait(5)
+    for i in range(2):
+        logger.warning('queued %s', i)
+
+    started = time.monotonic()
+    handler.stop()
+    assert time.monotonic() - started < 1
+    assert handler.dropped == 2
+    target.released.set()
+
+
+def test_queue_logger():
+    stream = io.StringIO()
+    logger = get_logger('access', logging.StreamHandler(stream))
+
+    queue_logger(logger)
+    [handler] = logger.handlers
+    assert isinstance(handler, QueueLogHandler)
+    assert handler.target.stream is stream
+
+    logger.warning('GET /customers/')
+    handler.stop()
+    assert stream.getvalue() == 'GET /customers/\n'
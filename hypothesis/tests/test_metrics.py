@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from hypothesis.metrics import render_metrics
+
+# The workers import hypothesis from the repository, wherever tests run from
+ROOT = Path(__file__).resolve().parents[2]
+WORKER = '''
+from hypothesis.metrics import QUERY_DURATION
+QUERY_DURATION.observe(0.01)
+'''
+
+
+@pytest.mark.usefixtures('session')
+def test_metrics_view(client, headers):
+    client.get('/customers/', headers=headers)
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    metrics = response.data.decode()
+    assert (
+        'http_request_duration_seconds_count{endpoint="api.customer",'
+        'method="GET",status="200"}'
+    ) in metrics
+    assert 'http_requests_in_flight 1.0' in metrics
+    assert 'db_query_duration_seconds_count' in metrics
+    assert 'db_pool_wait_seconds_count' in metrics
+
+
+def test_metrics_add_up_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    for _ in range(2):
+        subprocess.run([sys.executable, '-c', WORKER], check=True, cwd=ROOT)
+
+    assert b'db_query_duration_seconds_count 2.0' in render_metrics()
@@ -0,0 +1,64 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from hypothesis.factory import db
+from hypothesis.partitions import add_months, create_partitions
+
+MONTHS = [
+    'transaction_y2025m04',
+    'transaction_y2025m05',
+    'transaction_y2025m06',
+]
+
+
+def count_by_partition():
+    rows = db.session.execute(
+        text(
+            'SELECT tableoid::regclass::text, count(*) FROM transaction '
+            'GROUP BY 1'
+        )
+    )
+    return dict(rows.all())
+
+
+@pytest.mark.parametrize(
+    'month, count, expected',
+    [
+        (date(2025, 4, 1), 1, date(2025, 5, 1)),
+        (date(2025, 12, 1), 1, date(2026, 1, 1)),
+        (date(2025, 1, 1), 14, date(2026, 3, 1)),
+    ],
+)
+def test_add_months(month, count, expected):
+    assert add_months(month, count) == expected
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_create_partitions_moves_default_rows():
+    before = count_by_partition()
+
+    assert create_partitions(db.session, date(2025, 4, 20), 3) == MONTHS
+    assert create_partitions(db.session, date(2025, 5, 1), 1) == []
+
+    after = count_by_partition()
+    assert (
+        'transaction_default' in before and 'transaction_default' not in after
+    )
+    assert sum(after.values()) == sum(before.values()) == 100
+
+    plan = '\n'.join(
+        db.session.execute(
+            text(
+                'EXPLAIN SELECT * FROM transaction '
+                'WHERE datetime >= :start AND datetime < :end'
+            ),
+            {'start': date(2025, 5, 10), 'end': date(2025, 5, 11)},
+        ).scalars()
+    )
+    scanned = {name for name in MONTHS if name in plan}
+    assert scanned == {'transaction_y2025m05'}
+
+    # Partitions are discarded with the test transaction
+    db.session.rollback()
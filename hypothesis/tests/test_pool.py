@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from hypothesis.factory import db
+from hypothesis.pool import TimedQueuePool, get_pool_stats
+from .conftest import address, database
+
+
+def test_pool_records_waits_and_timeouts():
+    engine = create_engine(
+        f'{address}/{database}',
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    connection = engine.connect()
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+
+    stats = get_pool_stats(engine)
+    assert (stats['size'], stats['checked_out']) == (1, 1)
+    assert (stats['checkouts'], stats['timeouts']) == (1, 1)
+    assert stats['wait_max_ms'] >= 100
+
+    connection.close()
+    engine.dispose()
+    assert get_pool_stats(engine)['timeouts'] == 1
+
+
+def test_engines_use_the_configured_pool(app):
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    pool = db.get_engine(app).pool
+    share = app.config['DB_MAX_CONNECTIONS'] // app.config['WEB_WORKERS']
+    share -= app.config['DB_LISTENERS']
+
+    assert isinstance(pool, TimedQueuePool)
+    assert pool.size() == options['pool_size']
+    assert pool.size() + options['max_overflow'] <= max(share, 1)
+
+
+@pytest.mark.usefixtures('session')
+def test_pool_view(client, headers):
+    response = client.get('/pool', headers=headers)
+
+    assert response.status_code == 200
+    assert set(response.json['default']) >= {
+        'size',
+        'checked_out',
+        'checkouts',
+        'timeouts',
+        'wait_avg_ms',
+        'wait_max_ms',
+    }
@@ -0,0 +1,96 @@
+import cProfile
+import os
+import pstats
+import time
+
+import pytest
+
+from hypothesis.factory import create_app
+from hypothesis.profiling import PROFILE_HEADER, create_token, fold_stacks
+from .conftest import address, database
+
+
+def leaf():
+    time.sleep(0.01)
+
+
+def branch():
+    leaf()
+
+
+def root():
+    leaf()
+    branch()
+
+
+@pytest.fixture()
+def profiled_app(tmp_path):
+    return create_app(
+        {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'{address}/{database}',
+            'PROFILE_SECRET': 'secret',
+            'PROFILE_DIR': str(tmp_path),
+        }
+    )
+
+
+def test_views_are_left_alone_without_profiling(app):
+    assert not hasattr(app.view_functions['api.customer'], '__wrapped__')
+
+
+def test_fold_stacks():
+    profiler = cProfile.Profile()
+    profiler.runcall(root)
+
+    folded = fold_stacks(pstats.Stats(profiler))
+
+    sleeps = {
+        stack: value
+        for stack, value in folded.items()
+        if stack.endswith('time.sleep>')
+    }
+    assert set(sleeps) == {
+        'root (test_profiling.py:21);leaf (test_profiling.py:13);'
+        '<built-in method time.sleep>',
+        'root (test_profiling.py:21);branch (test_profiling.py:17);'
+        'leaf (test_profiling.py:13);<built-in method time.sleep>',
+    }
+    assert all(9000 < value < 20000 for value in sleeps.values())
+
+
+@pytest.mark.usefixtures('session')
+def test_signed_requests_are_profiled(profiled_app, tmp_path):
+    client = profiled_app.test_client()
+    client.get('/customers/', headers={PROFILE_HEADER: 'forged'})
+    assert not os.listdir(tmp_path)
+
+    client.get(
+        '/customers/', headers={PROFILE_HEADER: create_token(profiled_app)}
+    )
+    [profile] = os.listdir(tmp_path / 'api.customer.get')
+    assert profile.endswith('.prof')
+
+    runner = profiled_app.test_cli_runner()
+    result = runner.invoke(args=['profiling', 'merge', 'api.customer.get'])
+    assert result.exit_code == 0
+    assert ';get (views.py:' in result.output
+
+    merged = tmp_path / 'merged.prof'
+    result = runner.invoke(
+        args=[
+            'profiling',
+            'merge',
+            'api.customer.get',
+            '--format',
+            'pstats',
+            '--output',
+            str(merged),
+        ]
+    )
+    assert result.exit_code == 0
+    assert pstats.Stats(str(merged)).total_calls
+
+    result = runner.invoke(args=['profiling', 'merge', 'api.transaction.get'])
+    assert result.exit_code == 1
+    assert 'No profiles' in result.output
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from hypothesis.models import Customer
+from hypothesis.queries import normalize, record_queries
+
+
+@pytest.mark.parametrize(
+    'statement, shape',
+    [
+        (
+            'SELECT * FROM customer\n WHERE id IN (%(id_1_1)s, %(id_1_2)s)',
+            'SELECT * FROM customer WHERE id IN (...)',
+        ),
+        (
+            "SELECT 1 WHERE name = 'it''s' AND balance > 10.5",
+            'SELECT ? WHERE name = ? AND balance > ?',
+        ),
+        (
+            'INSERT INTO t (a) VALUES (%(a_m0)s), (%(a_m1)s), (%(a_m2)s)',
+            'INSERT INTO t (a) VALUES (...)',
+        ),
+    ],
+)
+def test_normalize(statement, shape):
+    assert normalize(statement) == shape
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_requests_report_their_statements(client, headers, queries):
+    response = client.get('/customers/', headers=headers)
+
+    assert response.status_code == 200
+    # The page and the COUNT of paginate
+    assert queries.count == 2
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert response.headers['Server-Timing'].endswith('desc="2 queries"')
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_repeated_statements_are_flagged(app, client, caplog, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUERY_LOG_MAX_COUNT', 1)
+    with record_queries(repeat_threshold=3) as queries:
+        for customer_id in range(1, 5):
+            Customer.query.get(customer_id)
+
+    [(shape, snippet)] = queries.repeated.items()
+    assert queries.shapes[shape] == 4
+    assert 'WHERE customer.id = ?' in shape
+    assert 'test_queries.py' in snippet
+
+    with caplog.at_level(logging.WARNING, logger='hypothesis.queries'):
+        client.get('/customers/')
+    assert 'GET /customers/? ran 2 statements' in caplog.text
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+from flask import g
+from sqlalchemy import create_engine, event
+
+from hypothesis.factory import create_app, db
+from hypothesis.models import Customer
+from hypothesis.replicas import LSN_HEADER, Replica, ReplicaRouter, parse_lsn
+from .conftest import address, database
+
+replica_uri = os.environ.get('TEST_REPLICA_URI')
+
+
+@pytest.fixture()
+def router(app, monkeypatch):
+    # WAL position replayed and age of the last transaction replayed
+    statuses = {'replica_0': (100, 0), 'replica_1': (300, 0)}
+
+    monkeypatch.setattr(
+        Replica, 'read_status', lambda replica: statuses[replica.bind]
+    )
+    monkeypatch.setattr(
+        ReplicaRouter, 'read_primary_lsn', lambda router: router.primary_lsn
+    )
+    # Checked on every choice
+    router = ReplicaRouter(app, ['replica_0', 'replica_1'], 1, 0)
+    router.statuses = statuses
+    router.primary_lsn = 300
+    return router
+
+
+def test_parse_lsn():
+    assert parse_lsn('0/16B3748') == 0x16B3748
+    assert parse_lsn('1/0') == 1 << 32
+    assert parse_lsn('0/20') > parse_lsn('0/1F')
+    with pytest.raises(ValueError):
+        parse_lsn('nope')
+
+
+def test_router_takes_turns(router):
+    assert [router.choose() for _ in range(4)] == [
+        'replica_0',
+        'replica_1',
+        'replica_0',
+        'replica_1',
+    ]
+
+
+def test_router_skips_late_replicas(router):
+    assert router.choose(min_lsn=200) == 'replica_1'
+    assert router.choose(min_lsn=200) == 'replica_1'
+    assert router.choose(min_lsn=400) is None
+
+    router.primary_lsn = 400
+    router.statuses['replica_1'] = (300, 5)
+    assert {router.choose() for _ in range(2)} == {'replica_0'}
+
+    router.statuses['replica_0'] = (None, None)
+    assert router.choose() is None
+
+
+def test_router_checks_replicas_against_the_primary(router):
+    # Caught up however long ago its last transaction was, the other one
+    # stopped receiving the WAL
+    router.statuses['replica_0'] = (300, 3600)
+    router.statuses['replica_1'] = (200, 3600)
+    assert {router.choose() for _ in range(2)} == {'replica_0'}
+
+    router.statuses['replica_1'] = (200, None)
+    assert router.choose(min_lsn=200) == 'replica_0'
+
+
+def test_session_reads_from_the_request_replica(app):
+    replica = create_engine(f'{address}/{database}')
+    session = db.create_scoped_session()()
+    # A context of its own, the one of the tests outlives the request
+    with app.app_context(), app.test_request_context('/'):
+        assert session.get_bind() is not replica
+        g.replica = replica
+        assert session.get_bind() is replica
+    session.close()
+
+
+@pytest.mark.skipif(
+    not replica_uri,
+    reason='Set TEST_REPLICA_URI to a replica of the test database',
+)
+def test_read_your_writes_from_replica(monkeypatch, headers):
+    replicated = create_app(
+        {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': f'{address}/{database}',
+            'SQLALCHEMY_BINDS': {'replica_0': replica_uri},
+        }
+    )
+    monkeypatch.setattr(db, 'session', db.create_scoped_session())
+    reads = []
+    with replicated.app_context():
+        event.listen(
+            db.get_engine(replicated, bind='replica_0'),
+            'before_cursor_execute',
+            lambda *args: reads.append(args[2]),
+        )
+    client = replicated.test_client()
+
+    response = client.post(
+        '/customers/', json={'name': 'replicated-customer'}, headers=headers
+    )
+    assert response.status_code == 201
+    min_lsn = response.headers[LSN_HEADER]
+
+    try:
+        response = client.get(
+            '/customers/?name=replicated-customer',
+            headers={LSN_HEADER: min_lsn},
+        )
+        assert [customer['name'] for customer in response.json] == [
+            'replicated-customer'
+        ]
+        assert any('FROM customer' in statement for statement in reads)
+    finally:
+        with replicated.app_context():
+            Customer.query.filter_by(name='replicated-customer').delete()
+            db.session.commit()
@@ -0,0 +1,224 @@
+from decimal import Decimal
+
+import pytest
+from freezegun import freeze_time
+
+from hypothesis.factory import db
+from hypothesis.models import Customer, CustomerBalanceSlot, Transaction
+from hypothesis.slots import reshard, split
+
+
+def get_slots(customer_id):
+    return [
+        slot.balance
+        for slot in CustomerBalanceSlot.query.filter_by(
+            customer_id=customer_id
+        ).order_by(CustomerBalanceSlot.slot)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def checkpoints(monkeypatch):
+    """Transfers of sharded customers which gather their slots, in order"""
+    taken = []
+    monkeypatch.setattr(
+        'hypothesis.transfers.takes_checkpoint',
+        lambda: taken.pop(0) if taken else False,
+    )
+    return taken
+
+
+def get_balance(client, headers, customer_id):
+    response = client.get(f'/customers/?id={customer_id}', headers=headers)
+    return response.json[0]['balance']
+
+
+@pytest.mark.parametrize(
+    'balance, count, expected',
+    [
+        ('10000', 3, ['3333.34', '3333.33', '3333.33']),
+        ('0.05', 2, ['0.03', '0.02']),
+        ('0', 2, ['0', '0']),
+    ],
+)
+def test_split(balance, count, expected):
+    assert split(Decimal(balance), count) == [Decimal(x) for x in expected]
+
+
+@pytest.mark.usefixtures('session')
+def test_reshard(client, headers, transaction_payload):
+    customer_id = transaction_payload['customer_source']
+
+    assert reshard(db.session, customer_id, 3) == Decimal('10000')
+    db.session.commit()
+
+    customer = Customer.query.get(customer_id)
+    assert (customer.balance, customer.balance_slots) == (0, 3)
+    assert get_slots(customer_id) == split(Decimal('10000'), 3)
+    assert get_balance(client, headers, customer_id) == 10000
+
+    assert reshard(db.session, customer_id, 0) == Decimal('10000')
+    db.session.commit()
+
+    assert (customer.balance, customer.balance_slots) == (10000, 0)
+    assert get_slots(customer_id) == []
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transactions_with_sharded_customers(
+    client, headers, transaction_payload
+):
+    source_id = transaction_payload['customer_source']
+    target_id = transaction_payload['customer_target']
+    reshard(db.session, source_id, 3)
+    reshard(db.session, target_id, 2)
+    db.session.commit()
+
+    # No slot can cover 5000 alone, they are gathered for it
+    values = []
+    for value in (50, 5000):
+        response = client.post(
+            '/transactions/',
+            json={**transaction_payload, 'value': value},
+            headers=headers,
+        )
+        assert response.status_code == 201
+        values.append(response.json['customer_source_value'])
+
+    # Unknown without locking every slot
+    assert values == [None, 4950]
+    assert response.json['customer_target_value'] is None
+    assert sum(get_slots(source_id)) == Decimal('4950')
+    assert max(get_slots(source_id)) - min(get_slots(source_id)) <= 1
+    assert sum(get_slots(target_id)) == Decimal('15050')
+    assert get_balance(client, headers, target_id) == 15050
+
+    response = client.post(
+        '/transactions/',
+        json={**transaction_payload, 'value': 6000},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert response.json['error'] == {'_schema': ['Insufficient funds']}
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transactions_batch_with_sharded_customer(
+    client, headers, transaction_payload
+):
+    target_id = transaction_payload['customer_target']
+    reshard(db.session, target_id, 4)
+    db.session.commit()
+
+    response = client.post(
+        '/transactions/batch', json=[transaction_payload] * 3, headers=headers
+    )
+
+    assert response.status_code == 201
+    assert [
+        (
+            result['transaction']['customer_source_value'],
+            result['transaction']['customer_target_value'],
+        )
+        for result in response.json['results']
+    ] == [(9950, 10050), (9900, 10100), (9850, 10150)]
+    assert get_slots(target_id) == split(Decimal('10150'), 4)
+    assert Customer.query.get(target_id).balance == 0
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_reshard_command(app):
+    customer_id = Customer.query.filter_by(name='company-x').first()._id
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(
+        args=['customers', 'reshard', str(customer_id), '--slots', '2']
+    )
+    assert result.exit_code == 0
+    assert get_slots(customer_id) == [Decimal('5000'), Decimal('5000')]
+
+    result = runner.invoke(args=['customers', 'reshard', '0', '--slots', '2'])
+    assert result.exit_code == 1
+    assert 'Customer not found' in result.output
+
+
+@pytest.mark.usefixtures('session')
+def test_statement_of_sharded_customer(client, headers, transaction_payload):
+    target_id = transaction_payload['customer_target']
+    reshard(db.session, target_id, 4)
+    db.session.commit()
+
+    for _ in range(5):
+        response = client.post(
+            '/transactions/', json=transaction_payload, headers=headers
+        )
+        assert response.status_code == 201
+
+    response = client.get(f'/customers/{target_id}/statement', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json['opening_balance'] == 10000
+    assert response.json['closing_balance'] == 10250
+    [day] = response.json['days']
+    assert (day['credit_total'], day['credit_count']) == (250, 5)
+    assert day['closing_balance'] == 10250
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize(
+    'at', ['2025-04-01', '2025-04-20T12:00', '2025-04-21T12:00', '2030-01-01']
+)
+def test_balance_at_of_sharded_customer(
+    client, headers, transaction_payload, at
+):
+    target_id = transaction_payload['customer_target']
+    for day, slots in (
+        ('2025-04-20', 3),
+        ('2025-04-21', 0),
+        ('2025-04-22', 2),
+    ):
+        with freeze_time(day):
+            for value in (10, 20):
+                response = client.post(
+                    '/transactions/',
+                    json={**transaction_payload, 'value': value},
+                    headers=headers,
+                )
+                assert response.status_code == 201
+        reshard(db.session, target_id, slots)
+        db.session.commit()
+
+    response = client.get(
+        f'/customers/{target_id}/balance?at={at}', headers=headers
+    )
+
+    expected = Decimal('10000') + sum(
+        transaction.value
+        for transaction in Transaction.query.filter(Transaction.datetime <= at)
+    )
+    assert response.json['balance'] == float(expected)
+
+
+@pytest.mark.usefixtures('session')
+def test_checkpoints_store_balances_of_sharded_customer(
+    client, headers, transaction_payload, checkpoints
+):
+    target_id = transaction_payload['customer_target']
+    reshard(db.session, target_id, 3)
+    db.session.commit()
+
+    checkpoints.extend([False, True, False])
+    values = []
+    for _ in range(3):
+        response = client.post(
+            '/transactions/', json=transaction_payload, headers=headers
+        )
+        values.append(response.json['customer_target_value'])
+
+    assert values == [None, 10100, None]
+    assert sum(get_slots(target_id)) == Decimal('10150')
+    for at, balance in (('2000-01-01', 10000), ('2100-01-01', 10150)):
+        response = client.get(
+            f'/customers/{target_id}/balance?at={at}', headers=headers
+        )
+        assert response.json['balance'] == balance
@@ -1,8 +1,19 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
 from decimal import Decimal
 
 import pytest
+from freezegun import freeze_time
 
+from hypothesis.factory import db
+from hypothesis.ledger import compact_ledger
 from hypothesis.models import Customer, Transaction
+from hypothesis.queries import record_queries
+from hypothesis.schemas import TransactionSchema
+from hypothesis.transfers import create_transaction, transfer_batch
 
 
 # pylint: disable=too-many-arguments
@@ -25,9 +36,58 @@ def test_create_transaction_with_success(client, headers, transaction_payload):
     assert transaction.customer_target == content['customer_target']
     assert transaction.value == Decimal('50')
     assert (
-        transaction.customer_source_value == source.balance == Decimal('-50')
+        transaction.customer_source_value == source.balance == Decimal('9950')
+    )
+    assert (
+        transaction.customer_target_value == target.balance == Decimal('10050')
     )
-    assert transaction.customer_target_value == target.balance == Decimal('50')
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transaction_ignores_balances_sent(
+    client, headers, transaction_payload
+):
+    transaction_payload['customer_source_value'] = 1000000
+    transaction_payload['customer_target_value'] = 1000000
+
+    response = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+
+    assert response.status_code == 201
+    assert response.json['customer_source_value'] == 9950
+    assert response.json['customer_target_value'] == 10050
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transaction_stamped_once_customers_are_locked(
+    transaction_payload,
+):
+    transaction_payload['datetime'] = '2030-01-01T00:00:00'
+    with freeze_time('2025-04-20') as frozen:
+        data = TransactionSchema().load(transaction_payload)
+        items = TransactionSchema(many=True).load([transaction_payload])
+        frozen.move_to('2025-04-21')
+        transaction = create_transaction(db.session, data)
+        transfer_batch(db.session, items)
+
+    assert transaction.datetime == datetime(2025, 4, 21)
+    assert items[0]['datetime'] == datetime(2025, 4, 21)
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transaction_insufficient_funds(
+    client, headers, transaction_payload
+):
+    transaction_payload['value'] = 10000.01
+
+    response = client.post(
+        '/transactions/', json=transaction_payload, headers=headers
+    )
+
+    assert response.status_code == 400
+    assert response.json['error'] == {'_schema': ['Insufficient funds']}
+    assert not Transaction.query.first()
 
 
 @pytest.mark.usefixtures('session')
@@ -107,6 +167,11 @@ def test_create_transaction_customer_shouldnt_be_the_same(
         ('value', {}, {'value': ['Not a valid number.']}),
         ('value', -10, {'value': ['Must be greater than 0.']}),
         ('value', 0, {'value': ['Must be greater than 0.']}),
+        (
+            'value',
+            1e12,
+            {'value': ['Must be less than or equal to 999999999999.99.']},
+        ),
     ],
 )
 def test_create_transaction_badrequest_invalid_data_type(
@@ -198,3 +263,310 @@ def test_list_transactions_search_by_date(client, headers):
     content = response.json
     assert response.status_code == 200
     assert len(content) == 0
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_with_cursor(client, headers):
+    response = client.get('/transactions/?after=', headers=headers)
+
+    content = response.json
+
+    assert response.status_code == 200
+    assert len(content['items']) == 20
+    assert content['has_more'] is True
+
+    items = content['items']
+    while content['has_more']:
+        response = client.get(
+            f'/transactions/?after={content["next"]}', headers=headers
+        )
+        content = response.json
+        items += content['items']
+
+    keys = [(item['datetime'], item['_id']) for item in items]
+    assert len(items) == 100
+    assert keys == sorted(keys)
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_with_cursor_and_filter(client, headers):
+    response = client.get(
+        '/transactions/?after=&date=2025-04-25', headers=headers
+    )
+
+    content = response.json
+
+    assert response.status_code == 200
+    assert len(content['items']) == 3
+    assert content['has_more'] is False
+    assert content['next'] is None
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transactions_batch(client, headers, transaction_payload):
+    reverse_payload = {
+        'customer_source': transaction_payload['customer_target'],
+        'customer_target': transaction_payload['customer_source'],
+        'value': 20,
+    }
+
+    response = client.post(
+        '/transactions/batch',
+        json=[transaction_payload, reverse_payload, transaction_payload],
+        headers=headers,
+    )
+
+    results = response.json['results']
+    source = Customer.query.get(transaction_payload['customer_source'])
+
+    assert response.status_code == 201
+    assert [result['status'] for result in results] == [201, 201, 201]
+    assert [
+        result['transaction']['customer_source_value'] for result in results
+    ] == [9950, 10030, 9920]
+    assert Transaction.query.count() == 3
+    assert source.balance == Decimal('9920')
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transactions_batch_atomic_rejects_all(
+    client, headers, transaction_payload
+):
+    invalid_payload = {**transaction_payload, 'value': 1000000}
+
+    response = client.post(
+        '/transactions/batch',
+        json=[transaction_payload, invalid_payload],
+        headers=headers,
+    )
+
+    results = response.json['results']
+
+    assert response.status_code == 400
+    assert [result['status'] for result in results] == [424, 400]
+    assert results[1]['error'] == {'_schema': ['Insufficient funds']}
+    assert not Transaction.query.first()
+
+
+@pytest.mark.usefixtures('session')
+def test_create_transactions_batch_best_effort_ndjson(
+    client, transaction_payload
+):
+    lines = [
+        json.dumps(transaction_payload),
+        json.dumps({**transaction_payload, 'customer_target': 999}),
+        json.dumps({**transaction_payload, 'value': -1}),
+        json.dumps(transaction_payload),
+    ]
+
+    response = client.post(
+        '/transactions/batch?mode=best_effort',
+        data='\n'.join(lines),
+        content_type='application/x-ndjson',
+    )
+
+    results = response.json['results']
+
+    assert response.status_code == 200
+    assert [result['status'] for result in results] == [201, 400, 400, 201]
+    assert results[1]['error'] == {
+        '_schema': ['Invalid identifier(s), customer(s) not found']
+    }
+    assert results[2]['error'] == {'value': ['Must be greater than 0.']}
+    assert results[3]['transaction']['customer_source_value'] == 9900
+    assert Transaction.query.count() == 2
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_search_by_date_range(client, headers):
+    response = client.get(
+        '/transactions/?date_from=2025-04-25&date_to=2025-04-26&after=',
+        headers=headers,
+    )
+
+    content = response.json
+
+    assert response.status_code == 200
+    assert len(content['items']) == 5
+    assert all(
+        '2025-04-25' <= item['datetime'] < '2025-04-27'
+        for item in content['items']
+    )
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_search_by_customer_id_with_cursor(client, headers):
+    customer_id = Customer.query.filter_by(name='company-x').one()._id
+
+    items, cursor = [], ''
+    while cursor is not None:
+        response = client.get(
+            f'/transactions/?customer_id={customer_id}&after={cursor}',
+            headers=headers,
+        )
+        items += response.json['items']
+        cursor = response.json['next']
+
+    keys = [(item['datetime'], item['_id']) for item in items]
+    assert len(items) == 100
+    assert keys == sorted(keys)
+
+
+@pytest.mark.usefixtures('session')
+@pytest.mark.parametrize(
+    'argument', ['date', 'date_from', 'date_to', 'customer_id']
+)
+def test_list_transactions_invalid_filter(client, headers, argument):
+    response = client.get(
+        f'/transactions/?{argument}=2025-13-01', headers=headers
+    )
+
+    assert response.status_code == 400
+    assert response.json['error'] == f'Invalid value for {argument}'
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_export_transactions_ndjson(client):
+    response = client.get('/transactions/export?date=2025-04-25')
+
+    lines = response.get_data(as_text=True).splitlines()
+    listed = client.get('/transactions/?date=2025-04-25&after=').json
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in lines] == listed['items']
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_export_transactions_csv_gzip(client):
+    customer_id = Customer.query.filter_by(name='company-x').one()._id
+
+    response = client.get(
+        f'/transactions/export?format=csv&customer_id={customer_id}',
+        headers={'Accept-Encoding': 'gzip'},
+    )
+
+    rows = list(
+        csv.DictReader(
+            io.StringIO(gzip.decompress(response.get_data()).decode())
+        )
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(rows) == 100
+    assert rows[0]['value'] == '50.0'
+    assert [row['datetime'] for row in rows] == sorted(
+        row['datetime'] for row in rows
+    )
+
+
+@pytest.mark.usefixtures('session')
+def test_export_transactions_invalid_format(client):
+    response = client.get('/transactions/export?format=xml')
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid value for format'
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_of_past_dates_are_immutable(client):
+    response = client.get('/transactions/?date=2025-04-25&page=1')
+    assert response.cache_control.immutable
+    etag = response.headers['ETag']
+
+    # Whatever the order of the arguments, without querying the database
+    with record_queries() as recorder:
+        response = client.get(
+            '/transactions/?page=1&date=2025-04-25',
+            headers={'If-None-Match': etag},
+        )
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert recorder.count == 0
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_etag_changes_with_transactions(
+    client, headers, transaction_payload
+):
+    for url in ('/transactions/', '/transactions/?customer_id=100'):
+        response = client.get(url)
+        assert response.cache_control.no_cache
+        etag = response.headers['ETag']
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        client.post(
+            '/transactions/', json=transaction_payload, headers=headers
+        )
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+
+@pytest.mark.usefixtures('session', 'customers_saved')
+def test_list_transactions_etag_changes_with_transactions_committed_late(
+    client, transaction_payload
+):
+    data = TransactionSchema().load(transaction_payload)
+    create_transaction(db.session, data)
+    db.session.commit()
+    response = client.get('/transactions/')
+    etag = response.headers['ETag']
+
+    # Committed after the transaction of the next identifier
+    late = Transaction.query.one()._id - 1
+    db.session.add(
+        Transaction(
+            _id=late,
+            datetime=datetime.now(),
+            customer_source=data['customer_source'],
+            customer_target=data['customer_target'],
+            value=data['value'],
+        )
+    )
+    db.session.commit()
+    response = client.get('/transactions/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [item['_id'] for item in response.json] == [late + 1, late]
+
+
+@pytest.mark.usefixtures('session', 'transactions_saved')
+def test_list_transactions_full_cursor_pages_are_immutable(client):
+    content = {'next': '', 'has_more': True}
+    while content['has_more']:
+        url = f'/transactions/?after={content["next"]}'
+        response = client.get(url)
+        content = response.json
+        assert response.cache_control.immutable is content['has_more']
+
+    # The last one is revalidated
+    assert response.cache_control.no_cache
+    response = client.get(
+        url, headers={'If-None-Match': response.headers['ETag']}
+    )
+    assert response.status_code == 304
+
+
+@pytest.mark.usefixtures('session', 'customers_saved', 'ledger_mode')
+def test_list_transactions_pending_ledger_entries_are_not_immutable(
+    client, headers, transaction_payload
+):
+    with freeze_time('2025-04-20'):
+        client.post(
+            '/transactions/', json=transaction_payload, headers=headers
+        )
+
+    url = '/transactions/?date=2025-04-25'
+    response = client.get(url)
+    assert response.cache_control.no_cache
+    etag = response.headers['ETag']
+
+    compact_ledger(db.session, 100)
+    db.session.commit()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.cache_control.immutable
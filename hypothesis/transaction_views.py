@@ -0,0 +1,195 @@
+import csv
+import io
+import json
+import zlib
+
+from flask import (
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
+from marshmallow.exceptions import ValidationError
+
+from hypothesis.cache import customer_ids, invalidate_customers
+from hypothesis.commons import BaseView
+from hypothesis.customer_ids import find_unknown_customers
+from hypothesis.factory import db
+from hypothesis.ledger import append_batch
+from hypothesis.transfers import transfer_batch
+from hypothesis.views import TransactionView
+
+
+class TransactionExportView(TransactionView):
+    formats = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self):
+        """
+        file: ../flasgger/get_transactions_export.yml
+        """
+        export_format = self.query_string.get('format', 'ndjson')
+        if export_format not in self.formats:
+            error = 'Invalid value for format'
+            abort(make_response(jsonify(error=error), 400))
+
+        # yield_per streams the rows through a server-side cursor, so memory
+        # stays flat whatever the number of transactions exported
+        rows = (
+            self.filter_query(self.query)
+            .with_entities(*self.encoder.columns)
+            .order_by(*self.cursor_columns)
+            .yield_per(current_app.config['EXPORT_FETCH_SIZE'])
+        )
+        if export_format == 'csv':
+            chunks = self.csv_chunks(rows)
+        else:
+            chunks = self.ndjson_chunks(rows)
+
+        response = Response(
+            stream_with_context(chunks), mimetype=self.formats[export_format]
+        )
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip']:
+            response.response = gzip_chunks(response.response)
+            response.content_encoding = 'gzip'
+        return response
+
+    def ndjson_chunks(self, rows):
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(self.encoder(row), sort_keys=True))
+            if len(lines) == current_app.config['EXPORT_FETCH_SIZE']:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    def csv_chunks(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.encoder.keys)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow(self.encoder(row).values())
+            if count % current_app.config['EXPORT_FETCH_SIZE'] == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(
+            chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+        )
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class TransactionBatchView(BaseView):
+    schema = TransactionView.schema
+    modes = ('atomic', 'best_effort')
+
+    def post(self):
+        """
+        file: ../flasgger/post_transactions_batch.yml
+        """
+        mode = self.query_string.get('mode', 'atomic')
+        if mode not in self.modes:
+            self.status_code = 400
+            return self.response({'error': 'Invalid value for mode'})
+
+        payloads = self.get_payloads()
+        if payloads is None:
+            self.status_code = 400
+            return self.response(
+                {'error': 'Expected a JSON array or NDJSON of transactions'}
+            )
+        if len(payloads) > current_app.config['TRANSACTION_BATCH_MAX_SIZE']:
+            self.status_code = 413
+            return self.response({'error': 'Too many transactions'})
+
+        items, errors = [], []
+        for payload in payloads:
+            try:
+                items.append(self.schema.load(payload))
+                errors.append(None)
+            except ValidationError as e:
+                items.append(None)
+                errors.append(e.normalized_messages())
+
+        unknown = find_unknown_customers(item for item in items if item)
+        for index, item in enumerate(items):
+            if item and customer_ids([item]) & unknown:
+                items[index] = None
+                errors[index] = {
+                    '_schema': ['Invalid identifier(s), customer(s) not found']
+                }
+
+        loaded = [item for item in items if item is not None]
+        if loaded and (mode == 'best_effort' or not any(errors)):
+            if current_app.config['ACCOUNTING_MODE'] == 'ledger':
+                apply = append_batch
+            else:
+                apply = transfer_batch
+            transfer_errors = iter(
+                apply(db.session, loaded, atomic=mode == 'atomic')
+            )
+            errors = [
+                next(transfer_errors) if item is not None else error
+                for item, error in zip(items, errors)
+            ]
+
+        rejected = mode == 'atomic' and any(errors)
+        results = []
+        for item, error in zip(items, errors):
+            if error:
+                results.append({'status': 400, 'error': error})
+            elif rejected:
+                results.append(
+                    {
+                        'status': 424,
+                        'error': 'Not applied, the batch has invalid items',
+                    }
+                )
+            else:
+                results.append(
+                    {'status': 201, 'transaction': self.schema.dump(item)}
+                )
+
+        if rejected:
+            db.session.rollback()
+            self.status_code = 400
+        else:
+            invalidate_customers(
+                db.session,
+                customer_ids(
+                    item
+                    for item, error in zip(items, errors)
+                    if item is not None and not error
+                ),
+            )
+            db.session.commit()
+            self.status_code = 201 if mode == 'atomic' else 200
+
+        return self.response({'results': results})
+
+    def get_payloads(self):
+        if request.mimetype == 'application/x-ndjson':
+            payloads = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    payloads.append(json.loads(line))
+                except ValueError:
+                    return None
+            return payloads
+
+        payloads = request.get_json(silent=True)
+        return payloads if isinstance(payloads, list) else None
@@ -0,0 +1,281 @@
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+from marshmallow import ValidationError
+from sqlalchemy import bindparam, case, insert, select, update
+
+from hypothesis.models import Customer, Transaction
+from hypothesis.slots import (
+    gather_slots,
+    lock_sharded_customers,
+    move_to_slot,
+    spread_balance,
+    takes_checkpoint,
+)
+from hypothesis.statements import record_daily_summaries
+
+customer_table = Customer.__table__
+transaction_table = Transaction.__table__
+
+CENTS = Decimal('0.01')
+INSERT_CHUNK_SIZE = 1000
+
+
+def to_amount(value):
+    """Round a value the same way Postgres stores it in a Numeric(14, 2)"""
+    return Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def lock_customers(session, ids, lock_slots=True):
+    """
+    Lock the customers rows for the rest of the database transaction and
+    return their balances and numbers of balance slots by identifier.
+
+    Rows are always locked in identifier order, so two transfers touching
+    the same customers (e.g. A to B and B to A) queue up instead of
+    deadlocking each other. Sharded customers rows are only locked in shared
+    mode, see hypothesis.slots.lock_sharded_customers for their balances.
+    """
+    balances, slots = {}, {}
+    while ids:
+        rows = session.execute(
+            select(customer_table.c.id, customer_table.c.balance)
+            .where(
+                customer_table.c.id.in_(ids),
+                customer_table.c.balance_slots == 0,
+            )
+            .order_by(customer_table.c.id)
+            .with_for_update(key_share=True)
+        )
+        for customer_id, balance in rows:
+            balances[customer_id], slots[customer_id] = balance, 0
+
+        missing = set(ids) - set(balances)
+        if not missing:
+            break
+
+        # Customers unsharded while waiting for the lock are locked again
+        ids = set()
+        sharded = lock_sharded_customers(session, missing, lock_slots)
+        for customer_id, (balance, count) in sharded.items():
+            if count:
+                balances[customer_id], slots[customer_id] = balance, count
+            else:
+                ids.add(customer_id)
+
+    return balances, slots
+
+
+def transfer(session, source_id, target_id, value):
+    """
+    Move value from source to target inside the current database
+    transaction and return both balances after the transfer, None for
+    sharded customers unless their slots were gathered, along with the
+    numbers of balance slots of the customers by identifier.
+
+    Balances are computed by Postgres in a single UPDATE guarded against
+    overdrafts, so concurrent transfers can't lose updates. Sharded
+    customers are updated one at a time, in identifier order, each in one
+    of their slots.
+    """
+    value = to_amount(value)
+
+    _, slots = lock_customers(
+        session, {source_id, target_id}, lock_slots=False
+    )
+    if len(slots) != 2:
+        raise ValidationError('Invalid identifier(s), customer(s) not found')
+
+    if any(slots.values()):
+        balances = {}
+        for customer_id in sorted(slots):
+            amount = -value if customer_id == source_id else value
+            if slots[customer_id]:
+                # Debits no slot covers alone gather them as well
+                if not takes_checkpoint() and move_to_slot(
+                    session, customer_id, amount
+                ):
+                    balances[customer_id] = None
+                    continue
+                balance = gather_slots(session, customer_id, amount)
+                if balance is not None:
+                    balances[customer_id] = balance
+                continue
+            balance = session.execute(
+                update(customer_table)
+                .where(
+                    customer_table.c.id == customer_id,
+                    customer_table.c.balance + amount >= 0,
+                )
+                .values(balance=customer_table.c.balance + amount)
+                .returning(customer_table.c.balance)
+            ).scalar()
+            if balance is not None:
+                balances[customer_id] = balance
+    else:
+        balances = dict(
+            session.execute(
+                update(customer_table)
+                .where(
+                    customer_table.c.id.in_((source_id, target_id)),
+                    (customer_table.c.id == target_id)
+                    | (customer_table.c.balance >= value),
+                )
+                .values(
+                    balance=customer_table.c.balance
+                    + case(
+                        (customer_table.c.id == source_id, -value),
+                        else_=value,
+                    )
+                )
+                .returning(customer_table.c.id, customer_table.c.balance)
+            ).all()
+        )
+
+    if source_id not in balances:
+        raise ValidationError('Insufficient funds')
+
+    return (balances[source_id], balances[target_id]), slots
+
+
+def create_transaction(session, data):
+    """
+    Apply the transfer of TransactionSchema loaded data and add the
+    transaction to the session, which must be committed afterwards.
+    """
+    data['value'] = to_amount(data['value'])
+    source_id, target_id = data['customer_source'], data['customer_target']
+    balances, slots = transfer(session, source_id, target_id, data['value'])
+    # Stamped while the customers are locked, so transactions sort by
+    # (datetime, id) in the order they were applied to each customer
+    data['datetime'] = datetime.now()
+    data['customer_source_value'], data['customer_target_value'] = balances
+    record_daily_summaries(session, [data], slots)
+
+    transaction = Transaction(**data)
+    session.add(transaction)
+    return transaction
+
+
+def transfer_batch(session, items, atomic=True):
+    """
+    Apply many transfers inside the current database transaction with a
+    single customers lookup, one balance update per customer and bulk
+    inserts, returning one error (or None when applied) per item.
+
+    Items are TransactionSchema loaded data, applied in order, they are
+    completed with the balances after each transfer, the datetime and the
+    transaction identifier. When atomic is set nothing is written if any
+    item fails.
+    """
+    balances, slots = lock_customers(
+        session,
+        {item['customer_source'] for item in items}
+        | {item['customer_target'] for item in items},
+    )
+    errors, applied, deltas = apply_balances(items, balances)
+
+    if not applied or (atomic and len(applied) != len(items)):
+        return errors
+
+    # Stamped while the customers are locked, as by single transfers. Every
+    # slot of the sharded ones is, their balances are exact too
+    moment = datetime.now()
+    for item in applied:
+        item['datetime'] = moment
+
+    write_balances(
+        session,
+        {customer_id: balances[customer_id] for customer_id in deltas},
+        slots,
+    )
+
+    insert_transactions(session, applied)
+    record_daily_summaries(session, applied, slots)
+    return errors
+
+
+def apply_balances(items, balances):
+    """
+    Apply the transfers of TransactionSchema loaded data to the balances by
+    identifier in order, completing each item with the balances after it.
+
+    Return one error (or None when applied) per item, the items applied and
+    the total change of each customer balance.
+    """
+    errors, applied, deltas = [], [], {}
+
+    for item in items:
+        source_id = item['customer_source']
+        target_id = item['customer_target']
+        value = item['value'] = to_amount(item['value'])
+
+        if source_id not in balances or target_id not in balances:
+            errors.append(
+                {'_schema': ['Invalid identifier(s), customer(s) not found']}
+            )
+            continue
+        if balances[source_id] < value:
+            errors.append({'_schema': ['Insufficient funds']})
+            continue
+
+        balances[source_id] -= value
+        balances[target_id] += value
+        deltas[source_id] = deltas.get(source_id, 0) - value
+        deltas[target_id] = deltas.get(target_id, 0) + value
+
+        item['customer_source_value'] = balances[source_id]
+        item['customer_target_value'] = balances[target_id]
+        applied.append(item)
+        errors.append(None)
+
+    return errors, applied, deltas
+
+
+def write_balances(session, balances, slots):
+    """
+    Set the balances of locked customers by identifier, spread on the slots
+    of the sharded ones.
+    """
+    for customer_id, balance in balances.items():
+        if slots[customer_id]:
+            spread_balance(session, customer_id, balance, slots[customer_id])
+
+    unsharded = [
+        {'customer_id': customer_id, 'customer_balance': balance}
+        for customer_id, balance in balances.items()
+        if not slots[customer_id]
+    ]
+    if unsharded:
+        session.execute(
+            update(customer_table)
+            .where(customer_table.c.id == bindparam('customer_id'))
+            .values(balance=bindparam('customer_balance')),
+            unsharded,
+        )
+
+
+def insert_transactions(session, items):
+    """
+    Insert TransactionSchema loaded data in chunks, setting the identifier
+    of each item.
+    """
+    columns = [column.name for column in transaction_table.columns]
+    for start in range(0, len(items), INSERT_CHUNK_SIZE):
+        chunk = items[start : start + INSERT_CHUNK_SIZE]
+        ids = session.execute(
+            insert(transaction_table)
+            .values(
+                [
+                    {
+                        column: item[column]
+                        for column in columns
+                        if column in item
+                    }
+                    for item in chunk
+                ]
+            )
+            .returning(transaction_table.c.id)
+        ).scalars()
+        for item, _id in zip(chunk, ids):
+            item['_id'] = _id
@@ -1,24 +1,69 @@
-import logging
-from datetime import datetime
+from datetime import timedelta
 
+from flask import (
+    Response,
+    abort,
+    current_app,
+    g,
+    jsonify,
+    make_response,
+    request,
+)
 from marshmallow.exceptions import ValidationError
-from sqlalchemy import Date, cast, or_
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 
-from hypothesis.commons import BaseView
-from hypothesis.factory import db
+from hypothesis.cache import (
+    customer_ids,
+    customer_key,
+    get_customer_cache,
+    invalidate_customers,
+)
+from hypothesis.commons import BaseView, decode_cursor, parse_date
+from hypothesis.customer_ids import find_unknown_customers
+from hypothesis.encoders import RowEncoder
+from hypothesis.etags import (
+    IMMUTABLE,
+    REVALIDATE,
+    counted_since,
+    get_ledger_state,
+    is_fresh,
+    make_etag,
+    not_modified,
+    set_cache_headers,
+    settled_before,
+)
+from hypothesis.factory import db, has_extension
+from hypothesis.group_commit import get_group_writer
+from hypothesis.idempotency import (
+    KEY_MAX_LENGTH,
+    StoredResponse,
+    claim_keys,
+    fingerprint,
+    get_response_cache,
+    get_responses,
+    store_response,
+    store_responses,
+)
+from hypothesis.ledger import append_transaction
 from hypothesis.models import Customer, Transaction
-from hypothesis.schemas import CustomerSchema, TransactionSchema
-
-logger = logging.getLogger(__name__)
+from hypothesis.schemas import (
+    CustomerSchema,
+    LedgerCustomerSchema,
+    TransactionSchema,
+)
+from hypothesis.transfers import create_transaction
 
 
 class TransactionView(BaseView):
+    model = Transaction
+    schema = TransactionSchema()
+    encoder = RowEncoder(schema, model)
+    cursor_columns = (Transaction.datetime, Transaction._id)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.model = Transaction
         self.query = self.model.query
-        self.schema = TransactionSchema()
 
     def get(self):
         """
@@ -26,55 +71,211 @@ class TransactionView(BaseView):
         """
         super().get()
 
-        if self.query_string.get('date'):
-            self.query = self.query.filter(
-                cast(self.model.datetime, Date)
-                == datetime.strptime(self.query_string['date'], '%Y-%m-%d')
+        self.query = self.filter_query(self.query)
+        if self.cursor is None:
+            # A page number always addresses the same transactions
+            self.query = self.query.order_by(*self.cursor_columns)
+
+        # Only ever sent for pages which can't change anymore
+        immutable_etag = make_etag()
+        if is_fresh(immutable_etag):
+            return not_modified(immutable_etag, IMMUTABLE)
+
+        ledger_state = None
+        if current_app.config['ACCOUNTING_MODE'] == 'ledger':
+            ledger_state = get_ledger_state(db.session)
+        settled = settled_before(ledger_state)
+
+        end = self.get_end()
+        if end is not None and end <= settled:
+            response, status_code = self.get_response()
+            set_cache_headers(response, immutable_etag, IMMUTABLE)
+            return response, status_code
+
+        # Read before the page, which is then at least as recent
+        etag = make_etag(self.get_version(), ledger_state and ledger_state[:2])
+        if is_fresh(etag):
+            return not_modified(etag, REVALIDATE)
+
+        if self.cursor is None:
+            response, status_code = self.get_response()
+        else:
+            page = self.get_keyset_page()
+            # Full pages of settled transactions are followed by them
+            # whatever is added
+            if (
+                page['has_more']
+                and decode_cursor(page['next'], self.cursor_columns)[0]
+                < settled
+            ):
+                etag = immutable_etag
+            response, status_code = self.response(page)
+        set_cache_headers(
+            response, etag, IMMUTABLE if etag == immutable_etag else REVALIDATE
+        )
+        return response, status_code
+
+    def get_end(self):
+        """Datetime the transactions of the filter are all before, if any"""
+        dates = [
+            self.get_argument(name, parse_date) for name in ('date', 'date_to')
+        ]
+        dates = [date for date in dates if date]
+        return min(dates) + timedelta(days=1) if dates else None
+
+    def get_version(self):
+        """
+        Identifiers of the transactions of a cursor page, or count of the
+        latest transactions of the filter, enough to tell whether the page
+        changed without loading it.
+        """
+        if self.cursor is not None:
+            query = self.get_keyset_query().with_entities(self.model._id)
+            return tuple(row[0] for row in query)
+        # Only grows while transactions are added, none is ever removed
+        since = counted_since()
+        count = (
+            self.query.filter(self.model.datetime > since)
+            .order_by(None)
+            .with_entities(func.count())
+            .scalar()
+        )
+        return since, count
+
+    def filter_query(self, query):
+        # Dates are compared as half-open ranges over datetime instead of
+        # casting it, so the indexes on datetime can be used
+        one_day = timedelta(days=1)
+        date = self.get_argument('date', parse_date)
+        if date:
+            query = query.filter(
+                self.model.datetime >= date,
+                self.model.datetime < date + one_day,
             )
-        if self.query_string.get('customer_id'):
-            self.query = self.query.filter(
-                or_(
-                    self.model.customer_source
-                    == self.query_string['customer_id'],
-                    self.model.customer_target
-                    == self.query_string['customer_id'],
-                )
+        date_from = self.get_argument('date_from', parse_date)
+        if date_from:
+            query = query.filter(self.model.datetime >= date_from)
+        date_to = self.get_argument('date_to', parse_date)
+        if date_to:
+            query = query.filter(self.model.datetime < date_to + one_day)
+
+        customer_id = self.get_argument('customer_id', int)
+        if customer_id is not None:
+            # A UNION ALL instead of an OR lets each side use its own index,
+            # a customer is never both source and target of a transaction
+            query = query.filter(
+                self.model.customer_source == customer_id
+            ).union_all(
+                query.filter(self.model.customer_target == customer_id)
             )
 
-        return self.get_response()
+        return query
 
     def post(self):
         """
         file: ../flasgger/post_transaction.yml
         """
+        key = request.headers.get('Idempotency-Key')
+        idempotency = cache = None
+        if key is not None:
+            if not 0 < len(key) <= KEY_MAX_LENGTH:
+                self.status_code = 400
+                return self.response(
+                    {'error': 'Invalid value for Idempotency-Key'}
+                )
+            idempotency = (key, fingerprint(request.get_json()))
+            cache = get_response_cache(current_app._get_current_object())
+            stored = cache.get(key)
+            if stored:
+                return self.replay(idempotency, stored)
+
         try:
             super().post()
+            if find_unknown_customers([self.data]):
+                raise ValidationError(
+                    'Invalid identifier(s), customer(s) not found'
+                )
 
-            source = self.data.pop('source_obj')
-            target = self.data.pop('target_obj')
-            source.balance = self.data['customer_source_value']
-            target.balance = self.data['customer_target_value']
-
-            transaction = Transaction(**self.data)
-
-            db.session.add(transaction)
-            db.session.commit()
+            if current_app.config['GROUP_COMMIT']:
+                # Answered once the writer has committed the whole group
+                writer = get_group_writer(current_app._get_current_object())
+                transaction = writer.submit(self.data, idempotency).result()
+            else:
+                transaction = self.create_transaction(idempotency)
         except ValidationError as e:
+            db.session.rollback()
             self.status_code = 400
-            response = {'error': e.args[0]}
-        else:
-            self.status_code = 201
-            response = self.schema.dump(transaction)
+            response = {'error': e.normalized_messages()}
+            if idempotency:
+                store_response(db.session, *idempotency, 400, response)
+                db.session.commit()
+            return self.response(response)
+
+        if isinstance(transaction, StoredResponse):
+            cache.put(key, transaction)
+            return self.replay(idempotency, transaction)
 
+        self.status_code = 201
+        response = self.schema.dump(transaction)
+        if idempotency:
+            cache.put(key, StoredResponse(idempotency[1], 201, response))
         return self.response(response)
 
+    def create_transaction(self, idempotency):
+        """
+        Make the transfer and commit it, return the StoredResponse of the
+        idempotency key instead when it was already used.
+        """
+        if idempotency:
+            key = idempotency[0]
+            # Waits for a request in flight with the same key to be done
+            if not claim_keys(db.session, dict([idempotency])):
+                stored = get_responses(db.session, [key])[key]
+                db.session.commit()
+                return stored
+
+        if current_app.config['ACCOUNTING_MODE'] == 'ledger':
+            transaction = append_transaction(db.session, self.data)
+        else:
+            transaction = create_transaction(db.session, self.data)
+            db.session.flush()
+
+        if idempotency:
+            store_responses(
+                db.session, {key: (201, self.schema.dump(transaction))}
+            )
+        invalidate_customers(db.session, customer_ids([self.data]))
+        db.session.commit()
+        return transaction
+
+    def replay(self, idempotency, stored):
+        if stored.fingerprint != idempotency[1]:
+            self.status_code = 422
+            return self.response(
+                {'error': 'Idempotency-Key already used by another request'}
+            )
+
+        self.status_code = stored.status_code
+        response, status_code = self.response(stored.response)
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, status_code
+
 
 class CustomerView(BaseView):
+    model = Customer
+    schema = CustomerSchema()
+    encoder = RowEncoder(schema, model)
+    ledger_schema = LedgerCustomerSchema()
+    ledger_encoder = RowEncoder(ledger_schema, model)
+    cursor_columns = (Customer._id,)
+    name_matches = ('prefix', 'contains', 'fuzzy')
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.model = Customer
         self.query = self.model.query
-        self.schema = CustomerSchema()
+        # Only ledger accounting mode reads the ledger entries
+        if current_app.config['ACCOUNTING_MODE'] == 'ledger':
+            self.schema, self.encoder = self.ledger_schema, self.ledger_encoder
 
     def get(self):
         """
@@ -82,15 +283,86 @@ class CustomerView(BaseView):
         """
         super().get()
 
+        match = self.query_string.get('match', 'contains')
+        if match not in self.name_matches:
+            abort(make_response(jsonify(error='Invalid value for match'), 400))
+
+        key = self.get_cache_key()
+        cache = key and get_customer_cache(current_app._get_current_object())
+        if cache:
+            return self.get_cached(cache, key)
+
         if self.query_string.get('id'):
             self.query = self.query.filter_by(_id=self.query_string['id'])
         elif self.query_string.get('name'):
-            self.query = self.query.filter(
-                Customer.name.contains(self.query_string['name'])
-            )
+            self.query = self.filter_by_name(self.query_string['name'], match)
 
         return self.get_response()
 
+    def get_cache_key(self):
+        """
+        Key of the response in the customer cache, None when it can't be
+        cached. Only the first page of lookups by id is, the arguments it
+        ignores left out.
+        """
+        customer_id = self.query_string.get('id', '')
+        if (
+            not customer_id.isascii()
+            or not customer_id.isdigit()
+            or self.query_string.get('page', '1') != '1'
+            or 'after' in self.query_string
+        ):
+            return None
+        return customer_key(int(customer_id))
+
+    def get_cached(self, cache, key):
+        body, token = cache.get(key)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+        # A replica behind the primary would cache a balance already
+        # invalidated
+        g.pop('replica', None)
+        rows = (
+            self.query.with_entities(*self.encoder.columns)
+            .filter_by(_id=int(self.query_string['id']))
+            .all()
+        )
+        response, status_code = self.response(
+            [self.encoder(row) for row in rows]
+        )
+        # Customers created later have nothing to invalidate, so unknown
+        # ones aren't cached
+        if rows:
+            cache.put(key, response.get_data(), token)
+        return response, status_code
+
+    def filter_by_name(self, name, match):
+        if match == 'prefix':
+            return self.query.filter(
+                self.model.name.startswith(name, autoescape=True)
+            )
+
+        if match == 'fuzzy' and has_extension('pg_trgm'):
+            if self.cursor is not None:
+                error = 'Cursor pagination is not supported by fuzzy match'
+                abort(make_response(jsonify(error=error), 400))
+            return self.query.filter(self.model.name.op('%')(name)).order_by(
+                func.similarity(self.model.name, name).desc(), self.model._id
+            )
+
+        # Without pg_trgm fuzzy falls back to a case insensitive contains
+        if match == 'fuzzy':
+            return self.query.filter(
+                func.lower(self.model.name).contains(
+                    name.lower(), autoescape=True
+                )
+            )
+
+        return self.query.filter(
+            self.model.name.contains(name, autoescape=True)
+        )
+
     def post(self):
         """
         file: ../flasgger/post_customer.yml
@@ -0,0 +1,76 @@
+"""add customer daily summary
+
+Revision ID: 3b7e6c1d0a52
+Revises: 9a4d3f6b2e18
+Create Date: 2026-10-18 11:12:40.318562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7e6c1d0a52'
+down_revision = '9a4d3f6b2e18'
+branch_labels = None
+depends_on = None
+
+# Same as hypothesis.statements.REBUILD_SUMMARIES, copied so the migration
+# doesn't change with the application code
+BACKFILL_SUMMARIES = '''
+    INSERT INTO customer_daily_summary (
+        customer_id, day, debit_total, debit_count, credit_total,
+        credit_count, closing_balance
+    )
+    SELECT DISTINCT ON (customer_id, day)
+        customer_id,
+        day,
+        coalesce(sum(debit) OVER days, 0),
+        count(debit) OVER days,
+        coalesce(sum(credit) OVER days, 0),
+        count(credit) OVER days,
+        first_value(balance) OVER (days ORDER BY datetime DESC, id DESC)
+    FROM (
+        SELECT
+            customer_source AS customer_id, datetime::date AS day,
+            value AS debit, NULL::numeric AS credit,
+            customer_source_value AS balance, datetime, id
+        FROM transaction
+        UNION ALL
+        SELECT
+            customer_target, datetime::date,
+            NULL, value,
+            customer_target_value, datetime, id
+        FROM transaction
+    ) entries
+    WINDOW days AS (PARTITION BY customer_id, day)
+    ORDER BY customer_id, day
+'''
+
+
+def upgrade():
+    op.create_table(
+        'customer_daily_summary',
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column(
+            'debit_total', sa.Numeric(precision=14, scale=2), nullable=False
+        ),
+        sa.Column('debit_count', sa.Integer(), nullable=False),
+        sa.Column(
+            'credit_total', sa.Numeric(precision=14, scale=2), nullable=False
+        ),
+        sa.Column('credit_count', sa.Integer(), nullable=False),
+        sa.Column(
+            'closing_balance',
+            sa.Numeric(precision=14, scale=2),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(['customer_id'], ['customer.id']),
+        sa.PrimaryKeyConstraint('customer_id', 'day'),
+    )
+    op.execute(BACKFILL_SUMMARIES)
+
+
+def downgrade():
+    op.drop_table('customer_daily_summary')
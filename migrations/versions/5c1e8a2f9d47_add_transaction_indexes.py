@@ -0,0 +1,44 @@
+"""add transaction indexes for date and customer filters
+
+Revision ID: 5c1e8a2f9d47
+Revises: 744f49fc148c
+Create Date: 2026-10-18 09:12:41.327906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a2f9d47'
+down_revision = '744f49fc148c'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_transaction_datetime': ['datetime'],
+    'ix_transaction_customer_source_datetime': ['customer_source', 'datetime'],
+    'ix_transaction_customer_target_datetime': ['customer_target', 'datetime'],
+}
+
+
+def upgrade():
+    # Built concurrently so the table keeps accepting transactions meanwhile
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(
+                name,
+                'transaction',
+                columns,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(
+                name,
+                table_name='transaction',
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,91 @@
+"""partition transaction by month
+
+Revision ID: 6e2a9b4c8f13
+Revises: d41f7a9c3e65
+Create Date: 2026-10-18 12:26:51.904417
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2a9b4c8f13'
+down_revision = 'd41f7a9c3e65'
+branch_labels = None
+depends_on = None
+
+# Partitions created from the current month on, as many as flask
+# partitions create has by default, which creates the later ones
+MONTHS_AHEAD = 3
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_new_table(definition):
+    # Writes are blocked until the new table is swapped in, reads are not
+    op.execute('LOCK TABLE transaction IN EXCLUSIVE MODE')
+    op.execute(f'CREATE TABLE transaction_new {definition}')
+
+
+def swap_new_table(primary_key):
+    """
+    Copy every transaction to the new table and put it in place of the
+    current one, keeping the identifiers sequence.
+    """
+    op.execute('INSERT INTO transaction_new SELECT * FROM transaction')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY NONE')
+    op.execute('DROP TABLE transaction')
+    op.execute('ALTER TABLE transaction_new RENAME TO transaction')
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY transaction.id')
+
+    op.create_primary_key('transaction_pkey', 'transaction', primary_key)
+    for column in ('customer_source', 'customer_target'):
+        op.create_foreign_key(
+            f'transaction_{column}_fkey',
+            'transaction',
+            'customer',
+            [column],
+            ['id'],
+        )
+        op.create_index(
+            f'ix_transaction_{column}_balance',
+            'transaction',
+            [column, 'datetime', 'id'],
+            postgresql_include=[f'{column}_value', 'value'],
+        )
+    op.create_index('ix_transaction_datetime', 'transaction', ['datetime'])
+
+
+def upgrade():
+    create_new_table(
+        '(LIKE transaction INCLUDING DEFAULTS) PARTITION BY RANGE (datetime)'
+    )
+
+    first = op.get_bind().execute(
+        sa.text('SELECT min(datetime) FROM transaction')
+    ).scalar()
+    current = date.today().replace(day=1)
+    month = first.date().replace(day=1) if first else current
+    while month < add_months(current, MONTHS_AHEAD):
+        op.execute(
+            f'CREATE TABLE transaction_y{month.year}m{month.month:02} '
+            'PARTITION OF transaction_new '
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        )
+        month = add_months(month, 1)
+    op.execute(
+        'CREATE TABLE transaction_default PARTITION OF transaction_new DEFAULT'
+    )
+
+    swap_new_table(['id', 'datetime'])
+
+
+def downgrade():
+    create_new_table('(LIKE transaction INCLUDING DEFAULTS)')
+    swap_new_table(['id'])
@@ -0,0 +1,65 @@
+"""add customer name search indexes
+
+Revision ID: 9a4d3f6b2e18
+Revises: 5c1e8a2f9d47
+Create Date: 2026-10-18 10:03:15.870214
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4d3f6b2e18'
+down_revision = '5c1e8a2f9d47'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_customer_name_pattern',
+            'customer',
+            ['name'],
+            postgresql_ops={'name': 'varchar_pattern_ops'},
+            postgresql_concurrently=True,
+        )
+
+        connection = op.get_bind()
+        available = connection.execute(
+            sa.text(
+                "SELECT exists(SELECT 1 FROM pg_available_extensions "
+                "WHERE name = 'pg_trgm')"
+            )
+        ).scalar()
+        if not available:
+            logger.warning(
+                'pg_trgm is not available, customer name searches will not '
+                'be indexed for contains and fuzzy matches'
+            )
+            return
+
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index(
+            'ix_customer_name_trgm',
+            'customer',
+            ['name'],
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'},
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_customer_name_trgm')
+        op.drop_index(
+            'ix_customer_name_pattern',
+            table_name='customer',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,51 @@
+"""add idempotency keys of transfers
+
+Revision ID: a7d2e4f6b913
+Revises: f5a1c9e3b742
+Create Date: 2026-10-18 16:12:09.402113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2e4f6b913'
+down_revision = 'f5a1c9e3b742'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_key',
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column(
+            'response',
+            postgresql.JSONB(astext_type=sa.Text()),
+            nullable=True,
+        ),
+        sa.Column(
+            'created_at',
+            sa.DateTime(),
+            server_default=sa.text('now()'),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint('key'),
+    )
+    op.create_index(
+        op.f('ix_idempotency_key_created_at'),
+        'idempotency_key',
+        ['created_at'],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f('ix_idempotency_key_created_at'), table_name='idempotency_key'
+    )
+    op.drop_table('idempotency_key')
@@ -0,0 +1,47 @@
+"""add ledger entry for the ledger accounting mode
+
+Revision ID: b8c3d5e7f021
+Revises: 6e2a9b4c8f13
+Create Date: 2026-10-18 13:34:18.207653
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8c3d5e7f021'
+down_revision = '6e2a9b4c8f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ledger_entry',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.Column('datetime', sa.DateTime(), nullable=False),
+        sa.Column(
+            'amount', sa.Numeric(precision=14, scale=2), nullable=False
+        ),
+        sa.ForeignKeyConstraint(['customer_id'], ['customer.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_ledger_entry_customer_id',
+        'ledger_entry',
+        ['customer_id'],
+        postgresql_include=['amount'],
+    )
+    for column in ('customer_source_value', 'customer_target_value'):
+        op.alter_column('transaction', column, nullable=True)
+
+
+def downgrade():
+    # Pending entries must be compacted first, with flask ledger compact
+    for column in ('customer_source_value', 'customer_target_value'):
+        op.alter_column('transaction', column, nullable=False)
+    op.drop_index('ix_ledger_entry_customer_id', table_name='ledger_entry')
+    op.drop_table('ledger_entry')
@@ -0,0 +1,45 @@
+"""notify the identifiers of the customers created
+
+Revision ID: c3f8e1a5d294
+Revises: a7d2e4f6b913
+Create Date: 2026-10-18 18:41:27.530918
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f8e1a5d294'
+down_revision = 'a7d2e4f6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        '''
+        CREATE OR REPLACE FUNCTION notify_customer_ids() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('customer_ids', string_agg(id::text, ','))
+            FROM (
+                SELECT id, (row_number() OVER (ORDER BY id) - 1) / 500 AS chunk
+                FROM created_customer
+            ) AS created
+            GROUP BY chunk;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        '''
+    )
+    op.execute(
+        '''
+        CREATE TRIGGER customer_ids AFTER INSERT ON customer
+        REFERENCING NEW TABLE AS created_customer
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_customer_ids()
+        '''
+    )
+
+
+def downgrade():
+    op.execute('DROP TRIGGER customer_ids ON customer')
+    op.execute('DROP FUNCTION notify_customer_ids()')
@@ -0,0 +1,62 @@
+"""add covering transaction indexes for balance lookups
+
+Revision ID: d41f7a9c3e65
+Revises: 3b7e6c1d0a52
+Create Date: 2026-10-18 11:48:07.512930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f7a9c3e65'
+down_revision = '3b7e6c1d0a52'
+branch_labels = None
+depends_on = None
+
+# The customer indexes are replaced by covering ones, which serve the same
+# customer and date filters
+INDEXES = {
+    'customer_source': (
+        'ix_transaction_customer_source_datetime',
+        'ix_transaction_customer_source_balance',
+    ),
+    'customer_target': (
+        'ix_transaction_customer_target_datetime',
+        'ix_transaction_customer_target_balance',
+    ),
+}
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for column, (old_name, name) in INDEXES.items():
+            op.create_index(
+                name,
+                'transaction',
+                [column, 'datetime', 'id'],
+                postgresql_include=[f'{column}_value', 'value'],
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                old_name,
+                table_name='transaction',
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column, (old_name, name) in INDEXES.items():
+            op.create_index(
+                old_name,
+                'transaction',
+                [column, 'datetime'],
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                name,
+                table_name='transaction',
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,57 @@
+"""drop the closing balances of the daily summaries
+
+Revision ID: e7b2d9c4f156
+Revises: c3f8e1a5d294
+Create Date: 2026-10-18 20:05:44.218730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2d9c4f156'
+down_revision = 'c3f8e1a5d294'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_column('customer_daily_summary', 'closing_at')
+    op.drop_column('customer_daily_summary', 'closing_balance')
+
+
+def downgrade():
+    op.add_column(
+        'customer_daily_summary',
+        sa.Column(
+            'closing_balance',
+            sa.Numeric(precision=14, scale=2),
+            nullable=True,
+        ),
+    )
+    op.add_column(
+        'customer_daily_summary',
+        sa.Column('closing_at', sa.DateTime(), nullable=True),
+    )
+    # The balance of the customer less the changes of the days after
+    op.execute(
+        '''
+        UPDATE customer_daily_summary s SET
+            closing_balance = c.balance + (
+                SELECT coalesce(sum(balance), 0) FROM customer_balance_slot
+                WHERE customer_id = s.customer_id
+            ) - (
+                SELECT coalesce(sum(credit_total - debit_total), 0)
+                FROM customer_daily_summary l
+                WHERE l.customer_id = s.customer_id AND l.day > s.day
+            ),
+            closing_at = s.day + interval '1 day' - interval '1 microsecond'
+        FROM customer c
+        WHERE c.id = s.customer_id
+        '''
+    )
+    op.alter_column(
+        'customer_daily_summary', 'closing_balance', nullable=False
+    )
+    op.alter_column('customer_daily_summary', 'closing_at', nullable=False)
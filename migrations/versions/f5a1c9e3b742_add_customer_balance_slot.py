@@ -0,0 +1,110 @@
+"""add customer balance slots
+
+Revision ID: f5a1c9e3b742
+Revises: b8c3d5e7f021
+Create Date: 2026-10-18 14:41:36.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a1c9e3b742'
+down_revision = 'b8c3d5e7f021'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'customer',
+        sa.Column(
+            'balance_slots', sa.Integer(), server_default='0', nullable=False
+        ),
+    )
+    op.create_table(
+        'customer_balance_slot',
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('slot', sa.Integer(), nullable=False),
+        sa.Column(
+            'balance', sa.Numeric(precision=14, scale=2), nullable=False
+        ),
+        sa.ForeignKeyConstraint(['customer_id'], ['customer.id']),
+        sa.PrimaryKeyConstraint('customer_id', 'slot'),
+    )
+
+    # Days of sharded customers are spread on one summary row per slot
+    op.add_column(
+        'customer_daily_summary',
+        sa.Column('slot', sa.Integer(), server_default='0', nullable=False),
+    )
+    op.add_column(
+        'customer_daily_summary',
+        sa.Column('closing_at', sa.DateTime(), nullable=True),
+    )
+    op.execute(
+        '''
+        UPDATE customer_daily_summary s SET closing_at = coalesce((
+            SELECT max(datetime) FROM transaction t
+            WHERE t.datetime >= s.day AND t.datetime < s.day + 1
+                AND s.customer_id IN (t.customer_source, t.customer_target)
+        ), s.day)
+        '''
+    )
+    op.alter_column('customer_daily_summary', 'closing_at', nullable=False)
+    op.drop_constraint('customer_daily_summary_pkey', 'customer_daily_summary')
+    op.create_primary_key(
+        'customer_daily_summary_pkey',
+        'customer_daily_summary',
+        ['customer_id', 'day', 'slot'],
+    )
+
+
+def downgrade():
+    # Days spread on many summary rows are merged back into one
+    op.execute(
+        '''
+        WITH merged AS (
+            DELETE FROM customer_daily_summary
+            WHERE (customer_id, day) IN (
+                SELECT customer_id, day FROM customer_daily_summary
+                GROUP BY customer_id, day HAVING count(*) > 1
+            )
+            RETURNING *
+        )
+        INSERT INTO customer_daily_summary (
+            customer_id, day, slot, debit_total, debit_count, credit_total,
+            credit_count, closing_balance, closing_at
+        )
+        SELECT
+            customer_id, day, 0, sum(debit_total), sum(debit_count),
+            sum(credit_total), sum(credit_count),
+            (array_agg(closing_balance ORDER BY closing_at DESC))[1],
+            max(closing_at)
+        FROM merged
+        GROUP BY customer_id, day
+        '''
+    )
+    op.drop_constraint('customer_daily_summary_pkey', 'customer_daily_summary')
+    op.create_primary_key(
+        'customer_daily_summary_pkey',
+        'customer_daily_summary',
+        ['customer_id', 'day'],
+    )
+    op.drop_column('customer_daily_summary', 'closing_at')
+    op.drop_column('customer_daily_summary', 'slot')
+
+    # Balances go back to the customers rows before dropping the slots
+    op.execute(
+        '''
+        UPDATE customer c SET balance = c.balance + s.balance
+        FROM (
+            SELECT customer_id, sum(balance) AS balance
+            FROM customer_balance_slot GROUP BY customer_id
+        ) s
+        WHERE c.id = s.customer_id
+        '''
+    )
+    op.drop_table('customer_balance_slot')
+    op.drop_column('customer', 'balance_slots')